@@ -1,65 +1,57 @@
-import json
-import resources
-from services import user_service, cloth_service, weather_service, coord_service, tryon_service
+import router
+from utils import tracing
+
+# ルート定義 ((method, path) -> 'module:function')。サービスモジュールは初回呼び出し時に import される
+app = router.Router()
+app.add('POST', '/users', 'services.user_service:register_user', with_context=True)
+app.add('GET', '/users', 'services.user_service:get_user')
+
+app.add('POST', '/clothes', 'services.cloth_service:register_cloth', with_context=True)
+app.add('GET', '/clothes', 'services.cloth_service:get_clothes')
+app.add('PUT', '/clothes', 'services.cloth_service:update_cloth', with_context=True)
+app.add('DELETE', '/clothes', 'services.cloth_service:delete_cloth')
+app.add('POST', '/upload-url', 'services.cloth_service:get_upload_url')
+app.add('POST', '/analyze', 'services.cloth_service:analyze_cloth')
+
+app.add('POST', '/weather', 'services.weather_service:get_weather')
+
+app.add('POST', '/coordinates', 'services.coord_service:start_create_coordinate', with_context=True)
+app.add('GET', '/coordinates', 'services.coord_service:get_history')
+# ★追加: コーデ状況確認
+app.add('GET', '/coordinates/status', 'services.coord_service:check_status')
+
+app.add('POST', '/try-on', 'services.tryon_service:start_try_on', with_context=True)
+app.add('GET', '/try-on', 'services.tryon_service:check_try_on')
+
+app.add_timing_hook(tracing.route_hook)
+
+# 非同期ワーカー (task名 -> 'module:function')
+TASKS = {
+    'try_on_worker': router.lazy('services.tryon_service:worker'),
+    'coord_worker': router.lazy('services.coord_service:worker'),
+    'weather_batch': router.lazy('services.weather_service:prewarm_worker'),
+    'derivative_worker': router.lazy('services.image_service:derivative_worker'),
+    'coord_batch': router.lazy('services.coord_service:precompute_worker'),
+    'batch_submit': router.lazy('services.batch_service:submit_worker'),
+    'batch_poll': router.lazy('services.batch_service:poll_worker'),
+}
+# context (残り時間・関数名) を受け取るタスク
+TASKS_WITH_CONTEXT = {'coord_batch', 'batch_submit', 'batch_poll'}
 
 def handler(event, context):
-    try:
-        resources.initialize()
-    except Exception as e:
-        return {"statusCode": 500, "headers": {}, "body": json.dumps({"message": "Init Error", "error": str(e)})}
+    # リソース(AWS/AIクライアント)は resources 側で初回アクセス時に遅延生成される
 
     # 非同期ワーカー分岐
     if not event.get('httpMethod'):
-        task = event.get('task')
-        if task == 'try_on_worker':
-            return tryon_service.worker(event)
-        if task == 'coord_worker': # ★追加
-            return coord_service.worker(event)
-
-    headers = {
-        "Access-Control-Allow-Origin": "*",
-        "Access-Control-Allow-Headers": "Content-Type",
-        "Access-Control-Allow-Methods": "OPTIONS,POST,GET,PUT,DELETE"
-    }
-
-    if event['httpMethod'] == 'OPTIONS':
-        return {"statusCode": 200, "headers": headers, "body": ""}
-
-    path = event['path']
-    method = event['httpMethod']
-
-    if path == '/users':
-        if method == 'POST': return user_service.register_user(event, headers)
-        if method == 'GET': return user_service.get_user(event, headers)
-
-    if path == '/clothes':
-        if method == 'POST': return cloth_service.register_cloth(event, headers)
-        if method == 'GET': return cloth_service.get_clothes(event, headers)
-        if method == 'PUT': return cloth_service.update_cloth(event, headers)
-        if method == 'DELETE': return cloth_service.delete_cloth(event, headers)
-
-    if path == '/upload-url' and method == 'POST':
-        return cloth_service.get_upload_url(event, headers)
-
-    if path == '/analyze' and method == 'POST':
-        return cloth_service.analyze_cloth(event, headers)
-
-    if path == '/weather' and method == 'POST':
-        return weather_service.get_weather(event, headers)
-
-    if path == '/coordinates':
-        if method == 'POST': return coord_service.start_create_coordinate(event, headers, context) # ★変更
-        if method == 'GET': return coord_service.get_history(event, headers)
-
-    # ★追加: コーデ状況確認
-    if path == '/coordinates/status':
-        if method == 'GET': return coord_service.check_status(event, headers)
-
-    if path == '/try-on':
-        if method == 'POST': return tryon_service.start_try_on(event, headers, context)
-        if method == 'GET': return tryon_service.check_try_on(event, headers)
-
-    return {"statusCode": 404, "headers": headers, "body": json.dumps({"message": "Not Found"})}
+        task = TASKS.get(event.get('task'))
+        if task:
+            with tracing.trace(event['task'], jobId=event.get('jobId')):
+                return task(event, context) if event['task'] in TASKS_WITH_CONTEXT else task(event)
+        return None
+
+    # Operation はルート解決後に route_hook でパターン単位に置き換わる (未登録パスは '<method> *')
+    with tracing.trace(f"{event['httpMethod']} *"):
+        return app.dispatch(event, context)
 
 
 
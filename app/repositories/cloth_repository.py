@@ -0,0 +1,124 @@
+import time
+from boto3.dynamodb.conditions import Key, Attr
+import resources
+from repositories import pagination
+
+KEY_FIELDS = ('userId', 'clothId')
+BATCH_GET_SIZE = 100
+
+# 有効な服 (deleteFlag=0) だけが載るスパースGSI。
+# activeCategory は有効な行にのみ '<category>#<ゼロ埋めした clothId>' を持ち、論理削除時に REMOVE される。
+# (カテゴリ順、同じカテゴリ内は clothId = 登録順に並ぶ。カテゴリの絞り込みは前方一致)
+ACTIVE_INDEX = 'ActiveCategoryIndex'
+ACTIVE_INDEX_KEY_FIELDS = ('userId', 'clothId', 'activeCategory')
+# category が無い行もインデックスに載せるための値
+UNCATEGORIZED = '未分類'
+# activeCategory 内の clothId の桁数 (文字列の並びを数値順に揃える)
+CLOTH_ID_DIGITS = 15
+
+# ClothTable の読み出しをまとめたモジュール。
+# query は1回あたり最大1MBで打ち切られるため、LastEvaluatedKey を辿って全ページを返す。
+
+def active_category(item):
+    """書き込み時に設定する activeCategory の値 (item には clothId が必要)"""
+    return f"{item.get('category') or UNCATEGORIZED}#{int(item['clothId']):0{CLOTH_ID_DIGITS}d}"
+
+def _projection_args(fields):
+    # size など予約語と衝突する属性名があるため、常にプレースホルダー経由で指定する
+    names = {f"#p{i}": f for i, f in enumerate(fields)}
+    return {'ProjectionExpression': ', '.join(names), 'ExpressionAttributeNames': names}
+
+def _query_kwargs(user_id, projection, active_only, category):
+    if active_only:
+        # 有効な服は GSI から読む (論理削除済みの過去バージョンは読み出し自体が発生しない)
+        key_cond = Key('userId').eq(user_id)
+        if category:
+            key_cond = key_cond & Key('activeCategory').begins_with(f"{category}#")
+        kwargs = {'IndexName': ACTIVE_INDEX, 'KeyConditionExpression': key_cond}
+    else:
+        kwargs = {'KeyConditionExpression': Key('userId').eq(user_id)}
+        if category:
+            kwargs['FilterExpression'] = Attr('category').eq(category)
+    if projection:
+        kwargs.update(_projection_args(projection))
+    return kwargs
+
+def iter_clothes(user_id, projection=None, active_only=False, category=None):
+    """ユーザーの服を全ページ分ストリームで返すジェネレータ
+
+    projection: 取得する属性名のリスト (None なら全属性)
+    active_only: 有効な服 (deleteFlag=0) のみ。スパースGSI経由で読む
+    category: 指定カテゴリのみに絞る
+    """
+    return pagination.iter_query(resources.cloth_table, _query_kwargs(user_id, projection, active_only, category))
+
+def page_clothes(user_id, limit, start_key=None, projection=None, active_only=False, category=None):
+    """1ページ分 (最大 limit 件) の服と、次ページの開始キーを返す"""
+    key_fields = ACTIVE_INDEX_KEY_FIELDS if active_only else KEY_FIELDS
+    if projection:
+        projection = list(dict.fromkeys([*key_fields, *projection]))
+    kwargs = _query_kwargs(user_id, projection, active_only, category)
+    return pagination.query_page(resources.cloth_table, kwargs, limit, key_fields, start_key=start_key)
+
+def batch_get_clothes(user_id, cloth_ids, projection=None):
+    """指定IDの服を BatchGetItem でまとめて取得し、clothId -> item の辞書で返す"""
+    ids = list(dict.fromkeys(int(cid) for cid in cloth_ids))
+    found = {}
+    table_name = resources.cloth_table.name
+    for i in range(0, len(ids), BATCH_GET_SIZE):
+        request = {'Keys': [{'userId': user_id, 'clothId': cid} for cid in ids[i:i + BATCH_GET_SIZE]]}
+        if projection:
+            request.update(_projection_args(list(dict.fromkeys([*KEY_FIELDS, *projection]))))
+        pending = {table_name: request}
+        for attempt in range(5):
+            resp = resources.dynamodb.batch_get_item(RequestItems=pending)
+            for item in resp.get('Responses', {}).get(table_name, []):
+                found[int(item['clothId'])] = item
+            pending = resp.get('UnprocessedKeys') or {}
+            if not pending:
+                break
+            # スロットリング時は少し待って未処理分のみ再送
+            time.sleep(0.05 * (2 ** attempt))
+        else:
+            raise Exception("BatchGetItem: unprocessed keys remain")
+    return found
+
+def set_image_variants(user_id, cloth_id, image_url, variants):
+    """作成済みの派生画像サイズを記録する。行の画像が変わっていれば (または行が無ければ) False"""
+    try:
+        resources.cloth_table.update_item(
+            Key={'userId': user_id, 'clothId': int(cloth_id)},
+            UpdateExpression='set imageVariants = :v',
+            ConditionExpression=Attr('imageUrl').eq(image_url),
+            ExpressionAttributeValues={':v': variants}
+        )
+        return True
+    except resources.cloth_table.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+
+def apply_analysis(user_id, cloth_id, attrs, overwrite=False):
+    """画像解析の結果を有効な服の行に書き込む。overwrite=False なら未設定の属性のみ。
+
+    行が無い・論理削除済み (解析中に更新/削除された) なら False
+    """
+    item = resources.cloth_table.get_item(Key={'userId': user_id, 'clothId': int(cloth_id)}).get('Item')
+    if not item or item.get('deleteFlag', 0) != 0:
+        return False
+    if not overwrite:
+        attrs = {k: v for k, v in attrs.items() if item.get(k) in (None, '', [])}
+    if not attrs:
+        return True
+    if 'category' in attrs:
+        attrs['activeCategory'] = active_category({'category': attrs['category'], 'clothId': cloth_id})
+    names = {f"#a{i}": k for i, k in enumerate(attrs)}
+    try:
+        resources.cloth_table.update_item(
+            Key={'userId': user_id, 'clothId': int(cloth_id)},
+            UpdateExpression='set ' + ', '.join(f"{n} = :a{i}" for i, n in enumerate(names)),
+            ConditionExpression=Attr('deleteFlag').eq(0),
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues={f":a{i}": v for i, v in enumerate(attrs.values())}
+        )
+        return True
+    except resources.cloth_table.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
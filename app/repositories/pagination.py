@@ -0,0 +1,85 @@
+import json
+import base64
+from decimal import Decimal
+
+# API の limit/cursor によるページング共通処理。
+# cursor は DynamoDB の ExclusiveStartKey (と呼び出し側の付加情報) を base64url した不透明な文字列。
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+class CursorError(ValueError):
+    pass
+
+def _plain(value):
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    raise TypeError(f"Unsupported cursor value: {value!r}")
+
+def encode_cursor(key, **extra):
+    if not key:
+        return None
+    payload = json.dumps({'k': key, **extra}, default=_plain, ensure_ascii=False, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """cursor を (開始キー, 付加情報) に戻す。不正な値は CursorError"""
+    if not cursor:
+        return None, {}
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+        key = data.pop('k')
+        if not isinstance(key, dict):
+            raise ValueError
+        return key, data
+    except Exception:
+        raise CursorError("Invalid cursor")
+
+def parse_page_params(params):
+    """クエリパラメータから (limit, cursor) を取り出す。どちらも無ければ (None, None) = ページングなし"""
+    limit, cursor = params.get('limit'), params.get('cursor')
+    if limit is None and cursor is None:
+        return None, None
+    try:
+        limit = int(limit) if limit is not None else DEFAULT_LIMIT
+    except ValueError:
+        raise CursorError("limit must be an integer")
+    if limit < 1:
+        raise CursorError("limit must be positive")
+    return min(limit, MAX_LIMIT), cursor
+
+def iter_query(table, query_kwargs):
+    """LastEvaluatedKey を辿って query の全ページの行を返すジェネレータ"""
+    kwargs = dict(query_kwargs)
+    while True:
+        resp = table.query(**kwargs)
+        yield from resp.get('Items', [])
+        last_key = resp.get('LastEvaluatedKey')
+        if not last_key:
+            return
+        kwargs['ExclusiveStartKey'] = last_key
+
+def query_page(table, query_kwargs, limit, key_fields, start_key=None, accept=None):
+    """query 結果から条件に合う最大 limit 件を集め、(items, 次ページの開始キー) を返す
+
+    FilterExpression や accept(item) で除外される行があっても limit 件に達するまで
+    ページを辿る。途中で打ち切った場合は最後に返した行のキー (key_fields) を次の開始キーにする。
+    """
+    kwargs = dict(query_kwargs)
+    if start_key:
+        kwargs['ExclusiveStartKey'] = start_key
+    items = []
+    while True:
+        kwargs['Limit'] = limit - len(items) if accept is None and 'FilterExpression' not in kwargs else max(limit, 25)
+        resp = table.query(**kwargs)
+        for item in resp.get('Items', []):
+            if accept and not accept(item):
+                continue
+            items.append(item)
+            if len(items) == limit:
+                return items, {f: item[f] for f in key_fields}
+        last_key = resp.get('LastEvaluatedKey')
+        if not last_key:
+            return items, None
+        kwargs['ExclusiveStartKey'] = last_key
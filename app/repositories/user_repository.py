@@ -0,0 +1,110 @@
+from boto3.dynamodb.conditions import Key, Attr
+import resources
+
+# UserTable の読み書きをまとめたモジュール。
+# 履歴行 (createDatetime=登録日時) に加えて、有効なプロフィールの写しを
+# 固定ソートキー 'CURRENT' の行に持ち、get_item 1回で引けるようにする。
+# ('CURRENT' は日時文字列より後ろにソートされるため、降順 Limit=1 の query でも先頭に来る)
+CURRENT = 'CURRENT'
+MAX_SAVE_ATTEMPTS = 3
+
+def _to_profile(item):
+    profile = dict(item)
+    # CURRENT 行は元の履歴行の登録日時を versionDatetime に持つ
+    profile['createDatetime'] = profile.pop('versionDatetime', profile.get('createDatetime'))
+    return profile
+
+def _legacy_active_rows(user_id):
+    """CURRENT 行導入前のデータ: 履歴から deleteFlag=0 の行を新しい順に返す"""
+    resp = resources.user_table.query(KeyConditionExpression=Key('userId').eq(user_id), ScanIndexForward=False)
+    return [
+        item for item in resp.get('Items', [])
+        if item['createDatetime'] != CURRENT and item.get('deleteFlag', 0) == 0
+    ]
+
+def get_current_user(user_id):
+    """有効なプロフィールを返す (無ければ None)"""
+    resp = resources.user_table.get_item(Key={'userId': user_id, 'createDatetime': CURRENT})
+    if resp.get('Item'):
+        return _to_profile(resp['Item'])
+    rows = _legacy_active_rows(user_id)
+    return rows[0] if rows else None
+
+def iter_current_users(projection=None):
+    """全ユーザーの CURRENT 行を返すジェネレータ (バッチ処理用の全件スキャン)"""
+    kwargs = {'FilterExpression': Attr('createDatetime').eq(CURRENT)}
+    if projection:
+        names = {f"#p{i}": f for i, f in enumerate(projection)}
+        kwargs.update({'ProjectionExpression': ', '.join(names), 'ExpressionAttributeNames': names})
+    while True:
+        resp = resources.user_table.scan(**kwargs)
+        yield from resp.get('Items', [])
+        last_key = resp.get('LastEvaluatedKey')
+        if not last_key:
+            return
+        kwargs['ExclusiveStartKey'] = last_key
+
+def _put(item, condition=None, values=None):
+    # resources.dynamodb.meta.client は値の型変換を自動で行うため、素の値をそのまま渡す
+    op = {'TableName': resources.user_table.name, 'Item': item}
+    if condition:
+        op['ConditionExpression'] = condition
+    if values:
+        op['ExpressionAttributeValues'] = values
+    return {'Put': op}
+
+def _mark_deleted(user_id, create_datetime):
+    return {'Update': {
+        'TableName': resources.user_table.name,
+        'Key': {'userId': user_id, 'createDatetime': create_datetime},
+        'UpdateExpression': 'set deleteFlag = :f',
+        'ConditionExpression': 'attribute_exists(userId)',
+        'ExpressionAttributeValues': {':f': 1},
+    }}
+
+def save_user(item):
+    """新しいプロフィールを保存する。
+
+    履歴行の追加・旧履歴行の論理削除・CURRENT 行の差し替えを1つの TransactWriteItems で行う。
+    CURRENT 行は versionDatetime による楽観ロックで更新し、同時更新で競合した場合は読み直して再試行する。
+    """
+    user_id = item['userId']
+    client = resources.dynamodb.meta.client
+    for attempt in range(MAX_SAVE_ATTEMPTS):
+        resp = resources.user_table.get_item(
+            Key={'userId': user_id, 'createDatetime': CURRENT},
+            ProjectionExpression='versionDatetime'
+        )
+        current = resp.get('Item')
+
+        pointer = dict(item, createDatetime=CURRENT, versionDatetime=item['createDatetime'])
+        if current:
+            prev_version = current['versionDatetime']
+            ops = [_put(pointer, 'versionDatetime = :v', {':v': prev_version})]
+            stale = [prev_version] if prev_version != item['createDatetime'] else []
+        else:
+            ops = [_put(pointer, 'attribute_not_exists(userId)')]
+            stale = [row['createDatetime'] for row in _legacy_active_rows(user_id)]
+
+        ops.append(_put(item))
+        ops.extend(_mark_deleted(user_id, dt) for dt in stale if dt != item['createDatetime'])
+        try:
+            client.transact_write_items(TransactItems=ops)
+            return item
+        except client.exceptions.TransactionCanceledException as e:
+            if attempt == MAX_SAVE_ATTEMPTS - 1:
+                raise
+            print(f"DEBUG: save_user conflict, retrying: {e}")
+
+def set_image_variants(user_id, image_link, variants):
+    """CURRENT 行に作成済みの派生画像サイズを記録する。写真が差し替わっていれば False"""
+    try:
+        resources.user_table.update_item(
+            Key={'userId': user_id, 'createDatetime': CURRENT},
+            UpdateExpression='set imageVariants = :v',
+            ConditionExpression=Attr('imageLink').eq(image_link),
+            ExpressionAttributeValues={':v': variants}
+        )
+        return True
+    except resources.user_table.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
@@ -1,55 +1,115 @@
 import os
-import boto3
-from botocore.config import Config
-from openai import OpenAI
-import google.generativeai as genai
-
-# グローバル変数
-client = None
-dynamodb = None
-s3_client = None
-cloth_table = None
-weather_table = None
-coordinate_table = None
-user_table = None
+import time
+from utils import tracing
 
 # 環境変数
+REGION = 'ap-northeast-1'
 BUCKET_NAME = os.environ.get('BUCKET_NAME')
 WEATHER_API_KEY = os.environ.get('OPENWEATHER_API_KEY')
 GOOGLE_API_KEY = os.environ.get('GOOGLE_API_KEY')
 GOOGLE_GENAI_KEY = os.environ.get('GOOGLE_GENAI_KEY')
 
-def initialize():
-    global client, dynamodb, s3_client, lambda_client
-    global cloth_table, weather_table, coordinate_table, user_table
+# 外部APIのエンドポイント (負荷試験でスタブサーバーに向ける場合などに上書きする)。
+# OpenAI は SDK が OPENAI_BASE_URL を、AWS は boto3 が AWS_ENDPOINT_URL(_<サービス>) を参照する
+GEOCODE_API_URL = os.environ.get('GEOCODE_API_URL', 'https://maps.googleapis.com/maps/api/geocode/json')
+OPENWEATHER_API_URL = os.environ.get('OPENWEATHER_API_URL', 'https://api.openweathermap.org/data/2.5/forecast')
+GEMINI_API_BASE = os.environ.get('GEMINI_API_BASE', 'https://generativelanguage.googleapis.com')
 
-    if client and dynamodb:
-        return
+# 生成済みリソースの初期化時間 (秒)。コールドスタート計測用
+init_timings = {}
 
-    print("DEBUG: Initializing resources...")
-    
-    # AI Clients
-    client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+# --- 遅延初期化レジストリ ---
+# 各クライアント/テーブルは初回アクセス時に生成し、モジュール変数としてキャッシュする。
+# AWS クライアントは API 呼び出しごとに tracing の span を記録するよう計測フックを登録する。
+# openai / google.generativeai / boto3 の import もここで初めて行うため、
+# OPTIONS や GET /clothes などAI SDKを使わないルートはその分の import コストを払わない。
+
+def _build_client():
+    from openai import OpenAI
+    return OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+
+def _build_genai():
+    import google.generativeai as genai
     if GOOGLE_GENAI_KEY:
         genai.configure(api_key=GOOGLE_GENAI_KEY)
+    return genai
 
-    # AWS Clients
-    # DynamoDB
-    dynamodb = boto3.resource('dynamodb', region_name='ap-northeast-1')
-    
+def _build_dynamodb():
+    import boto3
+    dynamodb = boto3.resource('dynamodb', region_name=REGION)
+    tracing.instrument_client(dynamodb.meta.client)
+    return dynamodb
+
+def _build_s3_client():
+    import boto3
+    from botocore.config import Config
     # ★修正: S3クライアントにリージョンと署名バージョンを明示する
-    s3_client = boto3.client(
-        's3', 
-        region_name='ap-northeast-1',
+    return tracing.instrument_client(boto3.client(
+        's3',
+        region_name=REGION,
         config=Config(signature_version='s3v4')
-    )
-    
-    lambda_client = boto3.client('lambda', region_name='ap-northeast-1')
+    ))
+
+def _build_credentials():
+    # 署名付きURLを自前で生成する際に使う認証情報 (期限付きの場合は自動更新される)
+    import boto3
+    return boto3.Session().get_credentials()
+
+def _build_lambda_client():
+    import boto3
+    return tracing.instrument_client(boto3.client('lambda', region_name=REGION))
 
+def _table_builder(env_name):
+    def build():
+        return _get('dynamodb').Table(os.environ.get(env_name))
+    return build
+
+_FACTORIES = {
+    # AI Clients
+    'client': _build_client,
+    'genai': _build_genai,
+    # AWS Clients
+    'dynamodb': _build_dynamodb,
+    's3_client': _build_s3_client,
+    'credentials': _build_credentials,
+    'lambda_client': _build_lambda_client,
     # DB Tables
-    cloth_table = dynamodb.Table(os.environ.get('TABLE_CLOTH'))
-    weather_table = dynamodb.Table(os.environ.get('TABLE_WEATHER'))
-    coordinate_table = dynamodb.Table(os.environ.get('TABLE_COORDINATE'))
-    user_table = dynamodb.Table(os.environ.get('TABLE_USER'))
-    
-    print("DEBUG: Resources initialized successfully.")
\ No newline at end of file
+    'cloth_table': _table_builder('TABLE_CLOTH'),
+    'weather_table': _table_builder('TABLE_WEATHER'),
+    'coordinate_table': _table_builder('TABLE_COORDINATE'),
+    'user_table': _table_builder('TABLE_USER'),
+    'cache_table': _table_builder('TABLE_CACHE'),
+    'batch_table': _table_builder('TABLE_BATCH'),
+}
+
+# 生成中のリソースのスタック (テーブル生成時の dynamodb のような入れ子分を差し引くため)
+_building = []
+
+def _get(name):
+    value = globals().get(name)
+    if value is not None:
+        return value
+    _building.append(0.0)
+    start = time.perf_counter()
+    try:
+        value = _FACTORIES[name]()
+    finally:
+        elapsed = time.perf_counter() - start
+        nested = _building.pop()
+        if _building:
+            _building[-1] += elapsed
+    init_timings[name] = elapsed - nested
+    globals()[name] = value
+    print(f"DEBUG: Resource initialized: {name} ({init_timings[name] * 1000:.1f}ms)")
+    return value
+
+def __getattr__(name):
+    # resources.cloth_table のような属性アクセスで初めて生成される (PEP 562)
+    if name in _FACTORIES:
+        return _get(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def initialize(*names):
+    """指定したリソース(省略時は全て)を先行して生成する。ワーカーのウォームアップ用"""
+    for name in names or _FACTORIES:
+        _get(name)
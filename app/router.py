@@ -0,0 +1,133 @@
+import json
+import time
+import importlib
+
+# 全レスポンス共通の CORS ヘッダー。ハンドラ側でヘッダーを追加しても他のレスポンスに影響しないよう、
+# 渡すとき・返すときは毎回コピーする
+CORS_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Headers": "Content-Type",
+    "Access-Control-Allow-Methods": "OPTIONS,POST,GET,PUT,DELETE"
+}
+
+OPTIONS_RESPONSE = {"statusCode": 200, "headers": CORS_HEADERS, "body": ""}
+NOT_FOUND_RESPONSE = {"statusCode": 404, "headers": CORS_HEADERS, "body": json.dumps({"message": "Not Found"})}
+
+def _copy(response):
+    """定型レスポンスを headers ごとコピーして返す"""
+    return {**response, "headers": dict(response["headers"])}
+
+def lazy(target):
+    """'module:function' 形式のハンドラを、初回呼び出し時に import して呼び出す関数を返す"""
+    resolved = []
+
+    def call(*args):
+        if not resolved:
+            module_name, func_name = target.split(':')
+            resolved.append(getattr(importlib.import_module(module_name), func_name))
+        return resolved[0](*args)
+    return call
+
+class Route:
+    """1エンドポイント分の定義。ハンドラはサービスモジュールを初回呼び出し時に import する"""
+
+    def __init__(self, method, pattern, target, with_context=False):
+        self.method = method
+        self.pattern = pattern
+        self.func = lazy(target)
+        self.with_context = with_context
+
+    def __call__(self, event, context):
+        if self.with_context:
+            return self.func(event, dict(CORS_HEADERS), context)
+        return self.func(event, dict(CORS_HEADERS))
+
+class Router:
+    def __init__(self):
+        # (method, path) -> Route  ※固定パスは辞書1回の参照で解決する
+        self._static = {}
+        # パスパラメータ付きルート: セグメント数 -> [(segments, {method: Route})]
+        self._dynamic = {}
+        # path(パターン) -> 登録済みメソッド / 405 レスポンス (Allow ヘッダー付き、登録時に生成)
+        self._methods = {}
+        self._not_allowed = {}
+        self._hooks = []
+
+    def add(self, method, pattern, target, with_context=False):
+        route = Route(method, pattern, target, with_context)
+        if '{' in pattern:
+            segments = tuple(pattern.strip('/').split('/'))
+            bucket = self._dynamic.setdefault(len(segments), [])
+            for seg, methods in bucket:
+                if seg == segments:
+                    methods[method] = route
+                    break
+            else:
+                bucket.append((segments, {method: route}))
+        else:
+            self._static[(method, pattern)] = route
+
+        allowed = self._methods.setdefault(pattern, set())
+        allowed.add(method)
+        headers = dict(CORS_HEADERS, Allow=','.join(['OPTIONS'] + sorted(allowed)))
+        self._not_allowed[pattern] = {"statusCode": 405, "headers": headers, "body": json.dumps({"message": "Method Not Allowed"})}
+        return route
+
+    def add_timing_hook(self, hook):
+        """hook(method, pattern, status_code, elapsed_ms) をリクエスト毎に呼び出す"""
+        self._hooks.append(hook)
+
+    def resolve(self, method, path):
+        """(Route, パスパラメータ, パターン) を返す。パスが無ければ (None, None, None)、メソッド不一致なら Route のみ None"""
+        if len(path) > 1 and path.endswith('/'):
+            path = path.rstrip('/')
+
+        route = self._static.get((method, path))
+        if route:
+            return route, {}, path
+        if path in self._not_allowed:
+            return None, None, path
+
+        segments = path.strip('/').split('/')
+        for pattern_segs, methods in self._dynamic.get(len(segments), ()):
+            params = {}
+            for p, s in zip(pattern_segs, segments):
+                if p[0] == '{':
+                    params[p[1:-1]] = s
+                elif p != s:
+                    break
+            else:
+                pattern = '/' + '/'.join(pattern_segs)
+                return methods.get(method), params, pattern
+        return None, None, None
+
+    def dispatch(self, event, context):
+        method = event['httpMethod']
+        if method == 'OPTIONS':
+            return _copy(OPTIONS_RESPONSE)
+
+        route, params, pattern = self.resolve(method, event.get('path') or '/')
+        if pattern is None:
+            return _copy(NOT_FOUND_RESPONSE)
+        if route is None:
+            return _copy(self._not_allowed[pattern])
+
+        if params:
+            event['pathParameters'] = dict(event.get('pathParameters') or {}, **params)
+
+        if not self._hooks:
+            return route(event, context)
+
+        start = time.perf_counter()
+        status = 500
+        try:
+            res = route(event, context)
+            status = res.get('statusCode', 200) if isinstance(res, dict) else 200
+            return res
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            for hook in self._hooks:
+                try:
+                    hook(method, pattern, status, elapsed_ms)
+                except Exception as e:
+                    print(f"Timing hook error: {e}")
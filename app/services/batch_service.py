@@ -0,0 +1,261 @@
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from decimal import Decimal
+from boto3.dynamodb.conditions import Attr
+import resources
+from repositories import cloth_repository, user_repository
+from services import cloth_service, coord_service, image_service
+from utils import tracing
+from utils.helpers import JST, get_target_date
+
+# OpenAI Batch API による一括処理 (翌日コーデの事前生成 / 服画像の一括解析)。
+# 依頼を JSONL (1行1リクエスト。custom_id = '<種類>#<userId>#<行のキー>') にまとめてアップロードし、
+# バッチを作成して BatchTable に記録する (task: batch_submit)。定期実行の batch_poll が状態を確認し、
+# 終了したバッチの結果を CoordinateTable / ClothTable に書き戻す。
+# 同期 API より安く別枠のレート制限で処理できるが、完了まで最大 COMPLETION_WINDOW かかるため、
+# 即時性の要らない処理にのみ使う。
+
+KINDS = ('coordinate', 'analyze')
+ENDPOINT = '/v1/chat/completions'
+COMPLETION_WINDOW = '24h'
+# 1バッチあたりの上限 (API の上限は 50,000 件 / 200MB)。超える分は複数のバッチに分ける
+MAX_REQUESTS = int(os.environ.get('OPENAI_BATCH_MAX_REQUESTS', '50000'))
+MAX_BYTES = int(os.environ.get('OPENAI_BATCH_MAX_BYTES', str(190 * 1024 * 1024)))
+# 依頼の作成・結果の書き戻しの並列数
+CONCURRENCY = int(os.environ.get('OPENAI_BATCH_CONCURRENCY', '8'))
+# 結果の書き戻しを続けるのに必要な Lambda の残り時間 (下回ったら続きを非同期起動する)
+MIN_REMAINING_MS = int(os.environ.get('OPENAI_BATCH_MIN_REMAINING_MS', '15000'))
+# これ以上変化しないバッチの状態
+TERMINAL_STATUSES = {'completed', 'failed', 'expired', 'cancelled'}
+
+def _now_str():
+    return datetime.now(JST).strftime('%Y-%m-%dT%H:%M:%S')
+
+def _custom_id(kind, user_id, key):
+    return f"{kind}#{user_id}#{key}"
+
+def _parse_custom_id(custom_id):
+    kind, rest = custom_id.split('#', 1)
+    user_id, key = rest.rsplit('#', 1)
+    return kind, user_id, key
+
+def _line(custom_id, body):
+    return {'custom_id': custom_id, 'method': 'POST', 'url': ENDPOINT, 'body': body}
+
+def _user_ids(event):
+    return event.get('userIds') or [u['userId'] for u in user_repository.iter_current_users(['userId'])]
+
+# --- 投入 (task: batch_submit) ---
+def submit_worker(event, context=None):
+    """event: {'kind': 'coordinate', 'targetDate'?, 'userIds'?} または {'kind': 'analyze', 'userIds'?, 'overwrite'?}"""
+    kind = event.get('kind')
+    if kind not in KINDS:
+        raise ValueError(f"kind must be one of {', '.join(KINDS)}")
+    if kind == 'coordinate':
+        return _submit_coordinates(event)
+    return _submit_analysis(event)
+
+def _submit_coordinates(event):
+    target_date_str = event.get('targetDate') or get_target_date(datetime.now(JST))
+    create_datetime = _now_str()
+    user_ids = _user_ids(event)
+
+    def prepare(user_id):
+        try:
+            return coord_service.batch_request(user_id, target_date_str)
+        except Exception as e:
+            print(f"Batch submit: {user_id} failed: {e}")
+            return 'failed', None
+
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as pool:
+        prepared = list(zip(user_ids, pool.map(prepare, user_ids)))
+    queued = {user_id: request for user_id, (outcome, request) in prepared if request}
+    lines = [_line(_custom_id('coordinate', user_id, create_datetime), r['body']) for user_id, r in queued.items()]
+
+    def save_pending(batch_id, chunk):
+        for line in chunk:
+            _, user_id, _ = _parse_custom_id(line['custom_id'])
+            coord_service.save_batch_pending(user_id, create_datetime, target_date_str, batch_id, queued[user_id])
+
+    batch_ids = _create_batches('coordinate', lines, {'targetDate': target_date_str}, save_pending)
+    result = {'kind': 'coordinate', 'targetDate': target_date_str, 'users': len(user_ids), 'queued': len(lines), 'batchIds': batch_ids}
+    result.update({name: sum(1 for _, (o, _) in prepared if o == name) for name in ('skipped', 'staleWeather', 'failed')})
+    print(f"Batch submitted: {json.dumps(result)}")
+    return result
+
+def _submit_analysis(event):
+    overwrite = bool(event.get('overwrite'))
+    fields = ['clothId', 'imageUrl', 'imageVariants', *cloth_service.ANALYSIS_FIELDS]
+    targets = []
+    for user_id in _user_ids(event):
+        u = user_repository.get_current_user(user_id)
+        prompt = cloth_service.build_analyze_prompt(cloth_service.wearer_text(u) if u else "")
+        for c in cloth_repository.iter_clothes(user_id, projection=fields, active_only=True):
+            # 上書きしない場合は、解析で埋まる属性が欠けている服だけ
+            if c.get('imageUrl') and (overwrite or any(c.get(f) in (None, '', []) for f in cloth_service.ANALYSIS_FIELDS)):
+                targets.append((user_id, c, prompt))
+
+    def build(target):
+        user_id, c, prompt = target
+        try:
+            # 署名付きURLは完了前に期限が切れうるため、画像を埋め込んで渡す
+            image = image_service.data_url(c['imageUrl'], c.get('imageVariants'))
+        except Exception as e:
+            print(f"Batch submit: image of {user_id}/{c['clothId']} unavailable: {e}")
+            return None
+        return _line(_custom_id('analyze', user_id, int(c['clothId'])), {
+            'model': cloth_service.ANALYZE_MODEL,
+            'messages': cloth_service.analyze_messages(prompt, image),
+            'response_format': {"type": "json_object"},
+        })
+
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as pool:
+        lines = [line for line in pool.map(build, targets) if line]
+    batch_ids = _create_batches('analyze', lines, {'overwrite': overwrite})
+    result = {'kind': 'analyze', 'clothes': len(targets), 'queued': len(lines), 'batchIds': batch_ids}
+    print(f"Batch submitted: {json.dumps(result)}")
+    return result
+
+def _chunks(encoded):
+    chunk, size = [], 0
+    for line, data in encoded:
+        if chunk and (len(chunk) >= MAX_REQUESTS or size + len(data) > MAX_BYTES):
+            yield chunk
+            chunk, size = [], 0
+        chunk.append((line, data))
+        size += len(data)
+    if chunk:
+        yield chunk
+
+def _create_batches(kind, lines, params, on_created=None):
+    """lines を上限ごとに分けてバッチを作成し、BatchTable に記録する。作成したバッチIDのリストを返す"""
+    batch_ids = []
+    encoded = [(line, (json.dumps(line, ensure_ascii=False) + '\n').encode('utf-8')) for line in lines]
+    for chunk in _chunks(encoded):
+        data = b''.join(d for _, d in chunk)
+        with tracing.span('openai.files', bytes=len(data)):
+            uploaded = resources.client.files.create(file=(f"{kind}.jsonl", data), purpose='batch')
+        with tracing.span('openai.batches', requests=len(chunk)):
+            batch = resources.client.batches.create(
+                input_file_id=uploaded.id, endpoint=ENDPOINT, completion_window=COMPLETION_WINDOW, metadata={'kind': kind}
+            )
+        resources.batch_table.put_item(Item={
+            'batchId': batch.id,
+            'kind': kind,
+            'status': batch.status,
+            'pending': 1,
+            'inputFileId': uploaded.id,
+            'requestCount': len(chunk),
+            'params': params,
+            'submitDatetime': _now_str(),
+        })
+        if on_created:
+            on_created(batch.id, [line for line, _ in chunk])
+        batch_ids.append(batch.id)
+    return batch_ids
+
+# --- 状態確認と結果の書き戻し (task: batch_poll) ---
+def poll_worker(event, context):
+    """未処理のバッチ (event の batchId 指定時はそれのみ) の状態を確認し、終了したものの結果を書き戻す"""
+    if event.get('batchId'):
+        item = resources.batch_table.get_item(Key={'batchId': event['batchId']}).get('Item')
+        items = [item] if item and 'pending' in item else []
+    else:
+        items = list(_pending_batches())
+    summary = []
+    for item in items:
+        with tracing.span('openai.batches', batchId=item['batchId']):
+            batch = resources.client.batches.retrieve(item['batchId'])
+        counts = batch.request_counts.model_dump() if batch.request_counts else {}
+        if batch.status not in TERMINAL_STATUSES:
+            resources.batch_table.update_item(
+                Key={'batchId': item['batchId']},
+                UpdateExpression='set #s = :s, requestCounts = :c',
+                ExpressionAttributeNames={'#s': 'status'},
+                ExpressionAttributeValues={':s': batch.status, ':c': counts}
+            )
+            summary.append({'batchId': item['batchId'], 'status': batch.status})
+            continue
+        summary.append(_apply(item, batch, counts, context))
+    print(f"Batch poll completed: {json.dumps(summary)}")
+    return summary
+
+def _pending_batches():
+    kwargs = {'FilterExpression': Attr('pending').exists()}
+    while True:
+        resp = resources.batch_table.scan(**kwargs)
+        yield from resp.get('Items', [])
+        last_key = resp.get('LastEvaluatedKey')
+        if not last_key:
+            return
+        kwargs['ExclusiveStartKey'] = last_key
+
+def _file_lines(file_id):
+    if not file_id:
+        return []
+    with tracing.span('openai.files', fileId=file_id):
+        text = resources.client.files.content(file_id).text
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+def _results(item, batch):
+    """custom_id -> (応答本文, エラー)"""
+    results = {}
+    for r in _file_lines(batch.output_file_id) + _file_lines(batch.error_file_id):
+        response = r.get('response') or {}
+        if response.get('status_code') == 200:
+            results[r['custom_id']] = (response['body']['choices'][0]['message']['content'], None)
+        else:
+            error = (r.get('error') or {}).get('message') or f"status {response.get('status_code')}"
+            results[r['custom_id']] = (None, error)
+    # 期限切れ・失敗したバッチで結果の無いコーデもルールベースで完了させるため、投入した依頼を洗い出す
+    if item['kind'] == 'coordinate' and len(results) < int(item['requestCount']):
+        for r in _file_lines(item['inputFileId']):
+            results.setdefault(r['custom_id'], (None, f"batch {batch.status}"))
+    return results
+
+def _apply(item, batch, counts, context):
+    results = _results(item, batch)
+    overwrite = bool((item.get('params') or {}).get('overwrite'))
+
+    def apply(entry):
+        custom_id, (content, error) = entry
+        if context.get_remaining_time_in_millis() < MIN_REMAINING_MS:
+            return 'deferred'
+        kind, user_id, key = _parse_custom_id(custom_id)
+        try:
+            if kind == 'coordinate':
+                return 'applied' if coord_service.apply_batch_result(user_id, key, content, error) else 'skipped'
+            if error:
+                return 'failed'
+            attrs = json.loads(content, parse_float=Decimal)
+            attrs = {f: attrs[f] for f in cloth_service.ANALYSIS_FIELDS if attrs.get(f) not in (None, '')}
+            return 'applied' if cloth_repository.apply_analysis(user_id, key, attrs, overwrite) else 'skipped'
+        except Exception as e:
+            print(f"Batch apply: {custom_id} failed: {e}")
+            return 'failed'
+
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as pool:
+        outcomes = list(pool.map(apply, results.items()))
+    result = {'batchId': item['batchId'], 'status': batch.status}
+    result.update({name: outcomes.count(name) for name in ('applied', 'skipped', 'failed', 'deferred')})
+
+    if result['deferred']:
+        # 書き戻しは冪等なので、同じバッチをもう一度処理させる
+        resources.lambda_client.invoke(
+            FunctionName=context.function_name,
+            InvocationType='Event',
+            Payload=json.dumps({'task': 'batch_poll', 'batchId': item['batchId']})
+        )
+        return result
+    resources.batch_table.update_item(
+        Key={'batchId': item['batchId']},
+        UpdateExpression='set #s = :s, requestCounts = :c, outputFileId = :o, errorFileId = :e, applied = :a, appliedDatetime = :t remove pending',
+        ExpressionAttributeNames={'#s': 'status'},
+        ExpressionAttributeValues={
+            ':s': batch.status, ':c': counts, ':o': batch.output_file_id, ':e': batch.error_file_id,
+            ':a': {name: result[name] for name in ('applied', 'skipped', 'failed')}, ':t': _now_str(),
+        }
+    )
+    return result
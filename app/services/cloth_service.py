@@ -1,9 +1,11 @@
 import json
 import time
 import uuid
-from boto3.dynamodb.conditions import Key
 import resources
-from utils.helpers import sign_s3_url
+from repositories import cloth_repository, pagination, user_repository
+from services import image_service
+from utils import tracing
+from utils.helpers import sign_s3_url, sign_s3_urls
 
 def get_clothes(event, headers):
     try:
@@ -13,23 +15,50 @@ def get_clothes(event, headers):
         
         if not user_id:
             return {"statusCode": 400, "headers": headers, "body": json.dumps({"message": "userId is required"})}
-            
-        response = resources.cloth_table.query(KeyConditionExpression=Key('userId').eq(user_id))
-        
-        valid_items = []
-        for item in response.get('Items', []):
-            if item.get('deleteFlag', 0) == 0:
-                if target_category and item.get('category') != target_category:
-                    continue
-                if 'imageUrl' in item:
-                    item['imageUrl'] = sign_s3_url(item['imageUrl'])
-                valid_items.append(item)
-                
-        return {"statusCode": 200, "headers": headers, "body": json.dumps(valid_items, default=str, ensure_ascii=False)}
+
+        try:
+            limit, cursor = pagination.parse_page_params(params)
+            start_key, _ = pagination.decode_cursor(cursor)
+            size = image_service.parse_size(params)
+        except ValueError as e:
+            return {"statusCode": 400, "headers": headers, "body": json.dumps({"message": str(e)})}
+
+        # 有効な服のみ (スパースGSI)、カテゴリ指定時はインデックスのキー条件で絞る
+        next_key = None
+        if limit is None:
+            # インデックスはカテゴリ順のため、従来どおり clothId (登録) 順に並べ直す
+            valid_items = sorted(
+                cloth_repository.iter_clothes(user_id, active_only=True, category=target_category),
+                key=lambda item: int(item['clothId'])
+            )
+        else:
+            if start_key: start_key['userId'] = user_id
+            valid_items, next_key = cloth_repository.page_clothes(
+                user_id, limit, start_key=start_key, active_only=True, category=target_category
+            )
+
+        # 一覧表示用に派生画像 (既定 small) の URL を thumbnailUrl に入れる。未作成なら元画像。
+        # imageUrl は編集時にそのまま送り返されるため元画像のまま
+        thumb_urls = [
+            image_service.variant_url(item.get('imageUrl'), item.get('imageVariants'), size) or item.get('imageUrl')
+            for item in valid_items
+        ]
+
+        # 署名はまとめて行う (同一キーはキャッシュから返る)。ページング時は返却分のみ
+        signed_urls = sign_s3_urls([item.get('imageUrl') for item in valid_items] + thumb_urls)
+        for item, url, thumb in zip(valid_items, signed_urls, signed_urls[len(valid_items):]):
+            if 'imageUrl' in item:
+                item['imageUrl'] = url
+                item['thumbnailUrl'] = thumb
+
+        if limit is None:
+            return {"statusCode": 200, "headers": headers, "body": json.dumps(valid_items, default=str, ensure_ascii=False)}
+        body = {"items": valid_items, "nextCursor": pagination.encode_cursor(next_key)}
+        return {"statusCode": 200, "headers": headers, "body": json.dumps(body, default=str, ensure_ascii=False)}
     except Exception as e:
         return {"statusCode": 500, "headers": headers, "body": json.dumps({"message": "Error", "error": str(e)})}
 
-def register_cloth(event, headers):
+def register_cloth(event, headers, context):
     try:
         body = json.loads(event['body'])
         user_id = body.get('userId')
@@ -50,12 +79,14 @@ def register_cloth(event, headers):
             'createDatetime': time.strftime('%Y-%m-%dT%H:%M:%S'), 
             'deleteFlag': 0
         }
+        item['activeCategory'] = cloth_repository.active_category(item)
         resources.cloth_table.put_item(Item=item)
+        image_service.request_derivatives(context, 'cloth', user_id, item['imageUrl'], cloth_id)
         return {"statusCode": 200, "headers": headers, "body": json.dumps({"message": "Saved", "data": item}, default=str)}
     except Exception as e:
         return {"statusCode": 500, "headers": headers, "body": json.dumps({"message": "Error", "error": str(e)})}
 
-def update_cloth(event, headers):
+def update_cloth(event, headers, context):
     try:
         body = json.loads(event['body'])
         user_id = body.get('userId')
@@ -67,7 +98,7 @@ def update_cloth(event, headers):
         # 論理削除 -> 新規作成 (履歴保持のため)
         resources.cloth_table.update_item(
             Key={'userId': user_id, 'clothId': int(old_cloth_id)},
-            UpdateExpression="set deleteFlag = :f", ExpressionAttributeValues={':f': 1}
+            UpdateExpression="set deleteFlag = :f remove activeCategory", ExpressionAttributeValues={':f': 1}
         )
         
         new_cloth_id = int(time.time() * 1000)
@@ -75,7 +106,12 @@ def update_cloth(event, headers):
         item['clothId'] = new_cloth_id
         item['createDatetime'] = time.strftime('%Y-%m-%dT%H:%M:%S')
         item['deleteFlag'] = 0
+        item['activeCategory'] = cloth_repository.active_category(item)
+        # 一覧レスポンス由来の項目は保存しない (派生画像は新しい行に対してワーカーが記録し直す)
+        item.pop('thumbnailUrl', None)
+        item.pop('imageVariants', None)
         resources.cloth_table.put_item(Item=item)
+        image_service.request_derivatives(context, 'cloth', user_id, item.get('imageUrl'), new_cloth_id)
         
         return {"statusCode": 200, "headers": headers, "body": json.dumps({"message": "Updated", "data": item}, default=str)}
     except Exception as e:
@@ -92,7 +128,7 @@ def delete_cloth(event, headers):
             
         resources.cloth_table.update_item(
             Key={'userId': user_id, 'clothId': int(cloth_id)},
-            UpdateExpression="set deleteFlag = :f", ExpressionAttributeValues={':f': 1}
+            UpdateExpression="set deleteFlag = :f remove activeCategory", ExpressionAttributeValues={':f': 1}
         )
         return {"statusCode": 200, "headers": headers, "body": json.dumps({"message": "Deleted"}, default=str)}
     except Exception as e:
@@ -124,6 +160,36 @@ def get_upload_url(event, headers):
     except Exception as e:
         return {"statusCode": 500, "headers": headers, "body": json.dumps({"message": "Error", "error": str(e)})}
 
+# 服画像の解析 (POST /analyze と batch_service の一括解析で共通)
+ANALYZE_MODEL = "gpt-5-nano"
+# 解析結果として服の行に書き込む属性
+ANALYSIS_FIELDS = ('category', 'brand', 'size', 'color', 'material', 'seasons', 'style', 'suitableMinTemp', 'suitableMaxTemp', 'description')
+
+def build_analyze_prompt(user_info_text=""):
+    return f"""
+        この服の画像を解析し、以下のJSONフォーマットで情報を抽出してください。
+        {user_info_text}
+        {{
+          "category": "アウター" | "トップス" | "ボトムス" | "シューズ" | "ワンピース" | "小物",
+          "brand": "ロゴやタグから推測されるブランド名(判別できない場合は空文字)",
+          "size": "推測されるサイズ(S/M/L/フリーなど、わからなければフリー)",
+          "color": "主要な1色(例: ブラック, ネイビー, ホワイト)",
+          "material": "見た目から推測される主要な素材1つ(例: 綿, ナイロン, レザー)",
+          "seasons": ["春", "夏", "秋", "冬"] の中から該当するものを配列で,
+          "style": "カジュアル" | "きれいめ" | "スポーティ" | "フォーマル",
+          "suitableMinTemp": 着用可能な最低気温(整数),
+          "suitableMaxTemp": 着用可能な最高気温(整数),
+          "description": "服の特徴を短く説明した文章"
+        }}
+        JSONのみを返してください。
+        """
+
+def wearer_text(u):
+    return f"【着用者属性】性別: {u.get('gender')}, 身長: {u.get('height')}cm"
+
+def analyze_messages(prompt, image_url):
+    return [{"role": "user", "content": [{"type": "text", "text": prompt}, {"type": "image_url", "image_url": {"url": image_url}}]}]
+
 def analyze_cloth(event, headers):
     try:
         body = json.loads(event['body'])
@@ -140,35 +206,19 @@ def analyze_cloth(event, headers):
         user_info_text = ""
         if user_id:
             try:
-                resp = resources.user_table.query(KeyConditionExpression=Key('userId').eq(user_id), ScanIndexForward=False, Limit=1)
-                if resp['Items']:
-                    u = resp['Items'][0]
-                    user_info_text = f"【着用者属性】性別: {u.get('gender')}, 身長: {u.get('height')}cm"
+                u = user_repository.get_current_user(user_id)
+                if u:
+                    user_info_text = wearer_text(u)
             except: pass
 
-        prompt = f"""
-        この服の画像を解析し、以下のJSONフォーマットで情報を抽出してください。
-        {user_info_text}
-        {{
-          "category": "アウター" | "トップス" | "ボトムス" | "シューズ" | "ワンピース" | "小物",
-          "brand": "ロゴやタグから推測されるブランド名(判別できない場合は空文字)",
-          "size": "推測されるサイズ(S/M/L/フリーなど、わからなければフリー)",
-          "color": "主要な1色(例: ブラック, ネイビー, ホワイト)",
-          "material": "見た目から推測される主要な素材1つ(例: 綿, ナイロン, レザー)",
-          "seasons": ["春", "夏", "秋", "冬"] の中から該当するものを配列で,
-          "style": "カジュアル" | "きれいめ" | "スポーティ" | "フォーマル",
-          "suitableMinTemp": 着用可能な最低気温(整数),
-          "suitableMaxTemp": 着用可能な最高気温(整数),
-          "description": "服の特徴を短く説明した文章"
-        }}
-        JSONのみを返してください。
-        """
+        prompt = build_analyze_prompt(user_info_text)
         
-        response = resources.client.chat.completions.create(
-            model="gpt-5-nano",
-            messages=[{"role": "user", "content": [{"type": "text", "text": prompt}, {"type": "image_url", "image_url": {"url": ai_access_url}}]}],
-            response_format={"type": "json_object"}
-        )
+        with tracing.span('openai.chat', model=ANALYZE_MODEL):
+            response = resources.client.chat.completions.create(
+                model=ANALYZE_MODEL,
+                messages=analyze_messages(prompt, ai_access_url),
+                response_format={"type": "json_object"}
+            )
         result = json.loads(response.choices[0].message.content)
         return {"statusCode": 200, "headers": headers, "body": json.dumps({"message": "Analyzed", "data": result}, default=str)}
     except Exception as e:
@@ -0,0 +1,123 @@
+import os
+import json
+
+# コーデ提案 (coord_service.worker) のプロンプト組み立て。
+# 手持ち服は JSON ではなく「番号|カテゴリ|色|着用気温|特徴」の表形式で渡し、
+# clothId (13桁) の代わりにプロンプト内の通し番号、カテゴリ・色は短縮コードを使う。
+# 服リスト部分はトークン数の上限 (TOKEN_BUDGET) を超えないよう、候補を渡された順
+# (coord_ranking.select_candidates の優先順) に詰め、入りきらない候補は落とす。
+
+CATEGORY_CODES = {'アウター': 'O', 'トップス': 'T', 'ボトムス': 'B', 'シューズ': 'S', 'ワンピース': 'D', '小物': 'A'}
+OTHER_CATEGORY = 'X'
+# 服リスト部分 (凡例・見出しを含む) のトークン数上限
+TOKEN_BUDGET = int(os.environ.get('COORD_PROMPT_TOKEN_BUDGET', '2000'))
+# 特徴 (description) の最大文字数
+DESC_MAX_CHARS = int(os.environ.get('COORD_PROMPT_DESC_CHARS', '16'))
+# tiktoken がある場合に使うエンコーディング (gpt-5 系)
+TOKENIZER_ENCODING = 'o200k_base'
+
+_encoding = None
+
+def _get_encoding():
+    # tiktoken は任意依存 (未導入・エンコーディング取得失敗時は概算する)
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+        except Exception as e:
+            print(f"DEBUG: tiktoken unavailable, estimating tokens: {e}")
+            _encoding = False
+    return _encoding
+
+def tokenizer_name():
+    return f"tiktoken:{TOKENIZER_ENCODING}" if _get_encoding() else 'estimate'
+
+def estimate_tokens(text):
+    """トークン数の概算 (ASCII は4文字で1、それ以外は1文字1トークン)"""
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+def count_tokens(text):
+    encoding = _get_encoding()
+    return len(encoding.encode(text)) if encoding else estimate_tokens(text)
+
+def _color_code(i):
+    # a..z, aa..zz
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    return letters[i] if i < 26 else letters[i // 26 - 1] + letters[i % 26]
+
+def _temp_range(c):
+    return float(c.get('suitableMinTemp', -50)), float(c.get('suitableMaxTemp', 50))
+
+def _row(n, c, color_code):
+    lo, hi = _temp_range(c)
+    desc = (c.get('description') or '').replace('|', '/').replace('\n', ' ').strip()[:DESC_MAX_CHARS]
+    return f"{n}|{CATEGORY_CODES.get(c.get('category'), OTHER_CATEGORY)}|{color_code}|{lo:g}~{hi:g}|{desc}"
+
+def build_closet_table(candidates, budget=TOKEN_BUDGET):
+    """候補 (優先順) を上限まで表形式にする。(表の文字列, 通し番号 -> clothId, 採用件数) を返す"""
+    header = "番号|カテゴリ|色|着用気温|特徴"
+    colors = {}
+    rows = []
+    id_map = {}
+    used = count_tokens(header) + count_tokens("色: ") + 2
+    for c in candidates:
+        color = c.get('color') or '-'
+        new_color = color not in colors
+        code = _color_code(len(colors)) if new_color else colors[color]
+        row = _row(len(rows) + 1, c, code)
+        cost = count_tokens(row) + 1 + (count_tokens(f"{code}={color} ") if new_color else 0)
+        # 固定アイテム (先頭) は上限に関わらず入れる
+        if rows and used + cost > budget:
+            break
+        used += cost
+        if new_color:
+            colors[color] = code
+        rows.append(row)
+        id_map[len(rows)] = int(c['clothId'])
+    legend = "色: " + ' '.join(f"{code}={color}" for color, code in colors.items())
+    return '\n'.join([legend, header, *rows]), id_map, len(rows)
+
+def build_prompt(target_date_str, weekday, season, weather, weekly_style, user_attr, candidates, anchor_cloth_id=None,
+                 budget=TOKEN_BUDGET):
+    """プロンプト、通し番号 -> clothId の対応、統計 (promptStats) を返す。candidates は優先順"""
+    table, id_map, included = build_closet_table(candidates, budget)
+    anchor_no = next((n for n, cid in id_map.items() if anchor_cloth_id and cid == int(anchor_cloth_id)), None)
+    anchor_info = f"【必須固定アイテム】番号 {anchor_no} を必ず使用してください。" if anchor_no else ""
+    category_legend = ' '.join(f"{code}={name}" for name, code in CATEGORY_CODES.items())
+
+    prompt = f"""あなたはプロのスタイリストです。以下の条件でコーディネートを1つ提案してください。
+【ターゲット情報】
+日付: {target_date_str} ({weekday}) {season}
+天気: {weather['weather']}, {weather['max']}°C / {weather['min']}°C
+湿度: {weather['humidity']}%
+降水確率: {weather.get('pop', 0)}%
+テーマ: {weekly_style if weekly_style else "TPOに合わせて"}
+ユーザー: {user_attr}
+{anchor_info}
+【手持ち服リスト】カテゴリ: {category_legend}
+{table}
+【出力ルール】
+1. 必ずJSONのみを返してください。服は手持ち服リストの「番号」で指定してください。
+2. 固定アイテムがある場合は、その番号を該当カテゴリのフィールドに必ず設定してください。
+3. outer_clothId, tops_clothId(配列), bottoms_clothId, shoes_clothId を決定してください。
+4. reason は100文字以内で、なぜこの組み合わせにしたか、指定テーマや天気にどう合わせたかを解説してください。
+JSON Example:
+{json.dumps({"outer_clothId": 1, "tops_clothId": [2], "bottoms_clothId": 3, "shoes_clothId": 4, "reason": "..."}, ensure_ascii=False)}"""
+
+    stats = {
+        'promptTokens': count_tokens(prompt),
+        'promptChars': len(prompt),
+        'candidates': len(candidates),
+        'included': included,
+        'tokenizer': tokenizer_name(),
+    }
+    return prompt, id_map, stats
+
+def resolve_cloth_id(value, id_map):
+    """AI が返した番号を clothId に戻す。clothId がそのまま返ってきた場合はそれを使う"""
+    if value is None or value == '':
+        return None
+    n = int(value)
+    return id_map.get(n, n if n in id_map.values() else None)
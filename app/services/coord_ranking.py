@@ -0,0 +1,174 @@
+import os
+import heapq
+from datetime import datetime
+
+# コーデ提案の候補絞り込み (coord_service.worker)。
+# 有効な服をスロット (outer/tops/bottoms/shoes) ごとに決定的なスコアで順位付けし、
+# 各スロットの上位 TOP_K 件だけを AI に渡す。スロットに当てはまらないカテゴリ (小物など) は渡さない。
+# スコアは服1着ごとの特徴量を列 (属性ごとのリスト) にまとめてから一括で計算する。
+
+# カテゴリ -> スロット (出力フィールド)
+SLOT_FIELDS = {
+    'アウター': 'outer_clothId',
+    'トップス': 'tops_clothId',
+    'ワンピース': 'tops_clothId',
+    'ボトムス': 'bottoms_clothId',
+    'シューズ': 'shoes_clothId',
+}
+TOP_K = int(os.environ.get('COORD_TOP_K', '12'))
+# 着用履歴を見る日数 (これより前の着用は減点しない)
+WEAR_WINDOW_DAYS = int(os.environ.get('COORD_WEAR_WINDOW_DAYS', '14'))
+
+WEIGHTS = {'temp': 3.0, 'season': 2.0, 'style': 1.0, 'color': 1.0, 'wear': 2.0}
+
+# 週間予定のキーワード -> 合うスタイル (register_cloth / analyze_cloth の style の値)
+STYLE_KEYWORDS = [
+    (('オフィス', '仕事', '会議', '出社', 'きれいめ', 'デート', 'フォーマル', '式'), {'きれいめ', 'フォーマル'}),
+    (('アクティブ', 'スポーツ', '運動', 'ジム', 'アウトドア'), {'スポーティ', 'カジュアル'}),
+    (('カジュアル', '休日', 'リラックス', '買い物', '家'), {'カジュアル'}),
+]
+# どの色とも合わせやすい色
+NEUTRAL_COLORS = {'ブラック', 'ホワイト', 'グレー', 'ネイビー', 'ベージュ', 'ブラウン', 'カーキ', 'アイボリー', 'デニム'}
+# 合わせにくい組み合わせ
+CLASHING_COLORS = {
+    frozenset(pair) for pair in [
+        ('レッド', 'グリーン'), ('レッド', 'ピンク'), ('オレンジ', 'ピンク'), ('パープル', 'オレンジ'),
+        ('イエロー', 'パープル'), ('レッド', 'オレンジ'),
+    ]
+}
+
+def slot_of(category):
+    return SLOT_FIELDS.get(category)
+
+def preferred_styles(weekly_style):
+    """週間予定のテーマから合うスタイルの集合を返す (判定できなければ None)"""
+    if not weekly_style:
+        return None
+    for keywords, styles in STYLE_KEYWORDS:
+        if any(k in weekly_style for k in keywords):
+            return styles
+    return None
+
+def color_harmony(base, color):
+    """base の色と color の相性 (0〜1)。base が無ければ合わせやすさ"""
+    if not color:
+        return 0.5
+    if not base:
+        return 1.0 if color in NEUTRAL_COLORS else 0.6
+    if color == base or color in NEUTRAL_COLORS or base in NEUTRAL_COLORS:
+        return 1.0
+    if frozenset((base, color)) in CLASHING_COLORS:
+        return 0.0
+    return 0.5
+
+def wear_days(coordinates, target_date_str):
+    """直近のコーデ履歴から clothId -> 最後に着てからの日数 を返す"""
+    target = datetime.strptime(target_date_str, '%Y-%m-%d')
+    last_worn = {}
+    for c in coordinates:
+        if c.get('processStatus', 'COMPLETED') != 'COMPLETED' or not c.get('targetDate'):
+            continue
+        days = (target - datetime.strptime(c['targetDate'], '%Y-%m-%d')).days
+        if days <= 0:
+            continue
+        ids = [c.get('outer_clothId'), c.get('bottoms_clothId'), c.get('shoes_clothId'), *(c.get('tops_clothId') or [])]
+        for cid in ids:
+            if cid:
+                cid = int(cid)
+                last_worn[cid] = min(days, last_worn.get(cid, days))
+    return last_worn
+
+def score_clothes(clothes, t_max, t_min, season, weekly_style=None, anchor=None, worn=None):
+    """服ごとのスコアのリスト (clothes と同じ順)"""
+    worn = worn or {}
+    styles = preferred_styles(weekly_style)
+    base_color = anchor.get('color') if anchor else None
+    width = max(1.0, t_max - t_min)
+
+    # 列ごとに取り出す
+    ids = [int(c['clothId']) for c in clothes]
+    lows = [float(c.get('suitableMinTemp', -50)) for c in clothes]
+    highs = [float(c.get('suitableMaxTemp', 50)) for c in clothes]
+
+    # 気温: その日の気温幅のうち着用可能範囲に入る割合。重ならなければ離れている度合いで負の値
+    temp = [
+        (min(hi, t_max) - max(lo, t_min)) / width if min(hi, t_max) >= max(lo, t_min)
+        else -max(lo - t_max, t_min - hi) / 10
+        for lo, hi in zip(lows, highs)
+    ]
+    season_fit = [1.0 if not c.get('seasons') or season in c['seasons'] else 0.0 for c in clothes]
+    style_fit = [0.5 if styles is None or not c.get('style') else float(c['style'] in styles) for c in clothes]
+    color_fit = [color_harmony(base_color, c.get('color')) for c in clothes]
+    wear = [max(0.0, 1 - worn[i] / WEAR_WINDOW_DAYS) if i in worn else 0.0 for i in ids]
+
+    w = WEIGHTS
+    return [
+        w['temp'] * t + w['season'] * s + w['style'] * st + w['color'] * co - w['wear'] * we
+        for t, s, st, co, we in zip(temp, season_fit, style_fit, color_fit, wear)
+    ]
+
+def select_candidates(clothes, t_max, t_min, season, weekly_style=None, anchor_cloth_id=None, worn=None, top_k=TOP_K):
+    """スロットごとの上位 top_k 件を、AI に渡す順 (固定アイテム -> 各スロットの1位 -> 2位 ...) で返す"""
+    anchor_id = int(anchor_cloth_id) if anchor_cloth_id else None
+    anchor = next((c for c in clothes if anchor_id is not None and int(c['clothId']) == anchor_id), None)
+    scores = score_clothes(clothes, t_max, t_min, season, weekly_style, anchor, worn)
+
+    by_slot = {}
+    for score, c in zip(scores, clothes):
+        slot = slot_of(c.get('category'))
+        if slot and c is not anchor:
+            by_slot.setdefault(slot, []).append((score, int(c['clothId']), c))
+    ranked = []
+    for entries in by_slot.values():
+        top = heapq.nlargest(top_k, entries, key=lambda e: (e[0], e[1]))
+        ranked.extend((rank, -score, c) for rank, (score, _, c) in enumerate(top))
+    ranked.sort(key=lambda r: (r[0], r[1]))
+    return ([anchor] if anchor else []) + [c for _, _, c in ranked]
+
+# --- ルールベースのコーデ組み立て (AI を使わない高速モード / AI 失敗時の代替) ---
+# 最低気温がこれ未満ならアウターを入れる
+OUTER_BELOW = float(os.environ.get('COORD_OUTER_BELOW', '18'))
+
+def _best(clothes, field, t_max, t_min, season, weekly_style, base, worn):
+    pool = [c for c in clothes if slot_of(c.get('category')) == field]
+    if not pool:
+        return None
+    scores = score_clothes(pool, t_max, t_min, season, weekly_style, base, worn)
+    return max(zip(scores, pool), key=lambda e: (e[0], int(e[1]['clothId'])))[1]
+
+def _label(c):
+    return c.get('description') or f"{c.get('color') or ''}の{c.get('category')}"
+
+def assemble_outfit(clothes, weather, season, weekly_style=None, anchor_cloth_id=None, worn=None):
+    """スコアの高い服から outer/tops/bottoms/shoes を1着ずつ選び、(フィールド辞書, reason) を返す
+
+    固定アイテム (無ければトップスの1位) を基準に、残りのスロットはその色との相性も含めて選ぶ。
+    トップスがワンピースならボトムスは選ばない。
+    """
+    t_max = float(weather.get('max', 20))
+    t_min = float(weather.get('min', 15))
+    anchor_id = int(anchor_cloth_id) if anchor_cloth_id else None
+    anchor = next((c for c in clothes if anchor_id is not None and int(c['clothId']) == anchor_id), None)
+
+    picked = {}
+    if anchor and slot_of(anchor.get('category')):
+        picked[slot_of(anchor['category'])] = anchor
+    base = anchor or picked.get('tops_clothId')
+    if 'tops_clothId' not in picked:
+        picked['tops_clothId'] = _best(clothes, 'tops_clothId', t_max, t_min, season, weekly_style, base, worn)
+        base = base or picked['tops_clothId']
+    one_piece = picked['tops_clothId'] is not None and picked['tops_clothId'].get('category') == 'ワンピース'
+    for field in ('bottoms_clothId', 'shoes_clothId', 'outer_clothId'):
+        if field in picked:
+            continue
+        if (field == 'bottoms_clothId' and one_piece) or (field == 'outer_clothId' and t_min >= OUTER_BELOW):
+            continue
+        picked[field] = _best(clothes, field, t_max, t_min, season, weekly_style, base, worn)
+
+    result = {field: int(c['clothId']) for field, c in picked.items() if c is not None}
+    if 'tops_clothId' in result:
+        result['tops_clothId'] = [result['tops_clothId']]
+    items = [_label(picked[f]) for f in ('outer_clothId', 'tops_clothId', 'bottoms_clothId', 'shoes_clothId') if picked.get(f)]
+    theme = f"「{weekly_style}」の予定と" if weekly_style else ""
+    reason = f"{weather.get('weather', '')}で{t_max:g}°C/{t_min:g}°Cの{season}の日に、{theme}気温に合わせて{'、'.join(items)}を選びました。"
+    return result, reason[:100]
@@ -1,10 +1,25 @@
+import os
 import json
 import time
 import uuid
-from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from boto3.dynamodb.conditions import Key
 import resources
-from utils.helpers import sign_s3_url, get_current_season
+from repositories import cloth_repository, pagination, user_repository
+from services import coord_prompt, coord_ranking, image_service
+from utils import tracing
+from utils.helpers import JST, sign_s3_urls, get_current_season, get_target_date
+
+# 生成するモード (ai: AI に提案させる / fast: ルールベースでその場で組み立てる)
+MODES = ('ai', 'fast')
+# AI 呼び出しの打ち切り秒数 (超えたらルールベースの結果で完了させる)
+AI_TIMEOUT = float(os.environ.get('COORD_AI_TIMEOUT', '20'))
+RESULT_FIELDS = ('outer_clothId', 'tops_clothId', 'bottoms_clothId', 'shoes_clothId')
+COORD_MODEL = "gpt-5-mini"
+
+# ワーカーのフィルタリング/プロンプト作成に必要な服の属性
+WORKER_CLOTH_FIELDS = ['clothId', 'category', 'color', 'description', 'seasons', 'style', 'suitableMinTemp', 'suitableMaxTemp']
 
 # --- 1. 受付API (POST /coordinates) ---
 def start_create_coordinate(event, headers, context):
@@ -13,15 +28,22 @@ def start_create_coordinate(event, headers, context):
         body = json.loads(event['body'])
         user_id = body.get('userId')
         anchor_cloth_id = body.get('anchorClothId')
+        mode = body.get('mode') or (event.get('queryStringParameters') or {}).get('mode') or 'ai'
         
         if not user_id:
             return {"statusCode": 400, "headers": headers, "body": json.dumps({"message": "userId required"})}
+        if mode not in MODES:
+            return {"statusCode": 400, "headers": headers, "body": json.dumps({"message": f"mode must be one of {', '.join(MODES)}"})}
 
         # IDとなる日時を決定
-        JST = timezone(timedelta(hours=+9), 'JST')
         now_jst = datetime.now(JST)
-        target_date = now_jst + timedelta(days=1) if now_jst.hour >= 19 else now_jst
-        target_date_str = target_date.strftime('%Y-%m-%d')
+        target_date_str = get_target_date(now_jst)
+
+        # 前夜のバッチで生成済みのコーデがあればそれを返す (固定アイテム指定時は対象外)
+        if not anchor_cloth_id:
+            claimed = _claim_precomputed(user_id, target_date_str, now_jst)
+            if claimed:
+                return _completed_response(claimed, headers)
         
         # レコードID (ソートキー)
         create_datetime = now_jst.strftime('%Y-%m-%dT%H:%M:%S')
@@ -37,6 +59,10 @@ def start_create_coordinate(event, headers, context):
             'jobId': job_id,
             'deleteFlag': 0
         }
+        # fast: AI を使わずその場で組み立て、完了した状態で登録して結果を返す
+        if mode == 'fast':
+            return _create_fast(item, headers)
+
         resources.coordinate_table.put_item(Item=item)
 
         # 2. 非同期ワーカー起動
@@ -85,13 +111,7 @@ def check_status(event, headers):
         status = item.get('processStatus', 'COMPLETED') # 古いデータはCOMPLETED扱い
         
         # 完了していれば画像URL等を付与して返す
-        result_data = {}
-        if status == 'COMPLETED':
-            result_data = item.copy()
-            # 服全件取得して画像マッピング
-            cloth_resp = resources.cloth_table.query(KeyConditionExpression=Key('userId').eq(user_id))
-            cloth_map = {int(c['clothId']): c['imageUrl'] for c in cloth_resp.get('Items', [])}
-            _attach_images(result_data, cloth_map)
+        result_data = _completed_data(user_id, item) if status == 'COMPLETED' else {}
 
         # エラー理由があれば返す
         fail_reason = item.get('failReason', '')
@@ -105,6 +125,45 @@ def check_status(event, headers):
     except Exception as e:
         return {"statusCode": 500, "headers": headers, "body": json.dumps({"error": str(e)})}
 
+def _create_fast(item, headers):
+    user_id = item['userId']
+    tracing.lap('init')
+    try:
+        inputs = _load_inputs(user_id, item['targetDate'])
+        tracing.lap('records')
+        result = _generate(inputs, item.get('anchorClothId'), 'fast')
+        item = dict(item, processStatus='COMPLETED', **_result_values(result))
+    except Exception as e:
+        print(f"Fast Coord Error: {e}")
+        item = dict(item, processStatus='FAILED', failReason=str(e))
+    item['phaseDurations'] = tracing.phase_durations()
+    resources.coordinate_table.put_item(Item=item)
+    return _completed_response(item, headers)
+
+def _completed_response(item, headers):
+    """生成済みの行を check_status と同じ形式 (+ coordinateId / jobId) で返す"""
+    status = item['processStatus']
+    return {"statusCode": 200, "headers": headers, "body": json.dumps({
+        "coordinateId": item['createDatetime'],
+        "jobId": item.get('jobId'),
+        "status": status,
+        "data": _completed_data(item['userId'], item) if status == 'COMPLETED' else {},
+        "failReason": item.get('failReason', '')
+    }, default=str, ensure_ascii=False)}
+
+def _completed_data(user_id, item):
+    """完了したコーデ行に画像URLを付けたもの (check_status / fast モードの応答)"""
+    result_data = item.copy()
+    # コーデに含まれる服だけ取得して画像マッピング
+    cloth_map = {
+        cid: _display_url(c, image_service.DEFAULT_SIZE)
+        for cid, c in cloth_repository.batch_get_clothes(
+            user_id, _cloth_ids(result_data), projection=['imageUrl', 'imageVariants']
+        ).items()
+    }
+    _attach_images(result_data, cloth_map, _sign_map(cloth_map.get(cid) for cid in _cloth_ids(result_data)))
+    return result_data
+
 # --- 3. バックグラウンドワーカー (裏方) ---
 def worker(event):
     print(f"Coord Worker started: {event.get('jobId')}")
@@ -112,108 +171,25 @@ def worker(event):
     create_datetime = event['createDatetime']
     target_date_str = event['targetDate']
     anchor_cloth_id = event.get('anchorClothId')
+    tracing.lap('init')
     
     try:
-        # === 既存のAI生成ロジック ===
-        
         # 1. 情報収集
-        weekdays = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
-        dt = datetime.strptime(target_date_str, '%Y-%m-%d')
-        current_weekday = weekdays[dt.weekday()]
-        season = get_current_season(target_date_str)
-
-        user_resp = resources.user_table.query(KeyConditionExpression=Key('userId').eq(user_id), ScanIndexForward=False, Limit=1)
-        weekly_style, user_attr = "", ""
-        if user_resp.get('Items'):
-            u = user_resp['Items'][0]
-            weekly_style = (u.get('weeklySchedule') or {}).get(current_weekday, "")
-            user_attr = f"性別:{u.get('gender')}, 身長:{u.get('height')}cm"
-
-        weather_resp = resources.weather_table.query(KeyConditionExpression=Key('userId').eq(user_id), ScanIndexForward=False, Limit=1)
-        if not weather_resp.get('Items'):
-            weather = {'weather': '不明', 'max': 20, 'min': 15, 'humidity': 50}
-        else:
-            weather = weather_resp['Items'][0]
-
-        cloth_resp = resources.cloth_table.query(KeyConditionExpression=Key('userId').eq(user_id))
-        all_clothes = cloth_resp.get('Items', [])
-        if not all_clothes:
-            raise Exception("No clothes registered")
+        inputs = _load_inputs(user_id, target_date_str)
+        tracing.lap('records')
 
-        # 2. フィルタリング
-        t_max = float(weather.get('max', 20))
-        t_min = float(weather.get('min', 15))
-        
-        filtered = []
-        for c in all_clothes:
-            cid = int(c['clothId'])
-            if anchor_cloth_id and cid == int(anchor_cloth_id):
-                filtered.append(c)
-                continue
-            if c.get('seasons') and season not in c['seasons']: continue
-            if float(c.get('suitableMinTemp', -50)) > t_max + 5: continue
-            if float(c.get('suitableMaxTemp', 50)) < t_min - 5: continue
-            filtered.append(c)
-            
-        target_list = filtered if filtered else all_clothes
-        if len(target_list) == 1 and anchor_cloth_id: target_list = all_clothes
-
-        summary = [{"id": int(c['clothId']), "cat": c['category'], "col": c.get('color'), "desc": c.get('description', '')} for c in target_list]
-        anchor_info = f"【必須固定アイテム】ID:{anchor_cloth_id} を必ず使用してください。" if anchor_cloth_id else ""
-
-        # プロンプト
-        prompt = f"""
-        あなたはプロのスタイリストです。以下の条件でコーディネートを1つ提案してください。
-        【ターゲット情報】
-        日付: {target_date_str} ({current_weekday}) {season}
-        天気: {weather['weather']}, {weather['max']}°C / {weather['min']}°C
-        湿度: {weather['humidity']}%
-        降水確率: {weather.get('pop', 0)}%
-        テーマ: {weekly_style if weekly_style else "TPOに合わせて"}
-        ユーザー: {user_attr}
-        {anchor_info}
-        【手持ち服リスト(ID一覧)】
-        {json.dumps(summary, ensure_ascii=False)}
-        【出力ルール】
-        1. 必ずJSONのみを返してください。
-        2. 固定アイテムがある場合は、そのIDを該当カテゴリのフィールドに必ず設定してください。
-        3. outer_clothId, tops_clothId(配列), bottoms_clothId, shoes_clothId を決定してください。
-        4. reason は100文字以内で、なぜこの組み合わせにしたか、指定テーマや天気にどう合わせたかを解説してください。
-        JSON Example:
-        {{
-            "outer_clothId": 123,
-            "tops_clothId": [456],
-            "bottoms_clothId": 789,
-            "shoes_clothId": 101,
-            "reason": "..."
-        }}
-        """
-
-        # 3. AI生成
-        print("DEBUG: Calling OpenAI...")
-        res = resources.client.chat.completions.create(
-            model="gpt-5-mini", 
-            messages=[{"role": "user", "content": prompt}], 
-            response_format={"type": "json_object"}
-        )
-        ai_data = json.loads(res.choices[0].message.content)
+        # 2〜3. 候補の絞り込みと生成 (AI が失敗・タイムアウトした場合はルールベースで組み立てる)
+        result = _generate(inputs, anchor_cloth_id, event.get('mode', 'ai'))
 
         # 4. DB更新 (完了)
-        outer = ai_data.get('outer_clothId')
-        tops = ai_data.get('tops_clothId')
-        bottoms = ai_data.get('bottoms_clothId')
-        shoes = ai_data.get('shoes_clothId')
-
+        values = _result_values(result)
         resources.coordinate_table.update_item(
             Key={'userId': user_id, 'createDatetime': create_datetime},
-            UpdateExpression="set processStatus=:s, outer_clothId=:o, tops_clothId=:t, bottoms_clothId=:b, shoes_clothId=:sh, reason=:r",
+            UpdateExpression="set processStatus=:s, " + ', '.join(f"{name}=:{name}" for name in values) + ", phaseDurations=:pd",
             ExpressionAttributeValues={
                 ':s': 'COMPLETED',
-                ':o': int(outer) if outer else None,
-                ':t': [int(t) for t in tops] if tops else None,
-                ':b': int(bottoms) if bottoms else None,
-                ':sh': int(shoes) if shoes else None,
-                ':r': ai_data.get('reason')
+                **{f":{name}": value for name, value in values.items()},
+                ':pd': tracing.phase_durations()
             }
         )
         print("DEBUG: Coord Worker completed")
@@ -223,9 +199,314 @@ def worker(event):
         # 失敗ステータス
         resources.coordinate_table.update_item(
             Key={'userId': user_id, 'createDatetime': create_datetime},
-            UpdateExpression="set processStatus = :s, failReason = :r",
-            ExpressionAttributeValues={':s': 'FAILED', ':r': str(e)}
+            UpdateExpression="set processStatus = :s, failReason = :r, phaseDurations = :pd",
+            ExpressionAttributeValues={':s': 'FAILED', ':r': str(e), ':pd': tracing.phase_durations()}
+        )
+
+def _load_inputs(user_id, target_date_str):
+    """コーデ生成の入力 (曜日・季節・予定・ユーザー属性・天気・有効な服・着用履歴) を集める"""
+    weekdays = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+    dt = datetime.strptime(target_date_str, '%Y-%m-%d')
+    current_weekday = weekdays[dt.weekday()]
+
+    u = user_repository.get_current_user(user_id)
+    weekly_style, user_attr = "", ""
+    if u:
+        weekly_style = (u.get('weeklySchedule') or {}).get(current_weekday, "")
+        user_attr = f"性別:{u.get('gender')}, 身長:{u.get('height')}cm"
+
+    weather_resp = resources.weather_table.query(KeyConditionExpression=Key('userId').eq(user_id), ScanIndexForward=False, Limit=1)
+    if not weather_resp.get('Items'):
+        weather = {'weather': '不明', 'max': 20, 'min': 15, 'humidity': 50}
+    else:
+        weather = weather_resp['Items'][0]
+
+    all_clothes = list(cloth_repository.iter_clothes(user_id, projection=WORKER_CLOTH_FIELDS, active_only=True))
+    if not all_clothes:
+        raise Exception("No clothes registered")
+
+    return {
+        'targetDate': target_date_str,
+        'weekday': current_weekday,
+        'season': get_current_season(target_date_str),
+        'weeklyStyle': weekly_style,
+        'userAttr': user_attr,
+        'weather': weather,
+        'clothes': all_clothes,
+        'worn': coord_ranking.wear_days(_recent_coordinates(user_id, target_date_str), target_date_str),
+    }
+
+def _generate(inputs, anchor_cloth_id, mode):
+    """服の組み合わせを決め、{'fields': {outer_clothId: ...}, 'reason', 'engine', 'promptStats'?} を返す
+
+    mode='fast' はルールベースのみ。'ai' は AI に提案させ、失敗・タイムアウト時はルールベースの結果を返す
+    """
+    rules = lambda: coord_ranking.assemble_outfit(
+        inputs['clothes'], inputs['weather'], inputs['season'], inputs['weeklyStyle'], anchor_cloth_id, inputs['worn']
+    )
+    if mode == 'fast':
+        fields, reason = rules()
+        tracing.lap('rules')
+        return {'fields': fields, 'reason': reason, 'engine': 'rules'}
+    try:
+        return _generate_ai(inputs, anchor_cloth_id)
+    except Exception as e:
+        print(f"DEBUG: AI generation failed, falling back to rules: {e}")
+        tracing.lap('generate')
+        fields, reason = rules()
+        tracing.lap('rules')
+        return {'fields': fields, 'reason': reason, 'engine': 'rules', 'fallbackReason': f"{type(e).__name__}: {e}"[:200]}
+
+def _generate_ai(inputs, anchor_cloth_id):
+    candidates, prompt, id_map, prompt_stats = _build_request(inputs, anchor_cloth_id)
+
+    # AI生成 (応答が遅い場合は打ち切ってルールベースに切り替える)
+    print("DEBUG: Calling OpenAI...")
+    with tracing.span('openai.chat', model=COORD_MODEL, promptTokens=prompt_stats['promptTokens']):
+        res = resources.client.with_options(timeout=AI_TIMEOUT, max_retries=0).chat.completions.create(**chat_body(prompt))
+    ai_data = json.loads(res.choices[0].message.content)
+    if getattr(res, 'usage', None):
+        prompt_stats['usagePromptTokens'] = res.usage.prompt_tokens
+    tracing.lap('generate')
+
+    slots = {int(c['clothId']): coord_ranking.slot_of(c.get('category')) for c in candidates}
+    fields = _fields_from_reply(ai_data, id_map, slots)
+    # 使える服が1着も無い応答は失敗扱いにしてルールベースに切り替える
+    if not any(fields.values()):
+        raise Exception("No usable clothes in reply")
+    return {'fields': fields, 'reason': ai_data.get('reason'), 'engine': 'ai', 'promptStats': prompt_stats}
+
+def _build_request(inputs, anchor_cloth_id):
+    """(候補, プロンプト, 通し番号 -> clothId, promptStats) を返す"""
+    weather = inputs['weather']
+    t_max = float(weather.get('max', 20))
+    t_min = float(weather.get('min', 15))
+
+    # 候補の絞り込み: スロットごとに気温・季節・予定・色・最近の着用でスコア付けし、上位のみ渡す
+    candidates = coord_ranking.select_candidates(
+        inputs['clothes'], t_max, t_min, inputs['season'], inputs['weeklyStyle'], anchor_cloth_id, inputs['worn']
+    )
+    if not candidates:
+        raise Exception("No clothes for coordinate slots")
+
+    # 服リストはコンパクトな表形式で、トークン上限内に収まるよう優先度順に詰める
+    prompt, id_map, prompt_stats = coord_prompt.build_prompt(
+        inputs['targetDate'], inputs['weekday'], inputs['season'], weather, inputs['weeklyStyle'], inputs['userAttr'],
+        candidates, anchor_cloth_id
+    )
+    prompt_stats['closet'] = len(inputs['clothes'])
+    tracing.put_metric('promptTokens', prompt_stats['promptTokens'])
+    tracing.put_metric('promptCandidates', prompt_stats['included'])
+    tracing.lap('closet')
+    return candidates, prompt, id_map, prompt_stats
+
+def chat_body(prompt):
+    """コーデ提案の Chat Completions リクエスト本文 (Batch API の body と共通)"""
+    return {
+        'model': COORD_MODEL,
+        'messages': [{"role": "user", "content": prompt}],
+        'response_format': {"type": "json_object"},
+    }
+
+def _fields_from_reply(ai_data, id_map, slots):
+    """AI はプロンプト内の番号で返すため clothId に戻し、スロットに合わない服 (slots: clothId -> フィールド) は捨てる"""
+    def pick(value, field):
+        cid = coord_prompt.resolve_cloth_id(value, id_map)
+        return cid if cid is not None and slots.get(cid) == field else None
+
+    tops = [t for t in (pick(t, 'tops_clothId') for t in ai_data.get('tops_clothId') or []) if t]
+    return {
+        'outer_clothId': pick(ai_data.get('outer_clothId'), 'outer_clothId'),
+        'tops_clothId': tops or None,
+        'bottoms_clothId': pick(ai_data.get('bottoms_clothId'), 'bottoms_clothId'),
+        'shoes_clothId': pick(ai_data.get('shoes_clothId'), 'shoes_clothId'),
+    }
+
+def _result_values(result):
+    """生成結果のうち行に書き込む属性 (属性名 -> 値)"""
+    values = {field: result['fields'].get(field) for field in RESULT_FIELDS}
+    values['reason'] = result['reason']
+    values['engine'] = result['engine']
+    for name in ('promptStats', 'fallbackReason'):
+        if name in result:
+            values[name] = result[name]
+    return values
+
+def _recent_coordinates(user_id, target_date_str):
+    """着用履歴の集計用に、対象日の前 WEAR_WINDOW_DAYS 日分のコーデ (服ID・対象日・状態のみ) を返す"""
+    since = datetime.strptime(target_date_str, '%Y-%m-%d') - timedelta(days=coord_ranking.WEAR_WINDOW_DAYS)
+    fields = ['targetDate', 'processStatus', 'precomputed', 'outer_clothId', 'tops_clothId', 'bottoms_clothId', 'shoes_clothId']
+    names = {f"#p{i}": f for i, f in enumerate(fields)}
+    # 受け取られていない事前生成のコーデは着ていないので数えない
+    return [c for c in pagination.iter_query(resources.coordinate_table, {
+        'KeyConditionExpression': Key('userId').eq(user_id) & Key('createDatetime').gte(since.strftime('%Y-%m-%d')),
+        'ProjectionExpression': ', '.join(names),
+        'ExpressionAttributeNames': names,
+    }) if 'precomputed' not in c]
+
+# --- 翌日分の事前生成バッチ (task: coord_batch) ---
+# 対象日が翌日に切り替わった後 (天気の事前取得バッチの後)、翌日の天気が取得済みの全ユーザーについて
+# コーデを生成し、precomputed 付きの COMPLETED 行として登録しておく。朝の POST /coordinates は
+# その行を受け取って (precomputed を外して) 即座に返す。受け取られるまでは履歴・着用履歴に含めない。
+# Lambda の残り時間が少なくなったら新しいユーザーの生成をやめ、自分自身を非同期起動して続きを処理する
+# (生成済み・対象日の行があるユーザーは飛ばすため、同じ event で再実行できる)。
+BATCH_CONCURRENCY = int(os.environ.get('COORD_BATCH_CONCURRENCY', '4'))
+# 新しいユーザーの生成を始めるのに必要な残り時間 (AI のタイムアウト + 書き込み分)
+# 1 なら OpenAI Batch API 経由で生成する (event の batchApi で上書き可)
+BATCH_API = os.environ.get('COORD_BATCH_API', '0') == '1'
+BATCH_MIN_REMAINING_MS = int(os.environ.get('COORD_BATCH_MIN_REMAINING_MS', str(int(AI_TIMEOUT * 1000) + 15000)))
+
+def precompute_worker(event, context):
+    now_jst = datetime.now(JST)
+    target_date_str = event.get('targetDate') or get_target_date(now_jst)
+    if event.get('batchApi', BATCH_API):
+        # 1件ずつ呼ばずに OpenAI Batch API にまとめて投入する (結果は batch_poll が書き込む)
+        from services import batch_service
+        return batch_service.submit_worker({'kind': 'coordinate', 'targetDate': target_date_str}, context)
+    user_ids = [u['userId'] for u in user_repository.iter_current_users(['userId'])]
+    print(f"Coord batch started: {target_date_str}, {len(user_ids)} users")
+
+    def run(user_id):
+        if context.get_remaining_time_in_millis() < BATCH_MIN_REMAINING_MS:
+            return 'deferred'
+        try:
+            return _precompute(user_id, target_date_str, now_jst)
+        except Exception as e:
+            print(f"Coord batch: {user_id} failed: {e}")
+            return 'failed'
+
+    with ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY) as pool:
+        outcomes = list(pool.map(run, user_ids))
+    result = {'targetDate': target_date_str, 'users': len(user_ids)}
+    result.update({name: outcomes.count(name) for name in ('generated', 'skipped', 'staleWeather', 'failed', 'deferred')})
+
+    if result['deferred']:
+        resources.lambda_client.invoke(
+            FunctionName=context.function_name,
+            InvocationType='Event',
+            Payload=json.dumps({'task': 'coord_batch', 'targetDate': target_date_str, 'jobId': event.get('jobId')})
+        )
+    print(f"Coord batch completed: {json.dumps(result)}")
+    return result
+
+def _precompute(user_id, target_date_str, now_jst):
+    # 対象日の行が既にある (手動で生成済み・前回の実行で生成済み) なら作らない
+    if _rows_for_date(user_id, target_date_str):
+        return 'skipped'
+    inputs = _load_inputs(user_id, target_date_str)
+    if inputs['weather'].get('targetDate') != target_date_str:
+        return 'staleWeather'
+    result = _generate(inputs, None, 'ai')
+    resources.coordinate_table.put_item(Item={
+        'userId': user_id,
+        'createDatetime': now_jst.strftime('%Y-%m-%dT%H:%M:%S'),
+        'targetDate': target_date_str,
+        'anchorClothId': None,
+        'processStatus': 'COMPLETED',
+        'precomputed': 1,
+        'jobId': str(uuid.uuid4()),
+        'deleteFlag': 0,
+        **_result_values(result),
+    })
+    return 'generated'
+
+def _rows_for_date(user_id, target_date_str):
+    """対象日のコーデ行 (論理削除済みを除く)。事前生成は前日の夜に作られるため前日以降の行を見る"""
+    since = datetime.strptime(target_date_str, '%Y-%m-%d') - timedelta(days=1)
+    return [c for c in pagination.iter_query(resources.coordinate_table, {
+        'KeyConditionExpression': Key('userId').eq(user_id) & Key('createDatetime').gte(since.strftime('%Y-%m-%d')),
+    }) if c.get('targetDate') == target_date_str and c.get('deleteFlag', 0) == 0]
+
+def _claim_precomputed(user_id, target_date_str, now_jst):
+    """受け取られていない事前生成の行があれば受け取り済みにして返す (無ければ None)"""
+    for item in _rows_for_date(user_id, target_date_str):
+        if 'precomputed' not in item or item.get('processStatus') != 'COMPLETED':
+            continue
+        # 生成後に削除された服を含むなら使わない
+        ids = _cloth_ids(item)
+        clothes = cloth_repository.batch_get_clothes(user_id, ids, projection=['deleteFlag'])
+        if any(clothes.get(cid, {}).get('deleteFlag', 1) != 0 for cid in ids):
+            continue
+        # 同時に来た POST のどちらか一方だけが受け取れるよう条件付きで更新する
+        try:
+            resp = resources.coordinate_table.update_item(
+                Key={'userId': user_id, 'createDatetime': item['createDatetime']},
+                UpdateExpression='remove precomputed set claimDatetime = :c',
+                ConditionExpression='attribute_exists(precomputed)',
+                ExpressionAttributeValues={':c': now_jst.strftime('%Y-%m-%dT%H:%M:%S')},
+                ReturnValues='ALL_NEW'
+            )
+        except resources.coordinate_table.meta.client.exceptions.ConditionalCheckFailedException:
+            continue
+        return resp['Attributes']
+    return None
+
+# --- OpenAI Batch API 経由の事前生成 (batch_service から呼ばれる) ---
+# 投入時に PROCESSING の行 (precomputed, batchId, 通し番号順の clothId の idList) を作っておき、
+# 結果が返ったら番号を clothId に戻して COMPLETED にする。失敗・期限切れはルールベースで完了させる。
+
+def batch_request(user_id, target_date_str):
+    """1ユーザー分の依頼。(結果, 依頼) を返し、依頼は {'body', 'idList', 'promptStats'} (対象外なら None)"""
+    if _rows_for_date(user_id, target_date_str):
+        return 'skipped', None
+    inputs = _load_inputs(user_id, target_date_str)
+    if inputs['weather'].get('targetDate') != target_date_str:
+        return 'staleWeather', None
+    _, prompt, id_map, prompt_stats = _build_request(inputs, None)
+    return 'queued', {'body': chat_body(prompt), 'idList': [id_map[n] for n in sorted(id_map)], 'promptStats': prompt_stats}
+
+def save_batch_pending(user_id, create_datetime, target_date_str, batch_id, request):
+    resources.coordinate_table.put_item(Item={
+        'userId': user_id,
+        'createDatetime': create_datetime,
+        'targetDate': target_date_str,
+        'anchorClothId': None,
+        'processStatus': 'PROCESSING',
+        'precomputed': 1,
+        'batchId': batch_id,
+        'idList': request['idList'],
+        'promptStats': request['promptStats'],
+        'jobId': str(uuid.uuid4()),
+        'deleteFlag': 0,
+    })
+
+def apply_batch_result(user_id, create_datetime, content=None, error=None):
+    """Batch API の1件分の結果 (応答本文 content か エラー error) を行に書き込む。書き込めなければ False"""
+    item = resources.coordinate_table.get_item(Key={'userId': user_id, 'createDatetime': create_datetime}).get('Item')
+    if not item or item.get('processStatus') != 'PROCESSING' or 'idList' not in item:
+        return False
+    try:
+        if error:
+            raise Exception(error)
+        ai_data = json.loads(content)
+        id_map = {n: int(cid) for n, cid in enumerate(item['idList'], 1)}
+        # 投入後に削除された服は使わない
+        clothes = cloth_repository.batch_get_clothes(user_id, id_map.values(), projection=['category', 'deleteFlag'])
+        slots = {cid: coord_ranking.slot_of(c.get('category')) for cid, c in clothes.items() if c.get('deleteFlag', 0) == 0}
+        fields = _fields_from_reply(ai_data, id_map, slots)
+        if not any(fields.values()):
+            raise Exception("No usable clothes in reply")
+        result = {'fields': fields, 'reason': ai_data.get('reason'), 'engine': 'ai', 'promptStats': item.get('promptStats')}
+    except Exception as e:
+        print(f"DEBUG: Batch result unusable, falling back to rules: {e}")
+        fields, reason = coord_ranking.assemble_outfit(*_rules_inputs(user_id, item['targetDate']))
+        result = {'fields': fields, 'reason': reason, 'engine': 'rules', 'fallbackReason': str(e)[:200]}
+
+    values = _result_values(result)
+    try:
+        resources.coordinate_table.update_item(
+            Key={'userId': user_id, 'createDatetime': create_datetime},
+            UpdateExpression="set processStatus=:s, " + ', '.join(f"{name}=:{name}" for name in values) + " remove idList",
+            ConditionExpression='processStatus = :p',
+            ExpressionAttributeValues={':s': 'COMPLETED', ':p': 'PROCESSING', **{f":{name}": value for name, value in values.items()}}
         )
+        return True
+    except resources.coordinate_table.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+
+def _rules_inputs(user_id, target_date_str):
+    inputs = _load_inputs(user_id, target_date_str)
+    return inputs['clothes'], inputs['weather'], inputs['season'], inputs['weeklyStyle'], None, inputs['worn']
 
 # --- 4. 履歴取得 (既存機能) ---
 def get_history(event, headers):
@@ -234,66 +515,117 @@ def get_history(event, headers):
         user_id = params.get('userId')
         if not user_id: return {"statusCode": 400, "headers": headers, "body": json.dumps({"message": "userId required"})}
 
-        coord_resp = resources.coordinate_table.query(KeyConditionExpression=Key('userId').eq(user_id), ScanIndexForward=False)
-        cloth_resp = resources.cloth_table.query(KeyConditionExpression=Key('userId').eq(user_id))
-        cloth_map = {int(c['clothId']): c for c in cloth_resp.get('Items', [])}
-        
-        history = []
-        seen = set()
-        
-        for item in coord_resp.get('Items', []):
-            if item.get('deleteFlag', 0) == 1: continue
-            
+        try:
+            limit, cursor = pagination.parse_page_params(params)
+            start_key, cursor_extra = pagination.decode_cursor(cursor)
+            size = image_service.parse_size(params)
+        except ValueError as e:
+            return {"statusCode": 400, "headers": headers, "body": json.dumps({"message": str(e)})}
+
+        # 同じ targetDate の行は createDatetime 順で連続するため、ページ跨ぎの重複除外は
+        # 直前ページ最後の targetDate (cursor に保持) だけ引き継げば足りる
+        seen = {cursor_extra['d']} if cursor_extra.get('d') else set()
+
+        def accept(item):
+            if item.get('deleteFlag', 0) == 1: return False
             # ★未完了のデータは履歴に出さない
             if item.get('processStatus') and item.get('processStatus') != 'COMPLETED':
-                continue
-
-            if item['targetDate'] in seen: continue
+                return False
+            # 受け取られていない事前生成のコーデも出さない
+            if 'precomputed' in item: return False
+            if item['targetDate'] in seen: return False
             seen.add(item['targetDate'])
-            
+            return True
+
+        query_kwargs = {'KeyConditionExpression': Key('userId').eq(user_id), 'ScanIndexForward': False}
+        next_key = None
+        if limit is None:
+            rows = [item for item in pagination.iter_query(resources.coordinate_table, query_kwargs) if accept(item)]
+        else:
+            if start_key: start_key['userId'] = user_id
+            rows, next_key = pagination.query_page(
+                resources.coordinate_table, query_kwargs, limit, ('userId', 'createDatetime'),
+                start_key=start_key, accept=accept
+            )
+
+        # 返却する行が参照する服だけを取得 (更新前の服も参照するため論理削除済みも対象)
+        cloth_map = cloth_repository.batch_get_clothes(user_id, [cid for item in rows for cid in _cloth_ids(item)])
+
+        # 履歴全体で使う画像URLをまとめて署名する
+        urls = [item.get('tryOnImageUrl') for item in rows]
+        for item in rows:
+            for cid in _cloth_ids(item):
+                c = cloth_map.get(cid) or {}
+                urls.extend((c.get('imageUrl'), _display_url(c, size)))
+        signed = _sign_map(urls)
+
+        history = []
+        for item in rows:
             h_item = item.copy()
-            _attach_full_cloth_data(h_item, cloth_map)
+            _attach_full_cloth_data(h_item, cloth_map, signed, size)
             
             if item.get('tryOnImageUrl'):
-                h_item['tryOnImage'] = sign_s3_url(item['tryOnImageUrl'])
+                h_item['tryOnImage'] = signed.get(item['tryOnImageUrl'])
                 
             history.append(h_item)
             
-        return {"statusCode": 200, "headers": headers, "body": json.dumps(history, default=str, ensure_ascii=False)}
+        if limit is None:
+            return {"statusCode": 200, "headers": headers, "body": json.dumps(history, default=str, ensure_ascii=False)}
+        next_cursor = pagination.encode_cursor(next_key, d=rows[-1]['targetDate']) if next_key else None
+        body = {"items": history, "nextCursor": next_cursor}
+        return {"statusCode": 200, "headers": headers, "body": json.dumps(body, default=str, ensure_ascii=False)}
     except Exception as e:
         return {"statusCode": 500, "headers": headers, "body": json.dumps({"message": "Error", "error": str(e)})}
 
 # --- Helpers ---
-def _attach_images(data, url_map):
-    if data.get('outer_clothId'): data['outer_image'] = sign_s3_url(url_map.get(int(data['outer_clothId'])))
-    if data.get('bottoms_clothId'): data['bottoms_image'] = sign_s3_url(url_map.get(int(data['bottoms_clothId'])))
-    if data.get('shoes_clothId'): data['shoes_image'] = sign_s3_url(url_map.get(int(data['shoes_clothId'])))
+def _cloth_ids(data):
+    ids = []
+    for field in ('outer_clothId', 'bottoms_clothId', 'shoes_clothId'):
+        if data.get(field): ids.append(int(data[field]))
+    for tid in data.get('tops_clothId') or []:
+        ids.append(int(tid))
+    return ids
+
+def _display_url(c, size):
+    """一覧表示に使う画像URL (派生画像があればそれ、無ければ元画像)"""
+    return image_service.variant_url(c.get('imageUrl'), c.get('imageVariants'), size) or c.get('imageUrl')
+
+def _sign_map(urls):
+    """URL -> 署名付きURL の辞書をまとめて作る"""
+    urls = list(dict.fromkeys(u for u in urls if u))
+    return dict(zip(urls, sign_s3_urls(urls)))
+
+def _attach_images(data, url_map, signed):
+    if data.get('outer_clothId'): data['outer_image'] = signed.get(url_map.get(int(data['outer_clothId'])))
+    if data.get('bottoms_clothId'): data['bottoms_image'] = signed.get(url_map.get(int(data['bottoms_clothId'])))
+    if data.get('shoes_clothId'): data['shoes_image'] = signed.get(url_map.get(int(data['shoes_clothId'])))
     if data.get('tops_clothId'):
-        data['tops_images'] = [sign_s3_url(url_map.get(int(tid))) for tid in data['tops_clothId'] if int(tid) in url_map]
+        data['tops_images'] = [signed.get(url_map.get(int(tid))) for tid in data['tops_clothId'] if int(tid) in url_map]
 
-def _attach_full_cloth_data(data, full_map):
+def _attach_full_cloth_data(data, full_map, signed, size=image_service.DEFAULT_SIZE):
     def _get_signed(c):
         cp = c.copy()
-        cp['imageUrl'] = sign_s3_url(c.get('imageUrl'))
+        cp['imageUrl'] = signed.get(c.get('imageUrl'), c.get('imageUrl'))
+        cp['thumbnailUrl'] = signed.get(_display_url(c, size), cp['imageUrl'])
         return cp
 
     if data.get('outer_clothId'):
         c = full_map.get(int(data['outer_clothId']))
         if c: 
             data['outer_cloth'] = _get_signed(c)
-            data['outer_image'] = data['outer_cloth']['imageUrl']
+            data['outer_image'] = data['outer_cloth']['thumbnailUrl']
             
     if data.get('bottoms_clothId'):
         c = full_map.get(int(data['bottoms_clothId']))
         if c:
             data['bottoms_cloth'] = _get_signed(c)
-            data['bottoms_image'] = data['bottoms_cloth']['imageUrl']
+            data['bottoms_image'] = data['bottoms_cloth']['thumbnailUrl']
             
     if data.get('shoes_clothId'):
         c = full_map.get(int(data['shoes_clothId']))
         if c:
             data['shoes_cloth'] = _get_signed(c)
-            data['shoes_image'] = data['shoes_cloth']['imageUrl']
+            data['shoes_image'] = data['shoes_cloth']['thumbnailUrl']
 
     if data.get('tops_clothId'):
         data['tops_clothes'] = []
@@ -303,4 +635,4 @@ def _attach_full_cloth_data(data, full_map):
             if c:
                 signed_c = _get_signed(c)
                 data['tops_clothes'].append(signed_c)
-                data['tops_images'].append(signed_c['imageUrl'])
\ No newline at end of file
+                data['tops_images'].append(signed_c['thumbnailUrl'])
\ No newline at end of file
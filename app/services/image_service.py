@@ -0,0 +1,95 @@
+import base64
+import json
+import os
+import resources
+from repositories import cloth_repository, user_repository
+from utils import images
+from utils.helpers import s3_key_from_url
+
+# アップロード画像の派生画像 (一覧用サムネイル等) の生成。
+# 服・プロフィールの登録時に非同期ワーカーを起動し、元画像1枚から DERIVATIVE_SIZES の各サイズを作って
+# derived/<サイズ名>/ 配下に保存する。作成済みのサイズは行の imageVariants に記録し、一覧APIはそれを見て返す。
+
+DERIVATIVE_FORMAT = os.environ.get('IMAGE_DERIVATIVE_FORMAT', 'WEBP').upper()
+DERIVATIVE_QUALITY = int(os.environ.get('IMAGE_DERIVATIVE_QUALITY', '80'))
+DEFAULT_SIZE = 'small'
+# 派生画像はキーが元画像ごとに固有で内容が変わらないため、長期キャッシュさせる
+CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+def _object_url(key):
+    return f"https://{resources.BUCKET_NAME}.s3.{resources.REGION}.amazonaws.com/{key}"
+
+def parse_size(params):
+    """クエリパラメータ size を検証して返す ('original' は派生画像を使わない)。不正な値は ValueError"""
+    size = params.get('size') or DEFAULT_SIZE
+    if size != 'original' and size not in images.DERIVATIVE_SIZES:
+        raise ValueError(f"size must be one of: {', '.join([*images.DERIVATIVE_SIZES, 'original'])}")
+    return size
+
+def variant_url(image_url, variants, size):
+    """派生画像が作成済みならその (未署名の) URL を、無ければ None を返す"""
+    if not image_url or size not in (variants or ()):
+        return None
+    return _object_url(images.derived_key(s3_key_from_url(image_url), size, DERIVATIVE_FORMAT))
+
+def data_url(image_url, variants=None, size='medium'):
+    """S3 の画像を data URL にする (期限切れの無い形で AI に渡す用)。派生画像があればそれを使う"""
+    key = s3_key_from_url(image_url)
+    if size in (variants or ()):
+        key = images.derived_key(key, size, DERIVATIVE_FORMAT)
+    obj = resources.s3_client.get_object(Bucket=resources.BUCKET_NAME, Key=key)
+    content_type = obj.get('ContentType') or 'image/jpeg'
+    return f"data:{content_type};base64,{base64.b64encode(obj['Body'].read()).decode('ascii')}"
+
+def request_derivatives(context, target, user_id, image_url, cloth_id=None):
+    """派生画像の生成ワーカーを非同期起動する。失敗しても元のリクエストは成功させる"""
+    if not image_url or not resources.BUCKET_NAME or resources.BUCKET_NAME not in image_url:
+        return
+    payload = {'task': 'derivative_worker', 'target': target, 'userId': user_id, 'imageUrl': image_url}
+    if cloth_id is not None:
+        payload['clothId'] = int(cloth_id)
+    try:
+        resources.lambda_client.invoke(
+            FunctionName=context.function_name,
+            InvocationType='Event',
+            Payload=json.dumps(payload)
+        )
+    except Exception as e:
+        print(f"Derivative request failed: {e}")
+
+def _missing_sizes(key):
+    missing = []
+    for size in images.DERIVATIVE_SIZES:
+        try:
+            resources.s3_client.head_object(Bucket=resources.BUCKET_NAME, Key=images.derived_key(key, size, DERIVATIVE_FORMAT))
+        except resources.s3_client.exceptions.ClientError:
+            missing.append(size)
+    return missing
+
+def derivative_worker(event):
+    """元画像から派生画像を作って保存し、対象の行に imageVariants を記録する"""
+    image_url = event['imageUrl']
+    key = s3_key_from_url(image_url)
+    try:
+        # 同じ画像で再登録された場合 (服の編集など) は作成済みの派生画像を使い回す
+        missing = _missing_sizes(key)
+        if missing:
+            obj = resources.s3_client.get_object(Bucket=resources.BUCKET_NAME, Key=key)
+            sizes = {size: images.DERIVATIVE_SIZES[size] for size in missing}
+            for size, (data, content_type) in images.make_derivatives(
+                obj['Body'].read(), sizes, DERIVATIVE_QUALITY, DERIVATIVE_FORMAT
+            ).items():
+                resources.s3_client.put_object(
+                    Bucket=resources.BUCKET_NAME, Key=images.derived_key(key, size, DERIVATIVE_FORMAT),
+                    Body=data, ContentType=content_type, CacheControl=CACHE_CONTROL
+                )
+
+        variants = list(images.DERIVATIVE_SIZES)
+        if event['target'] == 'cloth':
+            cloth_repository.set_image_variants(event['userId'], event['clothId'], image_url, variants)
+        else:
+            user_repository.set_image_variants(event['userId'], image_url, variants)
+        print(f"Derivatives ready: {key} (generated {len(missing)})")
+    except Exception as e:
+        # 派生画像が無くても一覧は元画像で表示できるため、記録だけして終える
+        print(f"Derivative Worker Error ({key}): {e}")
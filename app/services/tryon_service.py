@@ -1,17 +1,50 @@
 import json
+import time
 import uuid
 import os
-import requests
+import re
+import hashlib
+import itertools
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 # import boto3
 import base64
-# from PIL import Image
-# from io import BytesIO
-from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.conditions import Attr
+from boto3.dynamodb.types import TypeDeserializer
 import resources
-from utils.helpers import sign_s3_url
+from repositories import cloth_repository, user_repository
+from utils import http_client, images, tracing
+from utils.helpers import sign_s3_url, s3_key_from_url
 
 # Google API設定
 GOOGLE_GENAI_KEY = os.environ.get('GOOGLE_GENAI_KEY')
+# 生成画像の受け取り: レスポンスは逐次読みし、この大きさまではメモリ、超えたら /tmp に書く
+RESPONSE_CHUNK_SIZE = 64 * 1024
+SPOOL_MAX_BYTES = 4 * 1024 * 1024
+# 画像パートの base64 の開始位置 ("inlineData": {"mimeType": "...", "data": ")。
+# APIのバージョンによって inlineData (Camel) か inline_data (Snake) か異なるため両方対象にする
+_INLINE_DATA = re.compile(rb'"(?:inlineData|inline_data)"\s*:\s*\{[^{}]*?"data"\s*:\s*"')
+_HEX4 = re.compile(rb'[0-9A-Fa-f]{4}')
+_HEX_PREFIX = re.compile(rb'[0-9A-Fa-f]{0,3}')
+
+# Gemini に送る画像の正規化設定 (長辺px・品質・形式)。派生画像のキャッシュキーにも使う
+TRYON_IMAGE_MAX_EDGE = int(os.environ.get('TRYON_IMAGE_MAX_EDGE', '1024'))
+TRYON_IMAGE_QUALITY = int(os.environ.get('TRYON_IMAGE_QUALITY', '85'))
+TRYON_IMAGE_FORMAT = os.environ.get('TRYON_IMAGE_FORMAT', 'JPEG').upper()
+TRYON_IMAGE_VARIANT = f"tryon-{TRYON_IMAGE_MAX_EDGE}-q{TRYON_IMAGE_QUALITY}"
+
+# 生成結果キャッシュ: 同じ人物写真・同じ服の組み合わせ・同じプロンプトなら生成済み画像を再利用する。
+# プロンプトや生成設定を変えたら PROMPT_VERSION を上げる (古い結果はキーが変わり使われなくなる)
+MODEL_NAME = "gemini-3-pro-image-preview"
+PROMPT_VERSION = 1
+RESULT_PREFIX = 'tryon/'
+
+# 受付済みジョブの有効期限 (秒)。関数のタイムアウト(120秒)より長くし、過ぎても PROCESSING のままなら
+# ワーカーが異常終了したとみなして次のリクエストを受け付ける
+LEASE_SECONDS = int(os.environ.get('TRYON_LEASE_SECONDS', '180'))
+
+class JobSuperseded(Exception):
+    """より新しいジョブが受け付けられたため、このジョブの結果は書き込まない"""
 
 def start_try_on(event, headers, context):
     try:
@@ -23,7 +56,32 @@ def start_try_on(event, headers, context):
             return {"statusCode": 400, "headers": headers, "body": json.dumps({"message": "Missing params"})}
 
         job_id = str(uuid.uuid4())
+
+        # 同じ組み合わせの生成済み画像があれば、ワーカーを起動せずその場で完了にする
+        # (処理中のジョブがあれば書き込まず、下の受付でそのジョブに合流させる)
+        try:
+            cache_key = _result_key(*_load_inputs(user_id, coord_id))
+            if _result_exists(cache_key):
+                s3_url = _complete(user_id, coord_id, job_id, cache_key, cached=True)
+                print(f"DEBUG: Try-on cache hit: {cache_key}")
+                return {"statusCode": 202, "headers": headers, "body": json.dumps({
+                    "message": "Completed", "jobId": job_id, "status": "COMPLETED", "imageUrl": sign_s3_url(s3_url)
+                })}
+        except JobSuperseded:
+            print("DEBUG: Try-on cache hit not recorded: job in progress")
+        except Exception as e:
+            # 入力不備などはワーカー側で FAILED として記録されるため、ここでは通常の非同期処理に回す
+            print(f"DEBUG: Try-on cache lookup skipped: {e}")
         
+        # 受付 (条件付き書き込み): 処理中のジョブがあれば新しいワーカーは起動せず、そのジョブに合流させる
+        try:
+            running_job_id = _admit(user_id, coord_id, job_id)
+        except LookupError:
+            return {"statusCode": 404, "headers": headers, "body": json.dumps({"message": "Not found"})}
+        if running_job_id:
+            print(f"DEBUG: Try-on already processing: {running_job_id}")
+            return {"statusCode": 202, "headers": headers, "body": json.dumps({"message": "Already processing", "jobId": running_job_id})}
+
         payload = {
             'task': 'try_on_worker',
             'jobId': job_id,
@@ -31,17 +89,16 @@ def start_try_on(event, headers, context):
             'coordinateId': coord_id
         }
         
-        resources.lambda_client.invoke(
-            FunctionName=context.function_name,
-            InvocationType='Event',
-            Payload=json.dumps(payload)
-        )
-        
-        resources.coordinate_table.update_item(
-            Key={'userId': user_id, 'createDatetime': coord_id},
-            UpdateExpression="set tryOnJobId = :j, tryOnStatus = :s",
-            ExpressionAttributeValues={':j': job_id, ':s': 'PROCESSING'}
-        )
+        try:
+            resources.lambda_client.invoke(
+                FunctionName=context.function_name,
+                InvocationType='Event',
+                Payload=json.dumps(payload)
+            )
+        except Exception as e:
+            # 起動できなかったジョブで期限まで受付を塞がないよう失敗にしておく
+            _fail(user_id, coord_id, job_id, f"Invoke failed: {e}"[:200])
+            raise
 
         return {"statusCode": 202, "headers": headers, "body": json.dumps({"message": "Accepted", "jobId": job_id})}
     except Exception as e:
@@ -61,6 +118,9 @@ def check_try_on(event, headers):
         url = item.get('tryOnImageUrl')
         if url: url = sign_s3_url(url)
         fail_reason = item.get('tryOnFailReason', '')
+        if status == 'PROCESSING' and _lease_expired(item):
+            # ワーカーが結果を書けずに終了した (タイムアウト等)
+            status, fail_reason = 'FAILED', 'Timed out'
         
         return {"statusCode": 200, "headers": headers, "body": json.dumps({"status": status, "imageUrl": url, "failReason": fail_reason})}
     except Exception as e:
@@ -71,56 +131,31 @@ def worker(event):
     job_id = event['jobId']
     user_id = event['userId']
     coord_id = event['coordinateId']
-    
+    # ここまで (サービスモジュールの import 等) を init、以降を各フェーズとして記録する
+    tracing.lap('init')
     try:
         # --- 1. データ収集 ---
-        user_resp = resources.user_table.query(KeyConditionExpression=Key('userId').eq(user_id), ScanIndexForward=False, Limit=1)
-        if not user_resp['Items']: raise Exception("User not found")
-        user_data = user_resp['Items'][0]
-        
-        coord_resp = resources.coordinate_table.get_item(Key={'userId': user_id, 'createDatetime': coord_id})
-        if 'Item' not in coord_resp: raise Exception("Coordinate not found")
-        coord_data = coord_resp['Item']
-        
-        # 画像データを格納するリスト (API送信順序用: [ユーザー写真, 服1, 服2...])
-        image_parts = []
-        
-        # 1-1. ユーザー写真取得
-        user_img_url = user_data.get('imageLink')
-        if user_img_url:
-            img_bytes, mime = _download_image_as_base64(user_img_url)
-            image_parts.append({
-                "inline_data": {
-                    "mime_type": mime,
-                    "data": img_bytes
-                }
-            })
-        else:
-            raise Exception("User profile image required")
+        user_img_url, clothes = _load_inputs(user_id, coord_id, job_id)
+        # プロンプト補強用にテキスト情報も記録
+        cloth_descriptions = [f"{c.get('color')} {c.get('category')}" for c in clothes]
+        cache_key = _result_key(user_img_url, clothes)
+        tracing.lap('records')
 
-        # 1-2. 服写真取得
-        target_cloth_ids = []
-        if coord_data.get('outer_clothId'): target_cloth_ids.append(int(coord_data['outer_clothId']))
-        if coord_data.get('tops_clothId'): target_cloth_ids.extend([int(tid) for tid in coord_data['tops_clothId']])
-        if coord_data.get('bottoms_clothId'): target_cloth_ids.append(int(coord_data['bottoms_clothId']))
-        if coord_data.get('shoes_clothId'): target_cloth_ids.append(int(coord_data['shoes_clothId']))
+        # 受付後に同じ組み合わせの生成が完了していれば再利用する
+        if _result_exists(cache_key):
+            _complete(user_id, coord_id, job_id, cache_key, owned=True, cached=True)
+            print(f"DEBUG: Worker completed from cache: {json.dumps(tracing.phase_durations())}")
+            return
 
-        cloth_descriptions = []
-        
-        for cid in target_cloth_ids:
-            c_resp = resources.cloth_table.get_item(Key={'userId': user_id, 'clothId': cid})
-            if 'Item' in c_resp:
-                c = c_resp['Item']
-                if c.get('imageUrl'):
-                    img_bytes, mime = _download_image_as_base64(c['imageUrl'])
-                    image_parts.append({
-                        "inline_data": {
-                            "mime_type": mime,
-                            "data": img_bytes
-                        }
-                    })
-                    # プロンプト補強用にテキスト情報も記録
-                    cloth_descriptions.append(f"{c.get('color')} {c.get('category')}")
+        # 1-1. ユーザー写真・服写真を S3 から並列取得 (API送信順序: [ユーザー写真, 服1, 服2...])
+        image_urls = [user_img_url] + [c['imageUrl'] for c in clothes]
+        with ThreadPoolExecutor(max_workers=len(image_urls)) as pool:
+            downloaded = list(pool.map(_download_image_as_base64, image_urls))
+        image_parts = [
+            {"inline_data": {"mime_type": mime, "data": img_b64}}
+            for img_b64, mime in downloaded
+        ]
+        tracing.lap('download')
 
         if len(image_parts) < 2:
             raise Exception("At least one cloth image is required")
@@ -129,8 +164,7 @@ def worker(event):
         print(f"DEBUG: Calling Google Gemini 3 Pro with {len(image_parts)} images...")
         
         # モデル名: ユーザー指定のプレビューモデル
-        model_name = "gemini-3-pro-image-preview" 
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_name}:generateContent?key={GOOGLE_GENAI_KEY}"
+        url = f"{resources.GEMINI_API_BASE}/v1beta/models/{MODEL_NAME}:generateContent?key={GOOGLE_GENAI_KEY}"
         
         # プロンプト: 1枚目が人物、2枚目以降が服であることを明示
         prompt_text = f"""
@@ -165,83 +199,264 @@ def worker(event):
             }
         }
         
-        response = requests.post(url, json=payload, headers={'Content-Type': 'application/json'})
-        
-        if response.status_code != 200:
-            raise Exception(f"Google API Error ({response.status_code}): {response.text}")
-            
-        result = response.json()
-        
-        # --- 3. 画像データの抽出 (修正箇所) ---
-        try:
-            candidates = result.get('candidates', [])
-            if not candidates: raise Exception("No candidates returned")
-            
-            parts = candidates[0].get('content', {}).get('parts', [])
-            img_b64 = None
-            
-            for part in parts:
-                # ★修正: APIのバージョンによって inlineData (Camel) か inline_data (Snake) か異なるため両方チェック
-                if 'inlineData' in part:
-                    img_b64 = part['inlineData']['data']
-                    break
-                if 'inline_data' in part:
-                    img_b64 = part['inline_data']['data']
-                    break
+        # レスポンスは stream=True で受け、JSON全体・base64文字列全体をメモリに載せない
+        with http_client.post('gemini', url, json=payload, headers={'Content-Type': 'application/json'}, stream=True) as response:
+            # 送信済みの入力画像 (base64) はここで手放す
+            payload = image_parts = downloaded = None
             
-            if not img_b64:
-                print(f"DEBUG: No image data found. Response: {json.dumps(result)[:200]}...")
-                raise Exception("Model returned text but no image data")
-                
-            img_data = base64.b64decode(img_b64)
-
-        except Exception as parse_err:
-            raise Exception(f"Failed to parse image: {parse_err}")
-
-        # --- 4. S3保存 ---
-        print("DEBUG: Saving to S3...")
-        file_name = f"tryon_{job_id}.png"
-        resources.s3_client.put_object(
-            Bucket=resources.BUCKET_NAME, 
-            Key=file_name, 
-            Body=img_data, 
-            ContentType='image/png'
-        )
-        s3_url = f"https://{resources.BUCKET_NAME}.s3.ap-northeast-1.amazonaws.com/{file_name}"
+            if response.status_code != 200:
+                raise Exception(f"Google API Error ({response.status_code}): {response.text}")
 
-        # --- 5. 完了更新 ---
-        resources.coordinate_table.update_item(
-            Key={'userId': user_id, 'createDatetime': coord_id},
-                UpdateExpression="SET tryOnStatus = :s, tryOnImageUrl = :u ADD tryOnSuccessCount :inc",
-                ExpressionAttributeValues={
-                    ':s': 'COMPLETED',
-                    ':u': s3_url,
-                    ':inc': 1  # 加算する値
-                },
-        )
-        print("DEBUG: Worker completed successfully")
+            with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES) as img_file:
+                # --- 3. 画像データの抽出 (受信しながら base64 を順次デコード) ---
+                try:
+                    size = _extract_inline_image(response.iter_content(chunk_size=RESPONSE_CHUNK_SIZE), img_file)
+                except Exception as parse_err:
+                    raise Exception(f"Failed to parse image: {parse_err}")
+                if not size:
+                    raise Exception("Failed to parse image: Model returned text but no image data")
+                tracing.lap('generate')
+
+                # --- 4. S3保存 (入力から決まるキャッシュキーで保存し、同じ組み合わせの試着で再利用する) ---
+                print(f"DEBUG: Saving to S3... ({size} bytes)")
+                img_file.seek(0)
+                resources.s3_client.upload_fileobj(
+                    img_file, resources.BUCKET_NAME, cache_key,
+                    ExtraArgs={'ContentType': 'image/png'}
+                )
+                tracing.lap('upload')
 
+        # --- 5. 完了更新 (このジョブが最新の受付である場合のみ) ---
+        _complete(user_id, coord_id, job_id, cache_key, owned=True)
+        print(f"DEBUG: Worker completed successfully: {json.dumps(tracing.phase_durations())}")
+
+    except JobSuperseded:
+        print(f"DEBUG: Worker superseded, exiting: {job_id} {json.dumps(tracing.phase_durations())}")
     except Exception as e:
-        print(f"ERROR in Worker: {e}")
-        error_msg = str(e)[:200]
+        print(f"ERROR in Worker: {e} {json.dumps(tracing.phase_durations())}")
         try:
-            resources.coordinate_table.update_item(
-                Key={'userId': user_id, 'createDatetime': coord_id},
-                UpdateExpression="set tryOnStatus = :s, tryOnFailReason = :r",
-                ExpressionAttributeValues={':s': 'FAILED', ':r': error_msg}
-            )
+            _fail(user_id, coord_id, job_id, str(e)[:200])
         except Exception as db_e:
             print(f"CRITICAL: DB Write Error: {db_e}")
 
-def _download_image_as_base64(url):
-    """S3等のURLから画像をDLし、Gemini API用のBase64文字列とMIMEタイプを返す"""
-    signed_url = sign_s3_url(url)
-    resp = requests.get(signed_url)
-    if resp.status_code != 200:
-        raise Exception(f"Failed to download image: {url}")
+def _extract_inline_image(chunks, out):
+    """generateContent の JSON レスポンス (バイト列のチャンク) を逐次読み、最初の画像パートを out にデコードして書き込む。
+    書き込んだバイト数を返す (画像パートが無ければ 0)"""
+    chunks = iter(chunks)
+    head, buf = b'', b''
+    for chunk in chunks:
+        head += chunk[:200 - len(head)]
+        buf += chunk
+        match = _INLINE_DATA.search(buf)
+        if match:
+            break
+        # 画像パートの開始部分がチャンク境界をまたいでも見つけられるよう末尾だけ残す
+        buf = buf[-1024:]
+    else:
+        print(f"DEBUG: No image data found. Response: {head.decode('utf-8', 'replace')}...")
+        return 0
+
+    written, carry, pending = 0, b'', b''
+    for piece in itertools.chain([buf[match.end():]], chunks):
+        # チャンク末尾で途切れたエスケープ (pending) は次のチャンクとつなげて解く
+        piece = pending + piece
+        end = piece.find(b'"')
+        text, pending = _unescape_json(piece if end < 0 else piece[:end])
+        carry += text
+        usable = len(carry) // 4 * 4
+        if usable:
+            decoded = base64.b64decode(carry[:usable], validate=True)
+            out.write(decoded)
+            written += len(decoded)
+            carry = carry[usable:]
+        if end >= 0:
+            break
+    else:
+        raise Exception("Response ended inside image data")
+    if pending:
+        raise Exception(f"Unexpected JSON escape in image data: {pending[:6]!r}")
+    if carry:
+        raise Exception("Invalid base64 image data")
+    return written
+
+def _unescape_json(data):
+    """JSON 文字列の一部 (バイト列) のエスケープを解く。base64 に現れうる \\uXXXX (ASCII), \\/, \\\\ のみ扱い、
+    それ以外のエスケープは例外にする。(解いたバイト列, 末尾で途切れたエスケープ) を返す"""
+    parts, pos = [], 0
+    while True:
+        i = data.find(b'\\', pos)
+        if i < 0:
+            parts.append(data[pos:])
+            return b''.join(parts), b''
+        parts.append(data[pos:i])
+        kind = data[i + 1:i + 2]
+        if kind in (b'/', b'\\'):
+            parts.append(kind)
+            pos = i + 2
+        elif kind == b'u' and len(data) >= i + 6:
+            code = data[i + 2:i + 6]
+            if not _HEX4.fullmatch(code) or int(code, 16) > 0x7f:
+                raise Exception(f"Unexpected JSON escape in image data: {data[i:i + 6]!r}")
+            parts.append(bytes([int(code, 16)]))
+            pos = i + 6
+        elif kind in (b'', b'u') and _HEX_PREFIX.fullmatch(data[i + 2:]):
+            # エスケープの途中でデータが終わった
+            return b''.join(parts), data[i:]
+        else:
+            raise Exception(f"Unexpected JSON escape in image data: {data[i:i + 6]!r}")
+
+def _admit(user_id, coord_id, job_id):
+    """ジョブを受け付ける。受付できれば None、処理中の (期限内の) ジョブがあればそのジョブIDを返す"""
+    now = int(time.time())
+    table = resources.coordinate_table
+    try:
+        table.update_item(
+            Key={'userId': user_id, 'createDatetime': coord_id},
+            UpdateExpression="set tryOnJobId = :j, tryOnStatus = :s, tryOnLeaseExpiresAt = :e",
+            ConditionExpression=_admittable(now),
+            ExpressionAttributeValues={':j': job_id, ':s': 'PROCESSING', ':e': now + LEASE_SECONDS},
+            ReturnValuesOnConditionCheckFailure='ALL_OLD'
+        )
+        return None
+    except table.meta.client.exceptions.ConditionalCheckFailedException as e:
+        old = e.response.get('Item')
+        if not old:
+            raise LookupError("Coordinate not found")
+        return TypeDeserializer().deserialize({'M': old}).get('tryOnJobId')
+
+def _admittable(now):
+    """新しいジョブを受け付けられる条件: コーデがあり、処理中 (期限内) のジョブが無い"""
+    return Attr('userId').exists() & (
+        Attr('tryOnStatus').not_exists() | Attr('tryOnStatus').ne('PROCESSING')
+        | Attr('tryOnLeaseExpiresAt').not_exists() | Attr('tryOnLeaseExpiresAt').lt(now)
+    )
+
+def _lease_expired(item):
+    expires_at = item.get('tryOnLeaseExpiresAt')
+    return expires_at is not None and int(expires_at) < time.time()
+
+def _fail(user_id, coord_id, job_id, reason):
+    """このジョブが最新の受付である場合のみ失敗を記録する"""
+    table = resources.coordinate_table
+    try:
+        table.update_item(
+            Key={'userId': user_id, 'createDatetime': coord_id},
+            UpdateExpression="set tryOnStatus = :s, tryOnFailReason = :r, tryOnPhaseDurations = :p remove tryOnLeaseExpiresAt",
+            ConditionExpression=Attr('tryOnJobId').eq(job_id),
+            ExpressionAttributeValues={':s': 'FAILED', ':r': reason, ':p': tracing.phase_durations()}
+        )
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        print(f"DEBUG: Failure of superseded job not recorded: {job_id}")
+
+def _load_inputs(user_id, coord_id, job_id=None):
+    """試着の入力 (ユーザー写真URL, 服のリスト) を取得する。服はコーデの並び順 (outer, tops, bottoms, shoes)
+
+    job_id を渡した場合、コーデの受付中ジョブが別のジョブに替わっていれば JobSuperseded
+    """
+    user_data = user_repository.get_current_user(user_id)
+    if not user_data: raise Exception("User not found")
+    
+    coord_resp = resources.coordinate_table.get_item(Key={'userId': user_id, 'createDatetime': coord_id})
+    if 'Item' not in coord_resp: raise Exception("Coordinate not found")
+    coord_data = coord_resp['Item']
+    if job_id and coord_data.get('tryOnJobId') != job_id:
+        raise JobSuperseded(job_id)
     
-    # データをPILで読み込んでJPEG/PNGに統一しても良いが、
-    # ここではそのままBase64化する (Geminiは主要フォーマットに対応)
-    content_type = resp.headers.get('Content-Type', 'image/jpeg')
-    b64_data = base64.b64encode(resp.content).decode('utf-8')
-    return b64_data, content_type
\ No newline at end of file
+    user_img_url = user_data.get('imageLink')
+    if not user_img_url:
+        raise Exception("User profile image required")
+
+    target_cloth_ids = []
+    if coord_data.get('outer_clothId'): target_cloth_ids.append(int(coord_data['outer_clothId']))
+    if coord_data.get('tops_clothId'): target_cloth_ids.extend([int(tid) for tid in coord_data['tops_clothId']])
+    if coord_data.get('bottoms_clothId'): target_cloth_ids.append(int(coord_data['bottoms_clothId']))
+    if coord_data.get('shoes_clothId'): target_cloth_ids.append(int(coord_data['shoes_clothId']))
+
+    # 服情報は BatchGetItem 1回で取得
+    cloth_map = cloth_repository.batch_get_clothes(user_id, target_cloth_ids, projection=['imageUrl', 'color', 'category'])
+    clothes = [cloth_map[cid] for cid in target_cloth_ids if cid in cloth_map and cloth_map[cid].get('imageUrl')]
+    return user_img_url, clothes
+
+def _result_key(user_img_url, clothes):
+    """生成結果の S3 キー。人物写真・服 (ID/画像/プロンプトに使う属性)・プロンプト版から決まる
+
+    画像キーはアップロードごとに一意なため、写真や服画像の差し替えはキーの変化として反映される。
+    服はコーデ上の並びに依らないよう clothId 順にする。
+    """
+    material = {
+        'v': PROMPT_VERSION,
+        'model': MODEL_NAME,
+        'image': TRYON_IMAGE_VARIANT,
+        'person': s3_key_from_url(user_img_url),
+        'items': sorted(
+            [int(c['clothId']), s3_key_from_url(c['imageUrl']), c.get('color'), c.get('category')]
+            for c in clothes
+        ),
+    }
+    digest = hashlib.sha256(json.dumps(material, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')).hexdigest()
+    return f"{RESULT_PREFIX}{digest}.png"
+
+def _result_exists(key):
+    try:
+        resources.s3_client.head_object(Bucket=resources.BUCKET_NAME, Key=key)
+        return True
+    except resources.s3_client.exceptions.ClientError:
+        return False
+
+def _complete(user_id, coord_id, job_id, key, owned=False, cached=False):
+    """生成済み画像を指してジョブを完了にする。保存先URLを返す
+
+    owned=True (ワーカー) の場合は受付中ジョブがこのジョブのままであること、owned=False (受付時のキャッシュヒット) の場合は
+    処理中 (期限内) のジョブが無いことを条件に書き込む (満たさなければ JobSuperseded)。
+    cached=True (キャッシュの再利用) は tryOnSuccessCount ではなく tryOnCacheHitCount を数える
+    """
+    s3_url = f"https://{resources.BUCKET_NAME}.s3.ap-northeast-1.amazonaws.com/{key}"
+    table = resources.coordinate_table
+    condition = Attr('tryOnJobId').eq(job_id) if owned else _admittable(int(time.time()))
+    counter = 'tryOnCacheHitCount' if cached else 'tryOnSuccessCount'
+    try:
+        table.update_item(
+            Key={'userId': user_id, 'createDatetime': coord_id},
+            UpdateExpression=f"SET tryOnStatus = :s, tryOnImageUrl = :u, tryOnJobId = :j, tryOnPhaseDurations = :p ADD {counter} :inc REMOVE tryOnLeaseExpiresAt",
+            ConditionExpression=condition,
+            ExpressionAttributeValues={':s': 'COMPLETED', ':u': s3_url, ':j': job_id, ':p': tracing.phase_durations(), ':inc': 1}
+        )
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        raise JobSuperseded(job_id)
+    return s3_url
+
+def _download_image_as_base64(url):
+    """画像を取得・正規化し、Gemini API用のBase64文字列とMIMEタイプを返す
+
+    自バケットの画像は S3 から直接読み、正規化済みの派生画像 (derived/tryon-.../) があればそれを使う。
+    無ければ元画像を正規化して派生キーに保存し、次回以降の試着で再利用する。
+    """
+    if resources.BUCKET_NAME and resources.BUCKET_NAME in url:
+        key = s3_key_from_url(url)
+        norm_key = images.derived_key(key, TRYON_IMAGE_VARIANT, TRYON_IMAGE_FORMAT)
+        try:
+            obj = resources.s3_client.get_object(Bucket=resources.BUCKET_NAME, Key=norm_key)
+            return base64.b64encode(obj['Body'].read()).decode('utf-8'), obj.get('ContentType') or images.MIME_TYPES[TRYON_IMAGE_FORMAT]
+        except resources.s3_client.exceptions.NoSuchKey:
+            pass
+        obj = resources.s3_client.get_object(Bucket=resources.BUCKET_NAME, Key=key)
+        content_type = obj.get('ContentType') or 'image/jpeg'
+        body = obj['Body'].read()
+    else:
+        norm_key = None
+        resp = http_client.get('download', url)
+        if resp.status_code != 200:
+            raise Exception(f"Failed to download image: {url}")
+        content_type = resp.headers.get('Content-Type', 'image/jpeg')
+        body = resp.content
+
+    try:
+        body, content_type = images.normalize_image(body, TRYON_IMAGE_MAX_EDGE, TRYON_IMAGE_QUALITY, TRYON_IMAGE_FORMAT)
+        if norm_key:
+            resources.s3_client.put_object(Bucket=resources.BUCKET_NAME, Key=norm_key, Body=body, ContentType=content_type)
+    except Exception as e:
+        # デコードできない形式などは元データのまま送る (Geminiは主要フォーマットに対応)
+        print(f"Image normalize skipped ({url}): {e}")
+
+    b64_data = base64.b64encode(body).decode('utf-8')
+    return b64_data, content_type
@@ -1,11 +1,11 @@
 import json
 import time
 from datetime import datetime, timedelta, timezone
-from boto3.dynamodb.conditions import Key
-import resources
-from utils.helpers import get_lat_long, sign_s3_url
+from repositories import user_repository
+from services import image_service
+from utils.helpers import get_lat_long, sign_s3_urls
 
-def register_user(event, headers):
+def register_user(event, headers, context):
     try:
         body = json.loads(event['body'])
         user_id = body.get('userId')
@@ -13,25 +13,10 @@ def register_user(event, headers):
         
         if not user_id: return {"statusCode": 400, "headers": headers, "body": json.dumps({"message": "userId is required"})}
 
-        existing_resp = resources.user_table.query(
-            KeyConditionExpression=Key('userId').eq(user_id)
-        )
-        existing_items = existing_resp.get('Items', [])
-        
-        for item in existing_items:
-            if item.get('deleteFlag', 0) == 0:
-                resources.user_table.update_item(
-                    Key={
-                        'userId': user_id, 
-                        'createDatetime': item['createDatetime']
-                    },
-                    UpdateExpression="set deleteFlag = :f",
-                    ExpressionAttributeValues={':f': 1}
-                )
-
         lat, lon = None, None
         if address:
-            lat, lon = get_lat_long(address)
+            # 住所が変わっていなければ現在のプロフィールの緯度経度を再利用する
+            lat, lon = get_lat_long(address, profile=lambda: user_repository.get_current_user(user_id))
 
         current_time = datetime.now(timezone(timedelta(hours=+9), 'JST')).strftime('%Y-%m-%dT%H:%M:%S')
         
@@ -50,7 +35,9 @@ def register_user(event, headers):
             'deleteFlag': 0
         }
         
-        resources.user_table.put_item(Item=item)
+        # 旧プロフィールの論理削除と新規保存は1トランザクションで行う
+        user_repository.save_user(item)
+        image_service.request_derivatives(context, 'user', user_id, item['imageLink'])
         return {"statusCode": 200, "headers": headers, "body": json.dumps({"message": "User saved", "data": item}, default=str, ensure_ascii=False)}
 
     except Exception as e:
@@ -63,24 +50,18 @@ def get_user(event, headers):
         user_id = params.get('userId')
         if not user_id: return {"statusCode": 400, "headers": headers, "body": json.dumps({"message": "userId is required"})}
 
-        resp = resources.user_table.query(
-            KeyConditionExpression=Key('userId').eq(user_id),
-            ScanIndexForward=False 
-        )
-        items = resp.get('Items', [])
-
-        active_user = None
-        for item in items:
-            if item.get('deleteFlag', 0) == 0:
-                active_user = item
-                break
+        active_user = user_repository.get_current_user(user_id)
 
         if not active_user:
             return {"statusCode": 404, "headers": headers, "body": json.dumps({"message": "User not found"})}
         
         # ★修正: imageLink は上書きせず、signedImageLink に署名付きを入れる
         if 'imageLink' in active_user:
-            active_user['signedImageLink'] = sign_s3_url(active_user['imageLink'])
+            # 表示用の縮小版 (medium) があれば signedThumbnailLink に入れる。無ければ元画像
+            thumb = image_service.variant_url(active_user['imageLink'], active_user.get('imageVariants'), 'medium')
+            active_user['signedImageLink'], active_user['signedThumbnailLink'] = sign_s3_urls(
+                [active_user['imageLink'], thumb or active_user['imageLink']]
+            )
             # active_user['imageLink'] は S3の生URL(https://bucket...) のまま残る
 
         return {"statusCode": 200, "headers": headers, "body": json.dumps(active_user, default=str, ensure_ascii=False)}
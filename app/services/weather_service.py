@@ -1,9 +1,15 @@
+import os
 import json
-import requests
-from datetime import datetime, timedelta, timezone
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
 from decimal import Decimal
 import resources
-from utils.helpers import get_lat_long
+from repositories import user_repository
+from utils import http_client
+from utils.helpers import JST, get_lat_long, get_target_date
+from utils.lru import LRUCache
 
 def get_weather(event, headers):
     try:
@@ -15,72 +21,190 @@ def get_weather(event, headers):
             return {"statusCode": 400, "headers": headers, "body": json.dumps({"message": "userId is required"})}
         
         # 緯度経度取得
-        lat_dec, lon_dec = get_lat_long(city_name)
+        lat_dec, lon_dec = get_lat_long(city_name, profile=lambda: user_repository.get_current_user(user_id))
         if not lat_dec:
             return {"statusCode": 404, "headers": headers, "body": json.dumps({"message": "Location not found"})}
 
         # 日付決定 (19時以降は明日)
-        JST = timezone(timedelta(hours=+9), 'JST')
         now_jst = datetime.now(JST)
-        target_date = now_jst + timedelta(days=1) if now_jst.hour >= 19 else now_jst
-        target_date_str = target_date.strftime('%Y-%m-%d')
+        target_date_str = get_target_date(now_jst)
 
-        # OpenWeatherMap API
-        url = f"https://api.openweathermap.org/data/2.5/forecast?lat={lat_dec}&lon={lon_dec}&appid={resources.WEATHER_API_KEY}&units=metric&lang=ja"
-        res = requests.get(url)
-        data = res.json()
-        
-        if res.status_code != 200:
-            return {"statusCode": res.status_code, "headers": headers, "body": json.dumps(data)}
-
-        # データ集計
-        temps, pops = [], []
-        weather_desc, icon_code = "", ""
-        humidity, wind_speed, wind_deg = 0, 0, 0
-        
-        for item in data['list']:
-            if target_date_str in item['dt_txt']:
-                temps.append(item['main']['temp_max'])
-                temps.append(item['main']['temp_min'])
-                pops.append(item.get('pop', 0))
-                # 代表的な時間帯(03:00 UTC = 12:00 JST)の天気を使用
-                if "03:00:00" in item['dt_txt']:
-                    weather_desc = item['weather'][0]['description']
-                    icon_code = item['weather'][0]['icon']
-                    humidity = item['main']['humidity']
-                    wind_speed = item['wind']['speed']
-                    wind_deg = item['wind']['deg']
-        
-        # データ不足時の補完
-        if not temps:
-             return {"statusCode": 404, "headers": headers, "body": json.dumps({"message": "Forecast not found"})}
-        if not weather_desc: # 03:00がない場合
-             first = [x for x in data['list'] if target_date_str in x['dt_txt']][0]
-             weather_desc = first['weather'][0]['description']
-             icon_code = first['weather'][0]['icon']
+        # 予報 (同じ格子・日付は共有キャッシュから)
+        forecast, error = get_forecast(lat_dec, lon_dec, target_date_str)
+        if error:
+            status_code, error_body = error
+            return {"statusCode": status_code, "headers": headers, "body": json.dumps(error_body)}
 
         # 保存と返却
-        item = {
-            'userId': user_id, 'targetDate': target_date_str, 
-            'latitude': lat_dec, 'longitude': lon_dec,
-            'weather': weather_desc, 
-            'iconUrl': f"https://openweathermap.org/img/wn/{icon_code}@2x.png" if icon_code else None,
-            'max': Decimal(str(max(temps))).quantize(Decimal("0.1")), 
-            'min': Decimal(str(min(temps))).quantize(Decimal("0.1")),
-            'humidity': Decimal(str(humidity)), 
-            'pop': Decimal(str(int(max(pops) * 100))),
-            'windSpeed': Decimal(str(wind_speed)).quantize(Decimal("0.1")), 
-            'windDirection': _get_wind_dir(wind_deg),
-            'city': city_name, 
-            'createDatetime': now_jst.strftime('%Y-%m-%dT%H:%M:%S'), 
-            'deleteFlag': 0
-        }
+        item = _build_weather_item(user_id, target_date_str, lat_dec, lon_dec, forecast, city_name, now_jst)
         resources.weather_table.put_item(Item=item)
         return {"statusCode": 200, "headers": headers, "body": json.dumps(item, default=str, ensure_ascii=False)}
 
     except Exception as e:
         return {"statusCode": 500, "headers": headers, "body": json.dumps({"message": "Error", "error": str(e)})}
 
+def _build_weather_item(user_id, target_date_str, lat_dec, lon_dec, forecast, city_name, now_jst):
+    return {
+        'userId': user_id, 'targetDate': target_date_str, 
+        'latitude': lat_dec, 'longitude': lon_dec,
+        'weather': forecast['weather'], 
+        'iconUrl': forecast['iconUrl'],
+        'max': forecast['max'], 
+        'min': forecast['min'],
+        'humidity': forecast['humidity'], 
+        'pop': forecast['pop'],
+        'windSpeed': forecast['windSpeed'], 
+        'windDirection': forecast['windDirection'],
+        'city': city_name, 
+        'createDatetime': now_jst.strftime('%Y-%m-%dT%H:%M:%S'), 
+        'deleteFlag': 0
+    }
+
+# --- 天気の事前取得バッチ (task: weather_batch) ---
+# 位置情報を登録済みの全ユーザーについて、翌日分の天気を WeatherTable に書き込んでおく。
+# 同じ格子のユーザーはまとめて1回だけ予報を取得する (get_forecast のキャッシュも共有)。
+BATCH_CONCURRENCY = int(os.environ.get('WEATHER_BATCH_CONCURRENCY', '8'))
+
+def prewarm_worker(event):
+    now_jst = datetime.now(JST)
+    target_date_str = event.get('targetDate') or get_target_date(now_jst)
+
+    cells = {}
+    for u in user_repository.iter_current_users(['userId', 'address', 'latitude', 'longitude']):
+        if u.get('latitude') is None or u.get('longitude') is None:
+            continue
+        cells.setdefault((u['latitude'], u['longitude']), []).append(u)
+    print(f"Weather batch started: {target_date_str}, {sum(len(v) for v in cells.values())} users / {len(cells)} cells")
+
+    forecasts, failed = {}, 0
+    with ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY) as pool:
+        futures = {pool.submit(get_forecast, lat, lon, target_date_str): (lat, lon) for lat, lon in cells}
+        for future in as_completed(futures):
+            cell = futures[future]
+            try:
+                forecast, error = future.result()
+            except Exception as e:
+                forecast, error = None, str(e)
+            if error:
+                failed += 1
+                print(f"Weather batch: forecast failed for {cell}: {error}")
+                continue
+            forecasts[cell] = forecast
+
+    written = 0
+    with resources.weather_table.batch_writer() as batch:
+        for cell, forecast in forecasts.items():
+            for u in cells[cell]:
+                batch.put_item(Item=_build_weather_item(
+                    u['userId'], target_date_str, cell[0], cell[1], forecast, u.get('address'), now_jst
+                ))
+                written += 1
+
+    result = {'targetDate': target_date_str, 'cells': len(cells), 'failedCells': failed, 'written': written}
+    print(f"Weather batch completed: {json.dumps(result)}")
+    return result
+
+# --- 予報キャッシュ ---
+# OpenWeatherMap の5日間予報は3時間刻みで更新されるため、同じ (緯度, 経度, 日付) の集計結果は
+# 次の3時間境界まで使い回す。ウォームコンテナ内のLRUと、コンテナ間で共有する CacheTable の2段構成。
+# (緯度経度は get_lat_long で小数2桁 = 約1km格子に丸め済み)
+FORECAST_CADENCE = 3 * 3600
+_forecast_cache = LRUCache(maxsize=256)
+# 参照元ごとの件数 (コンテナ起動からの累計)。事前取得のスレッドからも更新されるためロックで守る
+forecast_stats = {'memory': 0, 'dynamodb': 0, 'api': 0}
+_stats_lock = threading.Lock()
+
+def _forecast_expires_at(now_ts):
+    return (int(now_ts) // FORECAST_CADENCE + 1) * FORECAST_CADENCE
+
+def _record_forecast(source):
+    with _stats_lock:
+        forecast_stats[source] += 1
+
+def _forecast_key(lat, lon, target_date_str):
+    return f"forecast#{lat}#{lon}#{target_date_str}"
+
+def get_forecast(lat, lon, target_date_str):
+    """指定地点・日付の予報サマリーを返す。(forecast, None) または失敗時 (None, (statusCode, body))"""
+    key = _forecast_key(lat, lon, target_date_str)
+    forecast = _forecast_cache.get(key)
+    if forecast is not None:
+        _record_forecast('memory')
+        return forecast, None
+
+    now_ts = time.time()
+    try:
+        item = resources.cache_table.get_item(Key={'cacheKey': key}).get('Item')
+        if item and int(item['expiresAt']) > now_ts:
+            forecast = item['forecast']
+            _forecast_cache.set(key, forecast, ttl=int(item['expiresAt']) - now_ts)
+            _record_forecast('dynamodb')
+            return forecast, None
+    except Exception as e:
+        print(f"Forecast cache read error: {e}")
+
+    forecast, error = _fetch_forecast(lat, lon, target_date_str)
+    if error:
+        return None, error
+    _record_forecast('api')
+    print(f"DEBUG: Forecast fetched: {key} ({forecast_stats})")
+
+    expires_at = _forecast_expires_at(now_ts)
+    _forecast_cache.set(key, forecast, ttl=expires_at - now_ts)
+    try:
+        resources.cache_table.put_item(Item={'cacheKey': key, 'forecast': forecast, 'expiresAt': expires_at})
+    except Exception as e:
+        print(f"Forecast cache write error: {e}")
+    return forecast, None
+
+def _fetch_forecast(lat_dec, lon_dec, target_date_str):
+    # OpenWeatherMap API
+    res = http_client.get(
+        'weather', resources.OPENWEATHER_API_URL,
+        params={'lat': lat_dec, 'lon': lon_dec, 'appid': resources.WEATHER_API_KEY, 'units': 'metric', 'lang': 'ja'}
+    )
+    data = res.json()
+    
+    if res.status_code != 200:
+        return None, (res.status_code, data)
+
+    # データ集計
+    temps, pops = [], []
+    weather_desc, icon_code = "", ""
+    humidity, wind_speed, wind_deg = 0, 0, 0
+    
+    for item in data['list']:
+        if target_date_str in item['dt_txt']:
+            temps.append(item['main']['temp_max'])
+            temps.append(item['main']['temp_min'])
+            pops.append(item.get('pop', 0))
+            # 代表的な時間帯(03:00 UTC = 12:00 JST)の天気を使用
+            if "03:00:00" in item['dt_txt']:
+                weather_desc = item['weather'][0]['description']
+                icon_code = item['weather'][0]['icon']
+                humidity = item['main']['humidity']
+                wind_speed = item['wind']['speed']
+                wind_deg = item['wind']['deg']
+    
+    # データ不足時の補完
+    if not temps:
+         return None, (404, {"message": "Forecast not found"})
+    if not weather_desc: # 03:00がない場合
+         first = [x for x in data['list'] if target_date_str in x['dt_txt']][0]
+         weather_desc = first['weather'][0]['description']
+         icon_code = first['weather'][0]['icon']
+
+    return {
+        'weather': weather_desc,
+        'iconUrl': f"https://openweathermap.org/img/wn/{icon_code}@2x.png" if icon_code else None,
+        'max': Decimal(str(max(temps))).quantize(Decimal("0.1")),
+        'min': Decimal(str(min(temps))).quantize(Decimal("0.1")),
+        'humidity': Decimal(str(humidity)),
+        'pop': Decimal(str(int(max(pops) * 100))),
+        'windSpeed': Decimal(str(wind_speed)).quantize(Decimal("0.1")),
+        'windDirection': _get_wind_dir(wind_deg),
+    }, None
+
 def _get_wind_dir(degrees):
     directions = ["北", "北北東", "北東", "東北東", "東", "東南東", "南東", "南南東", "南", "南南西", "南西", "西南西", "西", "西北西", "北西", "北北西"]
     return directions[int((degrees + 11.25) / 22.5) % 16]
\ No newline at end of file
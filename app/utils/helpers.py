@@ -1,7 +1,49 @@
-import requests
+import time
+import threading
+import unicodedata
 from decimal import Decimal
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlparse, unquote
 import resources
+from utils import http_client, s3_signer, tracing
+from utils.lru import LRUCache
+
+def s3_key_from_url(image_url):
+    """S3オブジェクトURL (https://{bucket}.s3.{region}.amazonaws.com/{key}) からキーを取り出す"""
+    path = unquote(urlparse(image_url).path).lstrip('/')
+    if path.startswith(f"{resources.BUCKET_NAME}/"):
+        path = path[len(resources.BUCKET_NAME) + 1:]
+    return path
+
+def sign_s3_urls(image_urls):
+    """複数の画像URLをまとめて署名付きURLに変換する。入力と同じ順序のリストを返す。
+    自バケット以外のURLや空値はそのまま返す"""
+    results = list(image_urls)
+    targets = [
+        i for i, url in enumerate(results)
+        if url and isinstance(url, str) and resources.BUCKET_NAME and resources.BUCKET_NAME in url
+    ]
+    if not targets:
+        return results
+    keys = [s3_key_from_url(results[i]) for i in targets]
+    try:
+        signed = s3_signer.presign_get_objects(keys)
+    except Exception as e:
+        print(f"Batch Sign URL Error: {e}")
+        signed = []
+        for key, i in zip(keys, targets):
+            try:
+                signed.append(resources.s3_client.generate_presigned_url(
+                    ClientMethod='get_object',
+                    Params={'Bucket': resources.BUCKET_NAME, 'Key': key},
+                    ExpiresIn=3600
+                ))
+            except Exception as e:
+                print(f"Sign URL Error: {e}")
+                signed.append(results[i])
+    for i, url in zip(targets, signed):
+        results[i] = url
+    return results
 
 def sign_s3_url(image_url):
     if not image_url or not isinstance(image_url, str):
@@ -9,34 +51,118 @@ def sign_s3_url(image_url):
     if not resources.BUCKET_NAME or resources.BUCKET_NAME not in image_url:
         print(f"DEBUG: URL not signed (Bucket match fail): {image_url}") 
         return image_url
+    return sign_s3_urls([image_url])[0]
+
+# --- ジオコーディング (住所 -> 緯度経度) ---
+# 1. プロセス内LRU  2. ユーザープロフィールに保存済みの緯度経度  3. DynamoDB (CacheTable, TTL付き)
+# 4. Google Geocoding API の順に参照する
+GEOCODE_TTL = 30 * 24 * 3600
+GEOCODE_NEGATIVE_TTL = 600
+_geocode_cache = LRUCache(maxsize=512, ttl=GEOCODE_TTL)
+# 参照元ごとの件数 (コンテナ起動からの累計)。天気の事前取得ではスレッドから更新されるためロックで守る
+geocode_stats = {'memory': 0, 'profile': 0, 'dynamodb': 0, 'api': 0, 'miss': 0}
+_stats_lock = threading.Lock()
+
+def normalize_address(address):
+    """全角/半角・空白・大文字小文字の揺れを吸収したキャッシュキー用の住所"""
+    return ''.join(unicodedata.normalize('NFKC', address).split()).lower()
+
+def geocode_hit_rate():
+    total = sum(geocode_stats.values())
+    hits = geocode_stats['memory'] + geocode_stats['profile'] + geocode_stats['dynamodb']
+    return hits / total if total else 0.0
+
+def _record_geocode(source):
+    """参照元を数え、累計のヒット率を trace のメトリクスにする (1件ごとにはログ出力しない)"""
+    with _stats_lock:
+        geocode_stats[source] += 1
+        rate = geocode_hit_rate()
+    tracing.put_metric('geocodeHitRate', round(rate * 100, 1), 'Percent')
+
+def _geocode_from_table(key):
     try:
-        if not resources.s3_client:
-            resources.initialize()
-        file_key = image_url.split('/')[-1]
-        return resources.s3_client.generate_presigned_url(
-            ClientMethod='get_object',
-            Params={'Bucket': resources.BUCKET_NAME, 'Key': file_key},
-            ExpiresIn=3600
-        )
+        item = resources.cache_table.get_item(Key={'cacheKey': f"geocode#{key}"}).get('Item')
+        # TTL削除は遅延するため期限も確認する
+        if item and int(item.get('expiresAt', 0)) > time.time():
+            return item['latitude'], item['longitude']
     except Exception as e:
-        print(f"Sign URL Error: {e}")
-        return image_url
+        print(f"Geocode cache read error: {e}")
+    return None
 
-def get_lat_long(address):
-    if not resources.GOOGLE_API_KEY: return None, None
+def _save_geocode(key, lat, lon):
     try:
-        url = f"https://maps.googleapis.com/maps/api/geocode/json?address={address}&key={resources.GOOGLE_API_KEY}&language=ja"
-        res = requests.get(url)
+        resources.cache_table.put_item(Item={
+            'cacheKey': f"geocode#{key}", 'latitude': lat, 'longitude': lon,
+            'expiresAt': int(time.time()) + GEOCODE_TTL
+        })
+    except Exception as e:
+        print(f"Geocode cache write error: {e}")
+
+def get_lat_long(address, profile=None):
+    """住所の緯度経度 (小数2桁の Decimal) を返す。取得できなければ (None, None)
+
+    profile: ユーザープロフィール、またはそれを返す関数。住所が一致すれば保存済みの緯度経度を使う
+             (関数の場合はメモリキャッシュに無いときだけ呼ばれる)
+    """
+    if not address: return None, None
+    key = normalize_address(address)
+
+    cached = _geocode_cache.get(key)
+    if cached is not None:
+        _record_geocode('memory')
+        return cached
+
+    if callable(profile):
+        try:
+            profile = profile()
+        except Exception as e:
+            print(f"Geocode profile lookup error: {e}")
+            profile = None
+    if (profile and profile.get('latitude') is not None and profile.get('longitude') is not None
+            and profile.get('address') and normalize_address(profile['address']) == key):
+        result = (profile['latitude'], profile['longitude'])
+        _geocode_cache.set(key, result)
+        _record_geocode('profile')
+        return result
+
+    result = _geocode_from_table(key)
+    if result:
+        _geocode_cache.set(key, result)
+        _record_geocode('dynamodb')
+        return result
+
+    if not resources.GOOGLE_API_KEY:
+        _record_geocode('miss')
+        return None, None
+    try:
+        res = http_client.get(
+            'geocode', resources.GEOCODE_API_URL,
+            params={'address': address, 'key': resources.GOOGLE_API_KEY, 'language': 'ja'}
+        )
         data = res.json()
         if data['status'] == 'OK':
             loc = data['results'][0]['geometry']['location']
             lat = Decimal(str(loc['lat'])).quantize(Decimal("0.01"))
             lon = Decimal(str(loc['lng'])).quantize(Decimal("0.01"))
+            _geocode_cache.set(key, (lat, lon))
+            _save_geocode(key, lat, lon)
+            _record_geocode('api')
             return lat, lon
-    except:
-        pass
+        if data['status'] == 'ZERO_RESULTS':
+            # 存在しない住所は短時間だけメモリに覚えておく
+            _geocode_cache.set(key, (None, None), ttl=GEOCODE_NEGATIVE_TTL)
+    except Exception as e:
+        print(f"Geocode API error: {e}")
+    _record_geocode('miss')
     return None, None
 
+JST = timezone(timedelta(hours=+9), 'JST')
+
+def get_target_date(now_jst):
+    """提案・天気の対象日 (19時以降は翌日) を YYYY-MM-DD で返す"""
+    target_date = now_jst + timedelta(days=1) if now_jst.hour >= 19 else now_jst
+    return target_date.strftime('%Y-%m-%d')
+
 def get_current_season(date_str):
     dt = datetime.strptime(date_str, '%Y-%m-%d')
     m = dt.month
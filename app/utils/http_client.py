@@ -0,0 +1,94 @@
+import time
+import random
+import threading
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from utils import tracing
+
+# 外部API呼び出しの共通層。
+# ホストごとの Session (keep-alive の接続プール) をウォームコンテナ内で使い回し、
+# 連携先ごとのタイムアウト・リトライ (429/5xx, 指数バックオフ+ジッター)・所要時間の記録 (tracing の span) をまとめて行う。
+
+# 連携先 -> (connect, read) タイムアウト秒、最大リトライ回数、タイムアウト/接続エラーもリトライするか
+INTEGRATIONS = {
+    'geocode': {'timeout': (3.05, 5), 'retries': 2, 'retry_errors': True},
+    'weather': {'timeout': (3.05, 10), 'retries': 2, 'retry_errors': True},
+    # 画像生成は1回が長く高価なため、生成前に弾かれた応答 (429/5xx) のみ1回だけ再試行する
+    'gemini': {'timeout': (5, 110), 'retries': 1, 'retry_errors': False},
+    'download': {'timeout': (3.05, 20), 'retries': 2, 'retry_errors': True},
+}
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+BACKOFF_BASE = 0.2
+BACKOFF_CAP = 5.0
+POOL_MAXSIZE = 16
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+# 連携先ごとの呼び出し回数・失敗数・リトライ数・累計/最大所要時間(ms)
+stats = {}
+
+def _session(url):
+    parts = urlsplit(url)
+    origin = f"{parts.scheme}://{parts.netloc}"
+    session = _sessions.get(origin)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(origin)
+            if session is None:
+                session = requests.Session()
+                session.mount(origin, HTTPAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE))
+                _sessions[origin] = session
+    return session
+
+def _backoff(attempt, response=None):
+    """次の試行までの待ち時間 (full jitter)。Retry-After が秒数で返っていればそれを優先する"""
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    if retry_after and retry_after.isdigit():
+        return min(float(retry_after), BACKOFF_CAP)
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * (2 ** attempt)))
+
+def _record(integration, method, url, status, elapsed_ms, attempts):
+    entry = stats.setdefault(integration, {'calls': 0, 'errors': 0, 'retries': 0, 'totalMs': 0.0, 'maxMs': 0.0})
+    entry['calls'] += 1
+    entry['retries'] += attempts - 1
+    entry['totalMs'] += elapsed_ms
+    entry['maxMs'] = max(entry['maxMs'], elapsed_ms)
+    if status is None or status >= 400:
+        entry['errors'] += 1
+    tracing.add_span(
+        f"http.{integration}", elapsed_ms,
+        method=method, host=urlsplit(url).netloc, status=status, attempts=attempts
+    )
+
+def request(integration, method, url, **kwargs):
+    """連携先 integration の設定で HTTP リクエストを送り、requests.Response を返す
+
+    429/5xx は設定回数までリトライし、最後の応答をそのまま返す (ステータスの判定は呼び出し側)。
+    stream=True の場合、所要時間はヘッダー受信までを計る。
+    """
+    config = INTEGRATIONS[integration]
+    kwargs.setdefault('timeout', config['timeout'])
+    session = _session(url)
+    start = time.perf_counter()
+    attempt = 0
+    while True:
+        response = None
+        try:
+            response = session.request(method, url, **kwargs)
+            if response.status_code not in RETRY_STATUSES or attempt >= config['retries']:
+                _record(integration, method, url, response.status_code, (time.perf_counter() - start) * 1000, attempt + 1)
+                return response
+            response.close()
+        except (requests.ConnectionError, requests.Timeout):
+            if not config['retry_errors'] or attempt >= config['retries']:
+                _record(integration, method, url, None, (time.perf_counter() - start) * 1000, attempt + 1)
+                raise
+        time.sleep(_backoff(attempt, response))
+        attempt += 1
+
+def get(integration, url, **kwargs):
+    return request(integration, 'GET', url, **kwargs)
+
+def post(integration, url, **kwargs):
+    return request(integration, 'POST', url, **kwargs)
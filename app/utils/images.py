@@ -0,0 +1,58 @@
+import io
+import posixpath
+
+# 画像の正規化 (EXIF回転の適用・縮小・再エンコード)。
+# Pillow は import が重いため、使う関数の中で初めて import する。
+
+MIME_TYPES = {'JPEG': 'image/jpeg', 'WEBP': 'image/webp', 'PNG': 'image/png'}
+EXTENSIONS = {'JPEG': 'jpg', 'WEBP': 'webp', 'PNG': 'png'}
+
+# 一覧表示用の派生画像 (サイズ名 -> 長辺px)
+DERIVATIVE_SIZES = {'small': 256, 'medium': 640, 'large': 1280}
+
+def _open_rgb(data):
+    """デコードして EXIF の向きを反映した RGB 画像を返す (透過は白背景に合成。JPEG は透過非対応)"""
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as src:
+        img = ImageOps.exif_transpose(src)
+        if img.mode in ('RGBA', 'LA', 'P'):
+            img = img.convert('RGBA')
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            background.paste(img, mask=img.getchannel('A'))
+            return background
+        return img.convert('RGB') if img.mode != 'RGB' else img.copy()
+
+def _shrink(img, max_edge):
+    from PIL import Image
+
+    if max(img.size) <= max_edge:
+        return img
+    img = img.copy()
+    img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    return img
+
+def _encode(img, quality, fmt):
+    out = io.BytesIO()
+    img.save(out, fmt, quality=quality)
+    return out.getvalue(), MIME_TYPES[fmt]
+
+def normalize_image(data, max_edge, quality=85, fmt='JPEG'):
+    """画像バイト列をデコードし、EXIFの向きを反映して長辺 max_edge 以下に縮小、fmt で再エンコードする。
+    (bytes, MIMEタイプ) を返す"""
+    return _encode(_shrink(_open_rgb(data), max_edge), quality, fmt)
+
+def make_derivatives(data, sizes=DERIVATIVE_SIZES, quality=80, fmt='WEBP'):
+    """1回のデコードから複数サイズの派生画像を作る。{サイズ名: (bytes, MIMEタイプ)} を返す"""
+    img = _open_rgb(data)
+    # 大きい順に縮小していくと、小さいサイズほど縮小元の画素数が減って速い
+    results = {}
+    for name, edge in sorted(sizes.items(), key=lambda kv: -kv[1]):
+        img = _shrink(img, edge)
+        results[name] = _encode(img, quality, fmt)
+    return results
+
+def derived_key(key, variant, fmt='JPEG'):
+    """元画像キーから派生画像の S3 キーを作る (例: abc.jpg -> derived/<variant>/abc.jpg)"""
+    stem = posixpath.splitext(key)[0]
+    return f"derived/{variant}/{stem}.{EXTENSIONS[fmt]}"
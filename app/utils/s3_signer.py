@@ -0,0 +1,76 @@
+import os
+import hmac
+import time
+import hashlib
+from datetime import datetime, timezone
+from urllib.parse import quote
+import resources
+from utils.lru import LRUCache
+
+# 署名付きURLの有効期限と、キャッシュから再利用してよい期間 (残り15分を切ったら再署名)
+URL_EXPIRES_IN = 3600
+REUSE_MARGIN = 900
+
+_url_cache = LRUCache(maxsize=int(os.environ.get('SIGNED_URL_CACHE_SIZE', '4096')), ttl=URL_EXPIRES_IN - REUSE_MARGIN)
+# (secret_key, 日付) -> SigV4 派生署名鍵。日付が変わるまで使い回す
+_signing_keys = LRUCache(maxsize=4)
+_cache_owner = {'access_key': None}
+
+def _hmac(key, msg):
+    return hmac.new(key, msg.encode('utf-8'), hashlib.sha256).digest()
+
+def _signing_key(secret_key, date_stamp, region):
+    cache_key = (secret_key, date_stamp, region)
+    key = _signing_keys.get(cache_key)
+    if key is None:
+        key = _hmac(_hmac(_hmac(_hmac(('AWS4' + secret_key).encode('utf-8'), date_stamp), region), 's3'), 'aws4_request')
+        _signing_keys.set(cache_key, key)
+    return key
+
+def _presign_get(bucket, key, creds, region, now):
+    """get_object 用の SigV4 クエリ署名URLを生成する (botocore の generate_presigned_url と同じ形式)"""
+    amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+    date_stamp = amz_date[:8]
+    host = f"{bucket}.s3.{region}.amazonaws.com"
+    canonical_uri = '/' + quote(key, safe='/~')
+    scope = f"{date_stamp}/{region}/s3/aws4_request"
+
+    params = {
+        'X-Amz-Algorithm': 'AWS4-HMAC-SHA256',
+        'X-Amz-Credential': f"{creds.access_key}/{scope}",
+        'X-Amz-Date': amz_date,
+        'X-Amz-Expires': str(URL_EXPIRES_IN),
+        'X-Amz-SignedHeaders': 'host',
+    }
+    if creds.token:
+        params['X-Amz-Security-Token'] = creds.token
+    query = '&'.join(f"{quote(k, safe='-_.~')}={quote(v, safe='-_.~')}" for k, v in sorted(params.items()))
+
+    canonical_request = f"GET\n{canonical_uri}\n{query}\nhost:{host}\n\nhost\nUNSIGNED-PAYLOAD"
+    string_to_sign = f"AWS4-HMAC-SHA256\n{amz_date}\n{scope}\n{hashlib.sha256(canonical_request.encode('utf-8')).hexdigest()}"
+    signature = hmac.new(_signing_key(creds.secret_key, date_stamp, region), string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+    return f"https://{host}{canonical_uri}?{query}&X-Amz-Signature={signature}"
+
+def presign_get_objects(keys):
+    """S3キーのリストをまとめて署名し、同じ順序のURLリストを返す。
+
+    同一キーは有効期限の大半(45分)の間キャッシュから返す。認証情報が
+    切り替わった場合(アクセスキー変更)はキャッシュを破棄する。
+    """
+    creds = resources.credentials.get_frozen_credentials()
+    if _cache_owner['access_key'] != creds.access_key:
+        _url_cache.clear()
+        _cache_owner['access_key'] = creds.access_key
+
+    now = datetime.fromtimestamp(time.time(), timezone.utc)
+    urls = []
+    for key in keys:
+        url = _url_cache.get(key)
+        if url is None:
+            url = _presign_get(resources.BUCKET_NAME, key, creds, resources.REGION, now)
+            _url_cache.set(key, url)
+        urls.append(url)
+    return urls
+
+def cache_stats():
+    return {'size': len(_url_cache), 'hits': _url_cache.hits, 'misses': _url_cache.misses}
@@ -0,0 +1,166 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+# 軽量トレース。1回の呼び出し (API リクエスト / 非同期タスク) を trace、その中の
+# DynamoDB・S3・Lambda・外部HTTP・AI 呼び出しやワーカーの各フェーズを span として記録し、
+# 終了時に CloudWatch Embedded Metric Format (EMF) 互換の JSON を1行出力する。
+# Lambda のコンテナは同時に1呼び出ししか処理しないため、現在の trace はモジュール変数で持ち、
+# ワーカー内のスレッド (並列ダウンロード等) からの span も同じ trace に集計する。
+
+NAMESPACE = os.environ.get('TRACE_NAMESPACE', 'Coordii')
+# 1行に載せる個別 span の上限 (超えた分はカテゴリ別の合計にのみ反映する)
+MAX_SPANS = 100
+
+_lock = threading.Lock()
+_current = None
+
+class Trace:
+    def __init__(self, operation):
+        self.operation = operation
+        self.attrs = {}
+        self.spans = []
+        self.dropped = 0
+        # カテゴリ (span 名の '.' より前: dynamodb / s3 / http / openai ...) -> 合計ms
+        self.totals = {}
+        # フェーズ名 -> ms (lap で記録)
+        self.phases = {}
+        # 任意のメトリクス名 -> (値, 単位) (put_metric で記録)
+        self.metrics = {}
+        self.start = time.perf_counter()
+        self._lap_start = self.start
+
+    def add_span(self, name, elapsed_ms, **attrs):
+        category = name.split('.', 1)[0]
+        with _lock:
+            self.totals[category] = self.totals.get(category, 0.0) + elapsed_ms
+            if len(self.spans) < MAX_SPANS:
+                offset_ms = (time.perf_counter() - self.start) * 1000 - elapsed_ms
+                self.spans.append({'name': name, 'ms': round(elapsed_ms, 1), 'at': round(offset_ms, 1), **attrs})
+            else:
+                self.dropped += 1
+
+    def lap(self, phase):
+        """前回の lap (または trace 開始) からの経過時間をフェーズ phase の所要時間として記録する"""
+        now = time.perf_counter()
+        self.phases[phase] = round((now - self._lap_start) * 1000, 1)
+        self._lap_start = now
+
+    def phase_durations(self):
+        """DynamoDB に保存する用のフェーズ別所要時間 (整数ms)"""
+        return {phase: int(round(ms)) for phase, ms in self.phases.items()}
+
+    def emit(self, elapsed_ms):
+        metrics = {'Duration': round(elapsed_ms, 1)}
+        metrics.update({f"{category}Ms": round(ms, 1) for category, ms in self.totals.items()})
+        metrics.update({f"phase.{phase}Ms": ms for phase, ms in self.phases.items()})
+        units = dict.fromkeys(metrics, 'Milliseconds')
+        for name, (value, unit) in self.metrics.items():
+            metrics[name] = value
+            units[name] = unit
+        line = {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': NAMESPACE,
+                    'Dimensions': [['Operation']],
+                    'Metrics': [{'Name': name, 'Unit': units[name]} for name in metrics],
+                }],
+            },
+            'type': 'trace',
+            'Operation': self.operation,
+            **metrics,
+            **self.attrs,
+            'spans': self.spans,
+        }
+        if self.dropped:
+            line['droppedSpans'] = self.dropped
+        print(json.dumps(line, default=str, ensure_ascii=False))
+
+def current():
+    return _current
+
+@contextmanager
+def trace(operation, **attrs):
+    """1呼び出し分の trace。終了時 (例外時も) に集計を1行出力する"""
+    global _current
+    t = Trace(operation)
+    t.attrs.update(attrs)
+    previous, _current = _current, t
+    try:
+        yield t
+    except Exception as e:
+        t.attrs['error'] = type(e).__name__
+        raise
+    finally:
+        _current = previous
+        t.emit((time.perf_counter() - t.start) * 1000)
+
+def route_hook(method, pattern, status, elapsed_ms):
+    """Router のタイミングフック: trace の Operation をルートのパターン単位にし、ステータスを記録する"""
+    t = _current
+    if t is not None:
+        t.operation = f"{method} {pattern}"
+        t.attrs['status'] = status
+
+def add_span(name, elapsed_ms, **attrs):
+    """計測済みの span を現在の trace に記録する。trace 外なら単独で1行出力する"""
+    t = _current
+    if t is not None:
+        t.add_span(name, elapsed_ms, **attrs)
+    else:
+        print(json.dumps({'type': 'span', 'name': name, 'ms': round(elapsed_ms, 1), **attrs}, default=str))
+
+@contextmanager
+def span(name, **attrs):
+    start = time.perf_counter()
+    try:
+        yield attrs
+    except Exception as e:
+        attrs['error'] = type(e).__name__
+        raise
+    finally:
+        add_span(name, (time.perf_counter() - start) * 1000, **attrs)
+
+def lap(phase):
+    """現在の trace にフェーズの所要時間を記録する (trace 外では何もしない)"""
+    t = _current
+    if t is not None:
+        t.lap(phase)
+
+def put_metric(name, value, unit='Count'):
+    """現在の trace に任意のメトリクス (プロンプトのトークン数など) を記録する (trace 外では何もしない)"""
+    t = _current
+    if t is not None:
+        t.metrics[name] = (value, unit)
+
+def phase_durations():
+    t = _current
+    return t.phase_durations() if t is not None else {}
+
+# --- boto3 クライアントの計測 ---
+# before-call / after-call イベントで API 呼び出し1回ごとに span を記録する (リトライ込みの所要時間)
+
+def _before_call(context, **kwargs):
+    context['trace_start'] = time.perf_counter()
+
+def _after_call(model, context, http_response=None, exception=None, **kwargs):
+    start = context.pop('trace_start', None)
+    if start is None:
+        return
+    attrs = {}
+    if exception is not None:
+        attrs['error'] = type(exception).__name__
+    elif http_response is not None and http_response.status_code >= 400:
+        attrs['status'] = http_response.status_code
+    add_span(f"{model.service_model.endpoint_prefix}.{model.name}", (time.perf_counter() - start) * 1000, **attrs)
+
+def instrument_client(client):
+    """boto3 クライアント (リソースの場合は resource.meta.client) の API 呼び出しを span として記録する"""
+    events = client.meta.events
+    events.register('before-call.*.*', _before_call, unique_id='tracing-before-call')
+    events.register('after-call.*.*', _after_call, unique_id='tracing-after-call')
+    events.register('after-call-error.*.*', _after_call, unique_id='tracing-after-call-error')
+    return client
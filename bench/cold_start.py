@@ -0,0 +1,130 @@
+"""main.handler のルート別コールドスタート計測
+
+各ルートごとに新しい Python プロセスを起動し、
+  - import main にかかった時間
+  - そのルートが初回アクセスで生成したリソース (resources.init_timings)
+  - handler 呼び出し全体の時間
+を計測して表形式で出力する。
+
+AWS への実通信は行わない想定で、ダミー認証情報と到達不能なエンドポイントを設定する
+(DynamoDB Local 等を使う場合は --endpoint-url で上書き)。そのため handler 自体は
+DB アクセスで失敗して 500 を返すが、import と初期化の計測には影響しない。
+
+使い方:
+    python bench/cold_start.py [--repeat 3] [--endpoint-url http://localhost:8000]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app')
+
+ROUTES = [
+    ('OPTIONS', '/clothes', None, None),
+    ('GET', '/users', {'userId': 'bench-user'}, None),
+    ('POST', '/users', None, {'userId': 'bench-user'}),
+    ('GET', '/clothes', {'userId': 'bench-user'}, None),
+    ('POST', '/clothes', None, {'userId': 'bench-user', 'imageUrl': 'x', 'category': 'トップス'}),
+    ('POST', '/upload-url', None, {'fileType': 'jpg'}),
+    ('POST', '/analyze', None, {'imageUrl': 'https://example.com/a.jpg'}),
+    ('POST', '/weather', None, {'userId': 'bench-user'}),
+    ('POST', '/coordinates', None, {'userId': 'bench-user'}),
+    ('GET', '/coordinates', {'userId': 'bench-user'}, None),
+    ('GET', '/coordinates/status', {'userId': 'bench-user', 'coordinateId': 'x'}, None),
+    ('POST', '/try-on', None, {'userId': 'bench-user', 'coordinateId': 'x'}),
+    ('GET', '/try-on', {'userId': 'bench-user', 'coordinateId': 'x'}, None),
+]
+
+# 子プロセス側で実行するコード
+_CHILD = r'''
+import json, sys, time, io, contextlib
+t0 = time.perf_counter()
+import main
+import resources
+t1 = time.perf_counter()
+
+class Context:
+    function_name = 'coordii-bench'
+
+event = json.loads(sys.argv[1])
+with contextlib.redirect_stdout(io.StringIO()):
+    try:
+        res = main.handler(event, Context())
+        status = res.get('statusCode') if isinstance(res, dict) else None
+    except Exception as e:
+        status = type(e).__name__
+t2 = time.perf_counter()
+print(json.dumps({
+    'import_ms': (t1 - t0) * 1000,
+    'init_ms': {k: v * 1000 for k, v in resources.init_timings.items()},
+    'handler_ms': (t2 - t1) * 1000,
+    'status': status,
+}))
+'''
+
+def _event(method, path, query, body):
+    return {
+        'httpMethod': method,
+        'path': path,
+        'queryStringParameters': query,
+        'body': json.dumps(body, ensure_ascii=False) if body is not None else None,
+    }
+
+def _child_env(endpoint_url):
+    env = dict(os.environ)
+    env.setdefault('AWS_ACCESS_KEY_ID', 'bench')
+    env.setdefault('AWS_SECRET_ACCESS_KEY', 'bench')
+    env.setdefault('AWS_DEFAULT_REGION', 'ap-northeast-1')
+    env['AWS_ENDPOINT_URL'] = endpoint_url
+    env['AWS_MAX_ATTEMPTS'] = '1'
+    env['AWS_RETRY_MODE'] = 'standard'
+    for name in ('TABLE_USER', 'TABLE_CLOTH', 'TABLE_COORDINATE', 'TABLE_WEATHER', 'TABLE_CACHE', 'TABLE_BATCH'):
+        env.setdefault(name, f'bench-{name.lower()}')
+    env.setdefault('BUCKET_NAME', 'bench-bucket')
+    env.setdefault('OPENAI_API_KEY', 'bench')
+    env['PYTHONPATH'] = APP_DIR + os.pathsep + env.get('PYTHONPATH', '')
+    env['PYTHONDONTWRITEBYTECODE'] = '1'
+    return env
+
+def run_route(method, path, query, body, env):
+    proc = subprocess.run(
+        [sys.executable, '-c', _CHILD, json.dumps(_event(method, path, query, body))],
+        capture_output=True, text=True, env=env, cwd=APP_DIR
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr else 'child failed')
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=3, help='ルートごとの試行回数 (中央値を表示)')
+    parser.add_argument('--endpoint-url', default='http://127.0.0.1:9', help='AWS エンドポイント (既定は到達不能ポート)')
+    parser.add_argument('--json', action='store_true', help='結果を JSON で出力')
+    args = parser.parse_args()
+
+    env = _child_env(args.endpoint_url)
+    results = []
+    for method, path, query, body in ROUTES:
+        runs = [run_route(method, path, query, body, env) for _ in range(args.repeat)]
+        init_names = sorted({k for r in runs for k in r['init_ms']})
+        results.append({
+            'route': f'{method} {path}',
+            'import_ms': statistics.median(r['import_ms'] for r in runs),
+            'init_ms': statistics.median(sum(r['init_ms'].values()) for r in runs),
+            'handler_ms': statistics.median(r['handler_ms'] for r in runs),
+            'resources': init_names,
+        })
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return
+
+    print(f"{'route':<28}{'import(ms)':>12}{'init(ms)':>10}{'handler(ms)':>13}  resources")
+    for r in results:
+        print(f"{r['route']:<28}{r['import_ms']:>12.1f}{r['init_ms']:>10.1f}{r['handler_ms']:>13.1f}  {','.join(r['resources']) or '-'}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+"""ベンチマーク用の外部APIスタブ (OpenAI / Gemini / Google Geocoding / OpenWeatherMap / Lambda Invoke)
+
+1つの HTTP サーバーでパスによって振り分け、連携先ごとに設定した遅延 (秒) を挟んで応答する。
+呼び出し回数は連携先ごとに数える。Lambda の非同期 Invoke は受け付けた payload を
+on_invoke コールバックに渡す (ベンチマーク側で main.handler をワーカーとして実行する)。
+OpenAI の Batch API (Files のアップロード / Batches の作成・取得 / 結果ファイルの取得) も扱い、
+バッチは作成から latency['batch'] 秒後に batch_outcome の状態 (completed なら全件を Chat と同じ応答で処理済み、
+expired / failed なら結果なし) になる。
+
+app 側は以下の環境変数でスタブに向ける (env() が返す):
+    OPENAI_BASE_URL, GEMINI_API_BASE, GEOCODE_API_URL, OPENWEATHER_API_URL, AWS_ENDPOINT_URL_LAMBDA
+"""
+import base64
+import email.parser
+import email.policy
+import itertools
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_LATENCY = {'openai': 0.8, 'gemini': 3.0, 'geocode': 0.05, 'weather': 0.1, 'lambda': 0.0, 'batch': 0.0}
+
+# コーデ提案の応答で使うカテゴリコード (services/coord_prompt.CATEGORY_CODES) -> フィールド
+_SLOTS = {'O': 'outer_clothId', 'T': 'tops_clothId', 'B': 'bottoms_clothId', 'S': 'shoes_clothId'}
+# 服リストの行 "番号|カテゴリ|色|着用気温|特徴"
+_CLOSET_ROW = re.compile(r'^(\d+)\|([A-Z])\|', re.M)
+
+def parse_latency(spec):
+    """'openai=0.5,gemini=2' 形式の指定を DEFAULT_LATENCY に上書きした辞書を返す"""
+    latency = dict(DEFAULT_LATENCY)
+    for part in filter(None, (spec or '').split(',')):
+        name, value = part.split('=')
+        if name not in latency:
+            raise ValueError(f"unknown backend: {name}")
+        latency[name] = float(value)
+    return latency
+
+def _coordinate_reply(prompt):
+    picked = {}
+    for number, category in _CLOSET_ROW.findall(prompt):
+        field = _SLOTS.get(category)
+        if field and field not in picked:
+            picked[field] = int(number)
+    if 'tops_clothId' in picked:
+        picked['tops_clothId'] = [picked['tops_clothId']]
+    return dict(picked, reason="ベンチマーク用の固定応答です。")
+
+_ANALYZE_REPLY = {
+    "category": "トップス", "brand": "", "size": "M", "color": "ネイビー", "material": "綿",
+    "seasons": ["春", "秋"], "style": "カジュアル", "suitableMinTemp": 12, "suitableMaxTemp": 24,
+    "description": "ベンチマーク用の固定応答です。",
+}
+
+def _chat_completion(request):
+    content = request['messages'][0]['content']
+    prompt = content if isinstance(content, str) else ' '.join(p.get('text', '') for p in content)
+    reply = _coordinate_reply(prompt) if 'outer_clothId' in prompt else _ANALYZE_REPLY
+    return {
+        'id': 'chatcmpl-bench', 'object': 'chat.completion', 'created': int(time.time()),
+        'model': request.get('model'),
+        'choices': [{'index': 0, 'finish_reason': 'stop',
+                     'message': {'role': 'assistant', 'content': json.dumps(reply, ensure_ascii=False)}}],
+        'usage': {'prompt_tokens': len(prompt) // 2, 'completion_tokens': 60, 'total_tokens': len(prompt) // 2 + 60},
+    }
+
+def _multipart(content_type, body):
+    """multipart/form-data を {フィールド名: bytes} にする"""
+    message = email.parser.BytesParser(policy=email.policy.default).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode('ascii') + body
+    )
+    return {part.get_param('name', header='content-disposition'): part.get_payload(decode=True) for part in message.iter_parts()}
+
+def _forecast(now=None):
+    """現在 (UTC) の0時から6日分、3時間刻みの予報"""
+    start = (now or datetime.now(timezone.utc)).replace(hour=0, minute=0, second=0, microsecond=0)
+    items = []
+    for i in range(48):
+        t = start + timedelta(hours=3 * i)
+        items.append({
+            'dt_txt': t.strftime('%Y-%m-%d %H:%M:%S'),
+            'main': {'temp_max': 18 + (i % 8), 'temp_min': 10 + (i % 8), 'humidity': 60},
+            'weather': [{'description': '晴れ', 'icon': '01d'}],
+            'wind': {'speed': 3.2, 'deg': 200},
+            'pop': 0.1,
+        })
+    return {'list': items}
+
+class FakeBackends:
+    def __init__(self, latency=None, on_invoke=None, image_bytes=1024 * 1024):
+        self.latency = dict(DEFAULT_LATENCY, **(latency or {}))
+        self.on_invoke = on_invoke
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        # Batch API: 終了時の状態と、アップロードされたファイル・作成されたバッチ
+        self.batch_outcome = 'completed'
+        self.files = {}
+        self.batches = {}
+        self._ids = itertools.count(1)
+        # 生成画像の代わりに返すバイト列 (大きさだけ実物に近づける)
+        self._image_b64 = base64.b64encode(os.urandom(image_bytes)).decode('ascii')
+        self._forecast = json.dumps(_forecast()).encode('utf-8')
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler_class())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def env(self):
+        return {
+            'OPENAI_BASE_URL': f"{self.url}/v1",
+            'OPENAI_API_KEY': 'bench',
+            'GEMINI_API_BASE': self.url,
+            'GOOGLE_GENAI_KEY': 'bench',
+            'GEOCODE_API_URL': f"{self.url}/maps/api/geocode/json",
+            'GOOGLE_API_KEY': 'bench',
+            'OPENWEATHER_API_URL': f"{self.url}/data/2.5/forecast",
+            'OPENWEATHER_API_KEY': 'bench',
+            'AWS_ENDPOINT_URL_LAMBDA': self.url,
+        }
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _count(self, backend):
+        with self._lock:
+            self.calls[backend] += 1
+        delay = self.latency.get(backend, 0)
+        if delay:
+            time.sleep(delay)
+
+    def _new_id(self, prefix):
+        with self._lock:
+            return f"{prefix}-bench{next(self._ids)}"
+
+    def _add_file(self, data, filename, purpose):
+        file_id = self._new_id('file')
+        self.files[file_id] = data
+        return {'id': file_id, 'object': 'file', 'bytes': len(data), 'created_at': int(time.time()),
+                'filename': filename, 'purpose': purpose, 'status': 'processed'}
+
+    def _create_batch(self, request):
+        batch_id = self._new_id('batch')
+        self.batches[batch_id] = {
+            'id': batch_id, 'object': 'batch', 'endpoint': request['endpoint'], 'input_file_id': request['input_file_id'],
+            'completion_window': request['completion_window'], 'status': 'in_progress', 'created_at': int(time.time()),
+            'metadata': request.get('metadata'), 'output_file_id': None, 'error_file_id': None,
+            'request_counts': {'total': 0, 'completed': 0, 'failed': 0},
+            '_ready_at': time.time() + self.latency.get('batch', 0),
+        }
+        return self._batch_view(batch_id)
+
+    def _batch_view(self, batch_id):
+        batch = self.batches[batch_id]
+        if batch['status'] == 'in_progress' and time.time() >= batch['_ready_at']:
+            self._finish_batch(batch)
+        return {k: v for k, v in batch.items() if not k.startswith('_')}
+
+    def _finish_batch(self, batch):
+        requests = [json.loads(line) for line in self.files[batch['input_file_id']].splitlines() if line.strip()]
+        batch['request_counts']['total'] = len(requests)
+        batch['status'] = self.batch_outcome
+        if self.batch_outcome != 'completed':
+            return
+        lines = [json.dumps({
+            'id': f"batch_req_{i}", 'custom_id': r['custom_id'], 'error': None,
+            'response': {'status_code': 200, 'request_id': f"req_{i}", 'body': _chat_completion(r['body'])},
+        }, ensure_ascii=False) for i, r in enumerate(requests)]
+        output = self._add_file('\n'.join(lines).encode('utf-8'), 'output.jsonl', 'batch_output')
+        batch['output_file_id'] = output['id']
+        batch['request_counts']['completed'] = len(requests)
+
+    def _handler_class(self):
+        fakes = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _body(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                return self.rfile.read(length) if length else b''
+
+            def _send(self, status, body=b'', content_type='application/json'):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _json(self, data, status=200):
+                self._send(status, json.dumps(data, ensure_ascii=False).encode('utf-8'))
+
+            def do_GET(self):
+                path = self.path.split('?', 1)[0]
+                if path.startswith('/v1/batches/'):
+                    fakes._count('openai')
+                    batch_id = path.rsplit('/', 1)[1]
+                    if batch_id not in fakes.batches:
+                        return self._json({'error': {'message': 'not found'}}, 404)
+                    return self._json(fakes._batch_view(batch_id))
+                if path.startswith('/v1/files/') and path.endswith('/content'):
+                    fakes._count('openai')
+                    data = fakes.files.get(path.split('/')[3])
+                    if data is None:
+                        return self._json({'error': {'message': 'not found'}}, 404)
+                    return self._send(200, data, 'application/octet-stream')
+                if path == '/maps/api/geocode/json':
+                    fakes._count('geocode')
+                    return self._json({'status': 'OK', 'results': [{'geometry': {'location': {'lat': 33.5902, 'lng': 130.4017}}}]})
+                if path == '/data/2.5/forecast':
+                    fakes._count('weather')
+                    return self._send(200, fakes._forecast)
+                self._json({'message': 'not found'}, 404)
+
+            def do_POST(self):
+                path = self.path.split('?', 1)[0]
+                body = self._body()
+                if path.endswith('/chat/completions'):
+                    fakes._count('openai')
+                    return self._json(_chat_completion(json.loads(body)))
+                if path == '/v1/files':
+                    fakes._count('openai')
+                    fields = _multipart(self.headers['Content-Type'], body)
+                    return self._json(fakes._add_file(fields['file'], 'input.jsonl', fields['purpose'].decode()))
+                if path == '/v1/batches':
+                    fakes._count('openai')
+                    return self._json(fakes._create_batch(json.loads(body)))
+                if path.endswith(':generateContent'):
+                    fakes._count('gemini')
+                    body = json.dumps({'candidates': [{'content': {'parts': [
+                        {'text': 'generated'},
+                        {'inlineData': {'mimeType': 'image/png', 'data': fakes._image_b64}},
+                    ]}}]}).encode('utf-8')
+                    # Google API と同じく '/' と '=' をエスケープして返す
+                    return self._send(200, body.replace(b'/', b'\\/').replace(b'=', b'\\u003d'))
+                if path.startswith('/2015-03-31/functions/') and path.endswith('/invocations'):
+                    fakes._count('lambda')
+                    if fakes.on_invoke:
+                        fakes.on_invoke(json.loads(body))
+                    return self._send(202)
+                self._json({'message': 'not found'}, 404)
+
+        return Handler
@@ -0,0 +1,341 @@
+"""スケール検証用の合成データ生成 (UserTable / ClothTable / CoordinateTable / WeatherTable とバケット)
+
+服の数・論理削除された過去バージョン (update_cloth による履歴)・コーデ履歴の日数をパラメータで指定し、
+ヘビーユーザー相当のデータを作る。分布は実データに寄せている:
+  - カテゴリはトップスが多く小物・ワンピースは少なめ、種類ごとに着用可能気温と季節が決まる
+  - 有効な服1着あたり平均 --versions 件の論理削除済みバージョン、さらに --deleted-ratio の割合で削除済みの服
+  - コーデは1日1件 (--regen-ratio の割合で同じ日に作り直した行が増える)、一部は FAILED、
+    --tryon-ratio の割合で試着画像 (tryon/*.png) 付き
+  - 天気は日ごとに季節の気温カーブに沿って1件
+
+テーブル名は TABLE_* 環境変数、無ければ bench/stack.py と同じ "<prefix>-<論理名>"。
+--create でテーブル・バケットを作成する (moto サーバー / DynamoDB Local 向け)。
+
+使い方:
+    python bench/gen_data.py --endpoint-url http://127.0.0.1:5000 --create \
+        --users 3 --clothes 1000 --versions 2 --days 730 [--tryon-ratio 0.2] [--with-variants] [--no-images]
+"""
+import argparse
+import hashlib
+import io
+import math
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+import boto3
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'app'))
+
+import stack
+
+JST = timezone(timedelta(hours=9))
+CURRENT = 'CURRENT'
+SLOT_FIELDS = {'アウター': 'outer_clothId', 'トップス': 'tops_clothId', 'ボトムス': 'bottoms_clothId', 'シューズ': 'shoes_clothId'}
+
+# カテゴリ -> (出現比率, [(説明, 最低気温, 最高気温), ...])
+CATEGORY_PROFILES = {
+    'トップス': (0.34, [('半袖Tシャツ', 20, 35), ('長袖シャツ', 12, 26), ('ニット', 0, 16), ('スウェット', 5, 20), ('タンクトップ', 24, 38)]),
+    'ボトムス': (0.20, [('デニム', 3, 28), ('スラックス', 5, 28), ('ショートパンツ', 22, 38), ('スカート', 10, 32)]),
+    'アウター': (0.14, [('ダウンジャケット', -10, 8), ('ウールコート', -3, 12), ('トレンチコート', 8, 20), ('デニムジャケット', 12, 22)]),
+    'シューズ': (0.14, [('スニーカー', -5, 35), ('ブーツ', -10, 15), ('サンダル', 22, 38), ('ローファー', 5, 28)]),
+    'ワンピース': (0.08, [('ロングワンピース', 12, 30), ('ニットワンピース', 0, 15)]),
+    '小物': (0.10, [('マフラー', -10, 10), ('キャップ', 15, 38), ('トートバッグ', -10, 38)]),
+}
+COLORS = [('ブラック', 22), ('ホワイト', 18), ('ネイビー', 14), ('グレー', 12), ('ベージュ', 10),
+          ('ブラウン', 7), ('カーキ', 6), ('ブルー', 5), ('レッド', 3), ('グリーン', 3)]
+MATERIALS = ['綿', 'ポリエステル', 'ウール', 'ナイロン', 'リネン', 'レザー', 'デニム']
+STYLES = [('カジュアル', 50), ('きれいめ', 30), ('スポーティ', 12), ('フォーマル', 8)]
+WEEKLY_STYLES = ['オフィスカジュアル', 'カジュアル', 'きれいめ', 'アクティブ', 'リラックス', '']
+# 福岡市博多区
+LATITUDE, LONGITUDE = Decimal('33.5902'), Decimal('130.4017')
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+def _weighted(rng, pairs):
+    return rng.choices([v for v, _ in pairs], weights=[w for _, w in pairs])[0]
+
+def seasons_for(min_temp, max_temp):
+    """着用可能気温の範囲から季節を決める (get_current_season の季節名)"""
+    seasons = []
+    if max_temp >= 14 and min_temp <= 22:
+        seasons.append('春')
+    if max_temp >= 25:
+        seasons.append('夏')
+    if max_temp >= 12 and min_temp <= 20:
+        seasons.append('秋')
+    if min_temp <= 8:
+        seasons.append('冬')
+    return seasons or ['春', '秋']
+
+def daily_temperature(day, rng):
+    """日ごとの (最高, 最低) 気温。福岡付近の平年値に近いカーブ+日々の揺らぎ"""
+    mean = 17 + 10 * math.sin(2 * math.pi * (day.timetuple().tm_yday - 110) / 365)
+    mean += rng.gauss(0, 2.5)
+    return round(mean + 4 + rng.random() * 2), round(mean - 4 - rng.random() * 2)
+
+def _object_url(bucket, key):
+    return f"https://{bucket}.s3.{stack.REGION}.amazonaws.com/{key}"
+
+class ImagePool:
+    """カテゴリごとに数種類の画像を作っておき、服ごとのオブジェクトには使い回す (生成コストを抑える)"""
+
+    def __init__(self, variety, with_variants):
+        from PIL import Image, ImageDraw
+        self.images = {}
+        rng = random.Random('images')
+        for category in [*CATEGORY_PROFILES, 'profile']:
+            self.images[category] = []
+            for _ in range(variety):
+                size = (960, 1280) if category == 'profile' else (900, 1200)
+                img = Image.new('RGB', size, tuple(rng.randrange(160, 256) for _ in range(3)))
+                draw = ImageDraw.Draw(img)
+                for _ in range(12):
+                    x, y = rng.randrange(size[0]), rng.randrange(size[1])
+                    draw.ellipse((x, y, x + rng.randrange(80, 400), y + rng.randrange(80, 400)),
+                                 fill=tuple(rng.randrange(256) for _ in range(3)))
+                buf = io.BytesIO()
+                img.save(buf, 'JPEG', quality=85)
+                self.images[category].append(buf.getvalue())
+        # 試着結果 (PNG)。ノイズ入りで実物に近いサイズにする
+        noise = Image.effect_noise((768, 1024), 40).convert('RGB')
+        buf = io.BytesIO()
+        noise.save(buf, 'PNG')
+        self.tryon = buf.getvalue()
+
+        self.variants = {}
+        if with_variants:
+            from services import image_service
+            from utils import images
+            self.variant_format = image_service.DERIVATIVE_FORMAT
+            for category, datas in self.images.items():
+                self.variants[category] = [
+                    images.make_derivatives(data, images.DERIVATIVE_SIZES, image_service.DERIVATIVE_QUALITY, self.variant_format)
+                    for data in datas
+                ]
+
+    def pick(self, category, rng):
+        i = rng.randrange(len(self.images[category]))
+        return self.images[category][i], self.variants.get(category, [None] * (i + 1))[i]
+
+class Generator:
+    def __init__(self, dynamodb, s3, tables, bucket, args):
+        self.dynamodb = dynamodb
+        self.s3 = s3
+        self.tables = tables
+        self.bucket = bucket
+        self.args = args
+        self.pool = None if args.no_images else ImagePool(args.image_variety, args.with_variants)
+        self.uploads = ThreadPoolExecutor(max_workers=args.threads)
+        self._futures = []
+        self.counts = defaultdict(int)
+
+    def _put_object(self, key, body, content_type):
+        self.counts['objects'] += 1
+        self._futures.append(self.uploads.submit(self.s3.put_object, Bucket=self.bucket, Key=key, Body=body, ContentType=content_type))
+
+    def wait(self):
+        """投入済みのアップロードの完了を待つ (失敗があれば例外を送出)"""
+        futures, self._futures = self._futures, []
+        for f in futures:
+            f.result()
+
+    def _image(self, category, key, rng):
+        """画像オブジェクト (と派生画像) を置き、imageVariants の値を返す"""
+        if self.pool is None:
+            return None
+        data, variants = self.pool.pick(category, rng)
+        self._put_object(key, data, 'image/jpeg')
+        if variants:
+            from utils import images
+            for size, (body, content_type) in variants.items():
+                self._put_object(images.derived_key(key, size, self.pool.variant_format), body, content_type)
+        return list(variants) if variants else None
+
+    def user(self, index, now):
+        rng = random.Random(f"{self.args.seed}-{index}")
+        user_id = f"{self.args.user_prefix}-{index:05d}"
+        start = now - timedelta(days=self.args.days + 30)
+
+        # プロフィール (過去の版は論理削除済み)
+        table = self.dynamodb.Table(self.tables['UserTable'])
+        photo_key = f"{user_id}/profile-{index}.jpg"
+        variants = self._image('profile', photo_key, rng)
+        days = rng.sample(range(max(3, self.args.days)), rng.randint(1, 3))
+        versions = sorted(start + timedelta(days=d) for d in days)
+        with table.batch_writer() as batch:
+            for i, created in enumerate(versions):
+                item = {
+                    'userId': user_id, 'createDatetime': created.strftime('%Y-%m-%dT%H:%M:%S'),
+                    'gender': rng.choice(['female', 'male']), 'birthDay': f"{rng.randint(1970, 2005)}-0{rng.randint(1, 9)}-1{rng.randint(0, 9)}",
+                    'height': rng.randint(150, 185), 'address': '福岡市博多区',
+                    'latitude': LATITUDE, 'longitude': LONGITUDE,
+                    'weeklySchedule': {d: rng.choice(WEEKLY_STYLES) for d in WEEKDAYS},
+                    'imageLink': _object_url(self.bucket, photo_key),
+                    'updateDatetime': created.strftime('%Y-%m-%dT%H:%M:%S'),
+                    'deleteFlag': 0 if i == len(versions) - 1 else 1,
+                }
+                if variants:
+                    item['imageVariants'] = variants
+                batch.put_item(Item=item)
+            current = dict(item, createDatetime=CURRENT, versionDatetime=item['createDatetime'])
+            batch.put_item(Item=current)
+        self.counts['users'] += 1
+
+        active = self._closet(user_id, rng, start, now)
+        coordinates = self._history(user_id, rng, now, active)
+        self.wait()
+        return {'userId': user_id, 'imageUrl': _object_url(self.bucket, photo_key), 'coordinates': coordinates,
+                'clothes': {c: [i['clothId'] for i in items] for c, items in active.items()}}
+
+    def _closet(self, user_id, rng, start, now):
+        """有効な服 --clothes 着と、その過去バージョン・削除済みの服を書き込み、有効な服をカテゴリ別に返す"""
+        # app 側の resources は import 時に環境変数を読むため、モジュールの読み込み時には import しない
+        from repositories.cloth_repository import active_category
+        table = self.dynamodb.Table(self.tables['ClothTable'])
+        span_ms = int((now - start).total_seconds() * 1000)
+        start_ms = int(start.timestamp() * 1000)
+        categories = list(CATEGORY_PROFILES)
+        weights = [CATEGORY_PROFILES[c][0] for c in categories]
+        active = defaultdict(list)
+        n_deleted = int(self.args.clothes * self.args.deleted_ratio)
+        used_ids = set()
+        with table.batch_writer() as batch:
+            for n in range(self.args.clothes + n_deleted):
+                category = rng.choices(categories, weights=weights)[0]
+                kind, lo, hi = rng.choice(CATEGORY_PROFILES[category][1])
+                lo, hi = lo + rng.randint(-2, 2), hi + rng.randint(-2, 2)
+                base = {
+                    'userId': user_id, 'category': category, 'brand': rng.choice(['', '', 'UNIQLO', 'GU', 'ZARA', 'BEAMS']),
+                    'size': rng.choice(['S', 'M', 'M', 'L', 'フリー']), 'color': _weighted(rng, COLORS),
+                    'material': rng.choice(MATERIALS), 'seasons': seasons_for(lo, hi), 'style': _weighted(rng, STYLES),
+                    'suitableMinTemp': lo, 'suitableMaxTemp': hi, 'description': f"{kind}",
+                }
+                # 過去バージョン -> 最新版の順に時刻が進む (clothId は登録時刻のミリ秒)
+                n_versions = 1 + min(int(rng.expovariate(1 / self.args.versions)) if self.args.versions else 0, 20)
+                times = sorted(start_ms + rng.randrange(span_ms) for _ in range(n_versions))
+                key = f"{user_id}/{hashlib.md5(f'{user_id}-{n}'.encode()).hexdigest()}.jpg"
+                variants = self._image(category, key, rng)
+                for v, cloth_id in enumerate(times):
+                    while cloth_id in used_ids:
+                        cloth_id += 1
+                    used_ids.add(cloth_id)
+                    is_active = v == n_versions - 1 and n < self.args.clothes
+                    item = dict(base, clothId=cloth_id, imageUrl=_object_url(self.bucket, key),
+                                createDatetime=datetime.fromtimestamp(cloth_id / 1000, JST).strftime('%Y-%m-%dT%H:%M:%S'),
+                                deleteFlag=0 if is_active else 1)
+                    if is_active:
+                        item['activeCategory'] = active_category(item)
+                        active[category].append(item)
+                    if variants:
+                        item['imageVariants'] = variants
+                    batch.put_item(Item=item)
+                    self.counts['cloth_rows'] += 1
+        return active
+
+    def _history(self, user_id, rng, now, active):
+        """過去 --days 日分のコーデと天気を書き込み、コーデID (createDatetime) の一覧を返す"""
+        coord_table = self.dynamodb.Table(self.tables['CoordinateTable'])
+        weather_table = self.dynamodb.Table(self.tables['WeatherTable'])
+        coordinates = []
+        with coord_table.batch_writer() as coords, weather_table.batch_writer() as weather:
+            for d in range(self.args.days, 0, -1):
+                day = now - timedelta(days=d)
+                t_max, t_min = daily_temperature(day, rng)
+                target = day.strftime('%Y-%m-%d')
+                weather.put_item(Item={
+                    'userId': user_id, 'createDatetime': (day - timedelta(days=1)).strftime('%Y-%m-%dT19:30:00'),
+                    'targetDate': target, 'latitude': LATITUDE, 'longitude': LONGITUDE,
+                    'weather': rng.choice(['晴天', '曇りがち', '小雨', '薄い雲']), 'iconUrl': 'https://openweathermap.org/img/wn/01d@2x.png',
+                    'max': t_max, 'min': t_min, 'humidity': rng.randint(40, 90), 'pop': rng.choice([0, 0, 10, 30, 60]),
+                    'windSpeed': Decimal(f"{rng.uniform(0.5, 8):.1f}"), 'windDirection': rng.choice(['北', '南', '東', '西']),
+                    'city': '福岡市博多区', 'deleteFlag': 0,
+                })
+                for r in range(1 + (rng.random() < self.args.regen_ratio)):
+                    coord_id = day.replace(hour=7 + r, minute=rng.randrange(60), second=rng.randrange(60)).strftime('%Y-%m-%dT%H:%M:%S')
+                    item = {'userId': user_id, 'createDatetime': coord_id, 'targetDate': target,
+                            'jobId': hashlib.md5(coord_id.encode()).hexdigest(), 'deleteFlag': 0, 'anchorClothId': None}
+                    if rng.random() < self.args.fail_ratio:
+                        item.update(processStatus='FAILED', failReason='Timeout')
+                    else:
+                        item.update(processStatus='COMPLETED', reason='気温と予定に合わせた組み合わせです。')
+                        self._outfit(item, rng, active, t_max, t_min)
+                        if self.pool is not None and rng.random() < self.args.tryon_ratio:
+                            key = f"tryon/{hashlib.sha256(f'{user_id}-{coord_id}'.encode()).hexdigest()}.png"
+                            self._put_object(key, self.pool.tryon, 'image/png')
+                            item.update(tryOnStatus='COMPLETED', tryOnImageUrl=_object_url(self.bucket, key), tryOnSuccessCount=1)
+                    coords.put_item(Item=item)
+                    coordinates.append(coord_id)
+                    self.counts['coordinates'] += 1
+        return coordinates
+
+    @staticmethod
+    def _outfit(item, rng, active, t_max, t_min):
+        for category, field in SLOT_FIELDS.items():
+            candidates = [c for c in active.get(category, [])
+                          if c['suitableMinTemp'] <= t_max + 5 and c['suitableMaxTemp'] >= t_min - 5] or active.get(category, [])
+            if not candidates or (category == 'アウター' and t_min > 18):
+                continue
+            picked = rng.choice(candidates)['clothId']
+            item[field] = [picked] if field == 'tops_clothId' else picked
+
+def table_names(prefix):
+    return {logical: os.environ.get(env) or f"{prefix}-{logical}" for logical, (env, *_) in stack.TABLES.items()}
+
+def generate(args, endpoint_url=None, prefix='bench', bucket='bench-bucket'):
+    """args の設定でデータを投入し、ユーザーごとの状態 (ID・有効な服・コーデID) のリストと件数を返す"""
+    bucket = os.environ.get('BUCKET_NAME') or bucket
+    dynamodb = boto3.resource('dynamodb', region_name=stack.REGION, endpoint_url=endpoint_url)
+    s3 = boto3.client('s3', region_name=stack.REGION, endpoint_url=endpoint_url)
+    gen = Generator(dynamodb, s3, table_names(prefix), bucket, args)
+    now = datetime.now(JST).replace(microsecond=0)
+    try:
+        users = [gen.user(i, now) for i in range(args.users)]
+    finally:
+        gen.uploads.shutdown()
+    return users, dict(gen.counts)
+
+def add_arguments(parser):
+    """データ量のオプション (bench/loadtest.py と共通)"""
+    parser.add_argument('--users', type=int, default=3)
+    parser.add_argument('--clothes', type=int, default=100, help='ユーザーあたりの有効な服の数')
+    parser.add_argument('--versions', type=float, default=1.0, help='有効な服1着あたりの論理削除済みバージョン数 (平均)')
+    parser.add_argument('--deleted-ratio', type=float, default=0.2, help='有効な服に対する削除済みの服の割合')
+    parser.add_argument('--days', type=int, default=90, help='コーデ・天気の履歴日数')
+    parser.add_argument('--regen-ratio', type=float, default=0.15, help='同じ日にコーデを作り直した割合')
+    parser.add_argument('--fail-ratio', type=float, default=0.03, help='FAILED のコーデの割合')
+    parser.add_argument('--tryon-ratio', type=float, default=0.2, help='試着画像付きのコーデの割合')
+    parser.add_argument('--image-variety', type=int, default=4, help='カテゴリごとの画像の種類数')
+    parser.add_argument('--with-variants', action='store_true', help='派生画像 (サムネイル) も作成する')
+    parser.add_argument('--no-images', action='store_true', help='画像オブジェクトを作らない (テーブルのみ)')
+    parser.add_argument('--user-prefix', default='bench-user')
+    parser.add_argument('--seed', type=int, default=0, help='乱数シード')
+    parser.add_argument('--threads', type=int, default=8, help='S3 アップロードの並列数')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_arguments(parser)
+    parser.add_argument('--endpoint-url', help='AWS スタンドインのエンドポイント (省略時は実 AWS)')
+    parser.add_argument('--prefix', default='bench', help='TABLE_* 未設定時のテーブル名の接頭辞')
+    parser.add_argument('--bucket', default='bench-bucket', help='BUCKET_NAME 未設定時のバケット名')
+    parser.add_argument('--create', action='store_true', help='テーブルとバケットを作成する')
+    args = parser.parse_args()
+
+    if args.create:
+        stack.create_stack(args.endpoint_url, args.prefix, os.environ.get('BUCKET_NAME') or args.bucket)
+    start = time.perf_counter()
+    users, counts = generate(args, args.endpoint_url, args.prefix, args.bucket)
+    counts_text = ' '.join(f"{k}={v}" for k, v in sorted(counts.items()))
+    print(f"{counts_text} elapsed={time.perf_counter() - start:.1f}s")
+    for u in users:
+        active = sum(len(ids) for ids in u['clothes'].values())
+        print(f"{u['userId']}: active_clothes={active} coordinates={len(u['coordinates'])}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""試着画像レスポンスの逐次デコード (tryon_service._extract_inline_image) の確認
+
+Google API と同じく base64 の '=' を \\u003d、'/' を \\/ とエスケープした generateContent の
+レスポンスを作り、チャンクの大きさを 1 バイトから順に変えて (エスケープの途中で区切られる場合を含む)
+元のバイト列に復元できることを確かめる。想定外のエスケープが例外になることも確かめる。
+
+ネットワークは使わない。
+
+使い方:
+    python bench/inline_image.py [--bytes 254] [--max-chunk 64]
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'ap-northeast-1')
+
+from services import tryon_service
+
+def _body(data_field):
+    body = json.dumps({'candidates': [{'content': {'parts': [
+        {'text': 'generated'},
+        {'inlineData': {'mimeType': 'image/png', 'data': 'DATA'}},
+    ]}}]}).encode('utf-8')
+    return body.replace(b'DATA', data_field)
+
+def _escaped(b64):
+    return b64.replace(b'/', b'\\/').replace(b'=', b'\\u003d')
+
+def _chunks(body, size):
+    return [body[i:i + size] for i in range(0, len(body), size)]
+
+def _decode(body, size):
+    out = io.BytesIO()
+    tryon_service._extract_inline_image(_chunks(body, size), out)
+    return out.getvalue()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--bytes', type=int, default=254, help='画像の大きさ (3 の倍数でなければ base64 にパディングが付く)')
+    parser.add_argument('--max-chunk', type=int, default=64, help='試すチャンクの大きさの上限')
+    args = parser.parse_args()
+
+    image = os.urandom(args.bytes)
+    b64 = base64.b64encode(image)
+    bodies = {'plain': _body(b64), 'escaped': _body(_escaped(b64))}
+    failures = 0
+    for name, body in bodies.items():
+        for size in range(1, args.max_chunk + 1):
+            if _decode(body, size) != image:
+                print(f"NG {name} chunk={size}")
+                failures += 1
+
+    for bad in (b'\\n', b'\\"', b'\\u00e9', b'\\u00zz', b'\\u003'):
+        body = _body(b64[:-4] + bad + b64[-4:])
+        for size in range(1, args.max_chunk + 1):
+            try:
+                _decode(body, size)
+            except Exception:
+                continue
+            print(f"NG escape {bad!r} chunk={size} was accepted")
+            failures += 1
+
+    print(f"{'NG' if failures else 'OK'}: {args.bytes} bytes, chunk 1..{args.max_chunk}, {failures} failures")
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,281 @@
+"""main.handler のローカル負荷試験 (AWS / AI バックエンドはスタブ)
+
+DynamoDB・S3 は moto サーバー (または --endpoint-url で指定した DynamoDB Local 等)、
+OpenAI・Gemini・Geocoding・OpenWeatherMap・Lambda Invoke は bench/fakes.py のスタブサーバーに向け、
+全ルートの API Gateway イベントを並列に main.handler へ投げる。
+非同期 Invoke されたワーカー (coord_worker / try_on_worker / derivative_worker) は
+同一プロセス内のスレッドで実行し、キューが空になるまで待ってから集計する。
+
+出力:
+  - ルート / タスクごとの件数・ステータス・スループット・p50/p95/p99 レイテンシ
+  - メモリ最大使用量 (ru_maxrss。スタブサーバーを含むこのプロセス全体)
+  - バックエンドごとの呼び出し回数 (AWS API は操作単位、外部APIはスタブ側の受信数)
+
+使い方:
+    pip install -r bench/requirements.txt
+    python bench/loadtest.py [--requests 20] [--concurrency 8] [--warmup 1] [--users 5] [--clothes 50] [--days 30] \
+        [--latency openai=0.8,gemini=3,geocode=0.05,weather=0.1] [--routes 'GET /clothes,POST /coordinates'] [--json]
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import resource
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(BENCH_DIR, '..', 'app')
+sys.path.insert(0, BENCH_DIR)
+
+import gen_data
+import stack
+from fakes import FakeBackends, parse_latency
+
+CATEGORIES = list(gen_data.SLOT_FIELDS)
+
+class Context:
+    function_name = 'coordii-bench'
+
+    def __init__(self, timeout_ms=120000):
+        self._deadline = time.time() + timeout_ms / 1000
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self._deadline - time.time()) * 1000))
+
+def _event(method, path, query=None, body=None):
+    return {
+        'httpMethod': method,
+        'path': path,
+        'queryStringParameters': query,
+        'body': json.dumps(body, ensure_ascii=False) if body is not None else None,
+    }
+
+def _user_state(user):
+    """gen_data のユーザー情報に、PUT / DELETE /clothes で繰り返し使う服を加える"""
+    tops = user['clothes'].get('トップス') or [cid for ids in user['clothes'].values() for cid in ids]
+    return dict(user, spare=tops[-1])
+
+# ルート名 -> ユーザー状態からイベントを作る関数
+SCENARIOS = {
+    'OPTIONS /clothes': lambda s: _event('OPTIONS', '/clothes'),
+    'GET /users': lambda s: _event('GET', '/users', {'userId': s['userId']}),
+    'POST /users': lambda s: _event('POST', '/users', body={
+        'userId': s['userId'], 'gender': 'female', 'height': 160, 'address': '福岡市博多区', 'imageLink': s['imageUrl'],
+    }),
+    'GET /clothes': lambda s: _event('GET', '/clothes', {'userId': s['userId']}),
+    'GET /clothes?limit': lambda s: _event('GET', '/clothes', {'userId': s['userId'], 'limit': '20'}),
+    'POST /clothes': lambda s: _event('POST', '/clothes', body={
+        'userId': s['userId'], 'imageUrl': s['imageUrl'], 'category': random.choice(CATEGORIES), 'color': 'ブラック',
+    }),
+    'PUT /clothes': lambda s: _event('PUT', '/clothes', body={
+        'userId': s['userId'], 'clothId': s['spare'], 'imageUrl': s['imageUrl'], 'category': 'トップス', 'color': 'ホワイト',
+    }),
+    'DELETE /clothes': lambda s: _event('DELETE', '/clothes', body={'userId': s['userId'], 'clothId': s['spare']}),
+    'POST /upload-url': lambda s: _event('POST', '/upload-url', body={'fileType': 'jpg'}),
+    'POST /analyze': lambda s: _event('POST', '/analyze', body={'userId': s['userId'], 'imageUrl': s['imageUrl']}),
+    'POST /weather': lambda s: _event('POST', '/weather', body={'userId': s['userId'], 'city': '福岡市博多区'}),
+    'POST /coordinates': lambda s: _event('POST', '/coordinates', body={'userId': s['userId']}),
+    'POST /coordinates?fast': lambda s: _event('POST', '/coordinates', body={'userId': s['userId'], 'mode': 'fast'}),
+    'GET /coordinates': lambda s: _event('GET', '/coordinates', {'userId': s['userId']}),
+    'GET /coordinates/status': lambda s: _event('GET', '/coordinates/status', {
+        'userId': s['userId'], 'coordinateId': random.choice(s['coordinates']),
+    }),
+    'POST /try-on': lambda s: _event('POST', '/try-on', body={
+        'userId': s['userId'], 'coordinateId': random.choice(s['coordinates']),
+    }),
+    'GET /try-on': lambda s: _event('GET', '/try-on', {'userId': s['userId'], 'coordinateId': random.choice(s['coordinates'])}),
+}
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+def summarize(name, samples, wall):
+    durations = [ms for ms, _ in samples]
+    return {
+        'name': name,
+        'count': len(samples),
+        'statuses': dict(Counter(str(status) for _, status in samples)),
+        'rps': round(len(samples) / wall, 2) if wall else 0.0,
+        'p50_ms': round(percentile(durations, 50), 1),
+        'p95_ms': round(percentile(durations, 95), 1),
+        'p99_ms': round(percentile(durations, 99), 1),
+        'max_ms': round(max(durations), 1) if durations else 0.0,
+    }
+
+class Harness:
+    def __init__(self, main, concurrency, workers):
+        self.main = main
+        self.samples = defaultdict(list)
+        self._lock = threading.Lock()
+        self._requests = ThreadPoolExecutor(max_workers=concurrency)
+        self._tasks = ThreadPoolExecutor(max_workers=workers)
+        self._pending = 0
+        self._idle = threading.Condition(self._lock)
+
+    def _timed(self, name, event):
+        start = time.perf_counter()
+        try:
+            res = self.main.handler(event, Context())
+            status = res.get('statusCode') if isinstance(res, dict) else 'ok'
+        except Exception as e:
+            status = type(e).__name__
+        elapsed = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.samples[name].append((elapsed, status))
+
+    def invoke(self, payload):
+        """スタブの Lambda Invoke から呼ばれる: ワーカーを別スレッドで実行する"""
+        with self._lock:
+            self._pending += 1
+        self._tasks.submit(self._run_task, payload)
+
+    def _run_task(self, payload):
+        try:
+            self._timed(f"task {payload.get('task')}", payload)
+        finally:
+            with self._lock:
+                self._pending -= 1
+                if not self._pending:
+                    self._idle.notify_all()
+
+    def run(self, jobs):
+        futures = [self._requests.submit(self._timed, name, event) for name, event in jobs]
+        for f in futures:
+            f.result()
+
+    def drain(self, timeout):
+        with self._lock:
+            return self._idle.wait_for(lambda: not self._pending, timeout=timeout)
+
+    def shutdown(self):
+        self._requests.shutdown()
+        self._tasks.shutdown()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=20, help='ルートごとのリクエスト数')
+    parser.add_argument('--concurrency', type=int, default=8, help='同時に処理する API リクエスト数')
+    parser.add_argument('--workers', type=int, default=8, help='非同期ワーカーの同時実行数')
+    parser.add_argument('--latency', default='', help="スタブの遅延秒 (例: openai=0.8,gemini=3)")
+    parser.add_argument('--image-kb', type=int, default=1024, help='Gemini スタブが返す画像の大きさ (KB)')
+    parser.add_argument('--routes', default='', help="対象ルートをカンマ区切りで指定 (既定: 全ルート)")
+    parser.add_argument('--endpoint-url', help='既存の AWS スタンドイン (省略時は moto サーバーを起動)')
+    parser.add_argument('--warmup', type=int, default=1, help='計測前にルートごとに逐次実行する回数')
+    parser.add_argument('--drain-timeout', type=float, default=300, help='ワーカー完了待ちの上限秒')
+    parser.add_argument('--json', action='store_true', help='結果を JSON で出力')
+    # 投入データの量 (--users / --clothes / --versions / --days など) は gen_data と共通
+    gen_data.add_arguments(parser)
+    parser.set_defaults(users=5, clothes=50, days=30)
+    args = parser.parse_args()
+
+    routes = [r.strip() for r in args.routes.split(',') if r.strip()] or list(SCENARIOS)
+    unknown = [r for r in routes if r not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown routes: {', '.join(unknown)} (choose from: {', '.join(SCENARIOS)})")
+    random.seed(args.seed)
+
+    moto = None
+    endpoint = args.endpoint_url
+    if not endpoint:
+        moto, endpoint = stack.start_moto_server()
+    harness = None
+    fakes = FakeBackends(parse_latency(args.latency), on_invoke=lambda payload: harness.invoke(payload),
+                         image_bytes=args.image_kb * 1024).start()
+    try:
+        # app の import 前に環境変数を設定する (resources がモジュール読み込み時に参照するため)
+        os.environ.update(stack.bench_env(endpoint))
+        os.environ.update(fakes.env())
+        os.environ['AWS_MAX_ATTEMPTS'] = '1'
+        stack.create_stack(endpoint)
+        sys.path.insert(0, APP_DIR)
+        import main as app_main
+        from utils import tracing
+
+        # AWS API の呼び出し回数は tracing の span (dynamodb.Query, s3.GetObject ...) から数える
+        aws_calls = Counter()
+        calls_lock = threading.Lock()
+        add_span = tracing.add_span
+
+        def counting_add_span(name, elapsed_ms, **attrs):
+            if not name.startswith(('http.', 'openai.')):
+                with calls_lock:
+                    aws_calls[name] += 1
+            add_span(name, elapsed_ms, **attrs)
+
+        users, _ = gen_data.generate(args, endpoint)
+        state = [_user_state(u) for u in users]
+        tracing.add_span = counting_add_span
+
+        harness = Harness(app_main, args.concurrency, args.workers)
+        jobs = [(name, SCENARIOS[name](random.choice(state))) for name in routes for _ in range(args.requests)]
+        random.shuffle(jobs)
+
+        # アプリのログ (DEBUG 行・trace の JSON) は集計の邪魔になるため捨てる
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            # ウォームアップ (import・クライアント生成などの初回コストを計測から除く)
+            for name in routes:
+                for _ in range(args.warmup):
+                    harness.run([(name, SCENARIOS[name](random.choice(state)))])
+            harness.drain(args.drain_timeout)
+            harness.samples.clear()
+            aws_calls.clear()
+            fakes.calls.clear()
+
+            start = time.perf_counter()
+            harness.run(jobs)
+            api_wall = time.perf_counter() - start
+            drained = harness.drain(args.drain_timeout)
+            total_wall = time.perf_counter() - start
+        harness.shutdown()
+        tracing.add_span = add_span
+    finally:
+        fakes.stop()
+        if moto:
+            moto.terminate()
+            moto.wait()
+
+    routes_summary = [summarize(name, harness.samples[name], api_wall) for name in routes]
+    tasks_summary = [
+        summarize(name, samples, total_wall)
+        for name, samples in sorted(harness.samples.items()) if name.startswith('task ')
+    ]
+    result = {
+        'requests': len(jobs),
+        'concurrency': args.concurrency,
+        'apiWallSec': round(api_wall, 2),
+        'totalWallSec': round(total_wall, 2),
+        'throughputRps': round(len(jobs) / api_wall, 2) if api_wall else 0.0,
+        'drained': drained,
+        'maxRssMb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'routes': routes_summary,
+        'tasks': tasks_summary,
+        'awsCalls': dict(sorted(aws_calls.items())),
+        'externalCalls': dict(sorted(fakes.calls.items())),
+        'latency': fakes.latency,
+    }
+
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        return
+
+    print(f"requests={result['requests']} concurrency={args.concurrency} api={result['apiWallSec']}s "
+          f"total={result['totalWallSec']}s throughput={result['throughputRps']}req/s maxRSS={result['maxRssMb']}MB"
+          f"{'' if drained else ' (workers did not finish)'}")
+    print(f"\n{'route / task':<30}{'n':>6}{'rps':>8}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}  status")
+    for r in routes_summary + tasks_summary:
+        statuses = ','.join(f"{k}:{v}" for k, v in sorted(r['statuses'].items()))
+        print(f"{r['name']:<30}{r['count']:>6}{r['rps']:>8.1f}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['p99_ms']:>10.1f}  {statuses}")
+    print(f"\n{'backend':<36}{'calls':>8}")
+    for name, count in list(result['awsCalls'].items()) + list(result['externalCalls'].items()):
+        print(f"{name:<36}{count:>8}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""署名付きURL生成のマイクロベンチマーク
+
+N 件の画像キーについて、1件あたりの署名コストを以下の3方式で比較する。
+  - botocore : s3_client.generate_presigned_url を1件ずつ呼ぶ (従来の sign_s3_url)
+  - batch    : utils.helpers.sign_s3_urls でまとめて署名 (キャッシュ未使用時)
+  - cached   : 同じキーを再度 sign_s3_urls (キャッシュヒット時)
+
+ネットワークは使わない (ダミー認証情報で署名のみ行う)。
+
+使い方:
+    python bench/sign_urls.py [--count 300] [--rounds 5]
+"""
+import argparse
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'bench')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'bench')
+os.environ.setdefault('BUCKET_NAME', 'coordii-bench-bucket')
+
+import resources
+from utils import helpers, s3_signer
+
+def _per_url_us(fn, count, rounds):
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / count * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=300, help='1リクエストあたりの画像数')
+    parser.add_argument('--rounds', type=int, default=5, help='試行回数 (最速値を採用)')
+    args = parser.parse_args()
+
+    bucket = resources.BUCKET_NAME
+    keys = [f"{uuid.uuid4()}.jpg" for _ in range(args.count)]
+    urls = [f"https://{bucket}.s3.ap-northeast-1.amazonaws.com/{k}" for k in keys]
+    s3 = resources.s3_client
+    resources.credentials.get_frozen_credentials()
+
+    def botocore_path():
+        for key in keys:
+            s3.generate_presigned_url(ClientMethod='get_object', Params={'Bucket': bucket, 'Key': key}, ExpiresIn=3600)
+
+    def batch_path():
+        s3_signer._url_cache.clear()
+        helpers.sign_s3_urls(urls)
+
+    def cached_path():
+        helpers.sign_s3_urls(urls)
+
+    results = [
+        ('botocore', _per_url_us(botocore_path, args.count, args.rounds)),
+        ('batch', _per_url_us(batch_path, args.count, args.rounds)),
+    ]
+    helpers.sign_s3_urls(urls)
+    results.append(('cached', _per_url_us(cached_path, args.count, args.rounds)))
+
+    base = results[0][1]
+    print(f"{args.count} urls x {args.rounds} rounds")
+    for name, us in results:
+        print(f"{name:<10}{us:>10.1f} us/url{base / us:>8.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""ベンチマーク用の AWS スタンドイン (moto サーバー / DynamoDB Local 等) 上にテーブルとバケットを作る
+
+テーブル定義は template.yaml と揃えること (GSI・TTL を含む)。
+"""
+import socket
+import subprocess
+import sys
+import time
+
+import boto3
+
+# 論理名 -> (環境変数, キー定義, 属性定義, GSI)
+TABLES = {
+    'UserTable': ('TABLE_USER', [('userId', 'HASH'), ('createDatetime', 'RANGE')], {'userId': 'S', 'createDatetime': 'S'}, []),
+    'ClothTable': (
+        'TABLE_CLOTH', [('userId', 'HASH'), ('clothId', 'RANGE')],
+        {'userId': 'S', 'clothId': 'N', 'activeCategory': 'S'},
+        [('ActiveCategoryIndex', [('userId', 'HASH'), ('activeCategory', 'RANGE')])],
+    ),
+    'CoordinateTable': ('TABLE_COORDINATE', [('userId', 'HASH'), ('createDatetime', 'RANGE')], {'userId': 'S', 'createDatetime': 'S'}, []),
+    'WeatherTable': ('TABLE_WEATHER', [('userId', 'HASH'), ('createDatetime', 'RANGE')], {'userId': 'S', 'createDatetime': 'S'}, []),
+    'CacheTable': ('TABLE_CACHE', [('cacheKey', 'HASH')], {'cacheKey': 'S'}, []),
+    'BatchTable': ('TABLE_BATCH', [('batchId', 'HASH')], {'batchId': 'S'}, []),
+}
+TTL_ATTRIBUTES = {'CacheTable': 'expiresAt'}
+REGION = 'ap-northeast-1'
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_moto_server(port=None):
+    """moto のスタンドアロンサーバーを別プロセスで起動し、(Popen, エンドポイントURL) を返す
+
+    ベンチマーク対象プロセスのメモリ計測に含めないよう、同一プロセス内では動かさない。
+    """
+    port = port or free_port()
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'moto.server', '-H', '127.0.0.1', '-p', str(port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    endpoint = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return proc, endpoint
+        except OSError:
+            if proc.poll() is not None:
+                raise RuntimeError("moto server exited (pip install -r bench/requirements.txt)")
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError("moto server did not start")
+
+def table_names(prefix):
+    return {logical: f"{prefix}-{logical}" for logical in TABLES}
+
+def bench_env(endpoint_url, prefix='bench', bucket='bench-bucket'):
+    """app をスタンドインに向けるための環境変数 (AWS 関連のみ)"""
+    env = {
+        'AWS_ACCESS_KEY_ID': 'bench', 'AWS_SECRET_ACCESS_KEY': 'bench', 'AWS_DEFAULT_REGION': REGION,
+        'AWS_ENDPOINT_URL': endpoint_url, 'BUCKET_NAME': bucket,
+    }
+    for logical, name in table_names(prefix).items():
+        env[TABLES[logical][0]] = name
+    return env
+
+def create_stack(endpoint_url, prefix='bench', bucket='bench-bucket'):
+    """テーブル・バケットを (無ければ) 作成する"""
+    client = boto3.client('dynamodb', region_name=REGION, endpoint_url=endpoint_url)
+    existing = set(client.list_tables()['TableNames'])
+    for logical, name in table_names(prefix).items():
+        if name in existing:
+            continue
+        _, keys, attrs, indexes = TABLES[logical]
+        kwargs = {
+            'TableName': name,
+            'KeySchema': [{'AttributeName': a, 'KeyType': t} for a, t in keys],
+            'AttributeDefinitions': [{'AttributeName': a, 'AttributeType': t} for a, t in attrs.items()],
+            'BillingMode': 'PAY_PER_REQUEST',
+        }
+        if indexes:
+            kwargs['GlobalSecondaryIndexes'] = [
+                {'IndexName': index, 'KeySchema': [{'AttributeName': a, 'KeyType': t} for a, t in index_keys],
+                 'Projection': {'ProjectionType': 'ALL'}}
+                for index, index_keys in indexes
+            ]
+        client.create_table(**kwargs)
+        client.get_waiter('table_exists').wait(TableName=name)
+        if logical in TTL_ATTRIBUTES:
+            client.update_time_to_live(
+                TableName=name, TimeToLiveSpecification={'Enabled': True, 'AttributeName': TTL_ATTRIBUTES[logical]}
+            )
+
+    s3 = boto3.client('s3', region_name=REGION, endpoint_url=endpoint_url)
+    try:
+        s3.create_bucket(Bucket=bucket, CreateBucketConfiguration={'LocationConstraint': REGION})
+    except (s3.exceptions.BucketAlreadyOwnedByYou, s3.exceptions.BucketAlreadyExists):
+        pass
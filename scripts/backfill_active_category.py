@@ -0,0 +1,110 @@
+"""ClothTable の activeCategory バックフィル (ActiveCategoryIndex 導入用マイグレーション)
+
+既存の全行を走査し、
+  - 有効な行 (deleteFlag が 0 または未設定) : activeCategory = '<category (無ければ 未分類)>#<ゼロ埋めした clothId>'
+  - 論理削除済みの行                        : activeCategory を削除
+となるよう更新する。何度実行しても同じ結果になる。
+
+DynamoDB Local で試す場合:
+    java -Djava.library.path=./DynamoDBLocal_lib -jar DynamoDBLocal.jar -sharedDb
+    python scripts/backfill_active_category.py --table ClothTable \
+        --endpoint-url http://localhost:8000 --create-index
+
+--create-index を付けると、テーブルに GSI が無い場合に作成してから処理する
+(CloudFormation 管理のテーブルでは template.yaml 側で作成されるため不要)。
+"""
+import argparse
+import os
+import sys
+import time
+
+import boto3
+from boto3.dynamodb.conditions import Attr
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+from repositories.cloth_repository import ACTIVE_INDEX, active_category
+
+def ensure_index(client, table_name):
+    desc = client.describe_table(TableName=table_name)['Table']
+    if any(i['IndexName'] == ACTIVE_INDEX for i in desc.get('GlobalSecondaryIndexes', [])):
+        return
+    print(f"Creating {ACTIVE_INDEX} on {table_name} ...")
+    update = {
+        'Create': {
+            'IndexName': ACTIVE_INDEX,
+            'KeySchema': [
+                {'AttributeName': 'userId', 'KeyType': 'HASH'},
+                {'AttributeName': 'activeCategory', 'KeyType': 'RANGE'},
+            ],
+            'Projection': {'ProjectionType': 'ALL'},
+        }
+    }
+    if desc.get('BillingModeSummary', {}).get('BillingMode') != 'PAY_PER_REQUEST':
+        update['Create']['ProvisionedThroughput'] = {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
+    client.update_table(
+        TableName=table_name,
+        AttributeDefinitions=[
+            {'AttributeName': 'userId', 'AttributeType': 'S'},
+            {'AttributeName': 'activeCategory', 'AttributeType': 'S'},
+        ],
+        GlobalSecondaryIndexUpdates=[update],
+    )
+    while True:
+        indexes = client.describe_table(TableName=table_name)['Table'].get('GlobalSecondaryIndexes', [])
+        status = next((i['IndexStatus'] for i in indexes if i['IndexName'] == ACTIVE_INDEX), None)
+        if status == 'ACTIVE':
+            return
+        time.sleep(2)
+
+def backfill(table, dry_run=False):
+    scanned = updated = removed = 0
+    kwargs = {
+        'ProjectionExpression': '#u, #c, #cat, #d, #a',
+        'ExpressionAttributeNames': {'#u': 'userId', '#c': 'clothId', '#cat': 'category', '#d': 'deleteFlag', '#a': 'activeCategory'},
+    }
+    while True:
+        resp = table.scan(**kwargs)
+        for item in resp.get('Items', []):
+            scanned += 1
+            key = {'userId': item['userId'], 'clothId': item['clothId']}
+            if item.get('deleteFlag', 0) == 0:
+                expected = active_category(item)
+                if item.get('activeCategory') == expected:
+                    continue
+                updated += 1
+                if not dry_run:
+                    table.update_item(
+                        Key=key,
+                        UpdateExpression="set activeCategory = :a",
+                        ConditionExpression=Attr('clothId').exists(),
+                        ExpressionAttributeValues={':a': expected},
+                    )
+            elif 'activeCategory' in item:
+                removed += 1
+                if not dry_run:
+                    table.update_item(Key=key, UpdateExpression="remove activeCategory")
+        last_key = resp.get('LastEvaluatedKey')
+        if not last_key:
+            break
+        kwargs['ExclusiveStartKey'] = last_key
+    return scanned, updated, removed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--table', default=os.environ.get('TABLE_CLOTH'), help='ClothTable のテーブル名 (既定: $TABLE_CLOTH)')
+    parser.add_argument('--endpoint-url', default=None, help='DynamoDB Local 等のエンドポイント')
+    parser.add_argument('--region', default='ap-northeast-1')
+    parser.add_argument('--create-index', action='store_true', help='GSI が無ければ作成する')
+    parser.add_argument('--dry-run', action='store_true', help='更新せず件数のみ表示')
+    args = parser.parse_args()
+    if not args.table:
+        parser.error('--table is required')
+
+    dynamodb = boto3.resource('dynamodb', region_name=args.region, endpoint_url=args.endpoint_url)
+    if args.create_index:
+        ensure_index(dynamodb.meta.client, args.table)
+    scanned, updated, removed = backfill(dynamodb.Table(args.table), dry_run=args.dry_run)
+    print(f"scanned={scanned} set={updated} removed={removed}{' (dry-run)' if args.dry_run else ''}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""既存画像の派生画像 (サムネイル) バックフィル
+
+imageVariants を持たない有効な服 (ClothTable) とプロフィール (UserTable の CURRENT 行) について、
+デプロイ済み関数に {"task": "derivative_worker", ...} を非同期 (Event) で送り、派生画像を作らせる。
+作成済みの派生画像はワーカー側で再利用されるため、何度実行してもよい。
+
+    python scripts/backfill_derivatives.py --function-name <関数名> \
+        --cloth-table <ClothTable名> --user-table <UserTable名> [--dry-run]
+"""
+import argparse
+import json
+import os
+import sys
+
+import boto3
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+from repositories.user_repository import CURRENT
+
+def _scan(table, names):
+    kwargs = {
+        'ProjectionExpression': ', '.join(f"#p{i}" for i in range(len(names))),
+        'ExpressionAttributeNames': {f"#p{i}": n for i, n in enumerate(names)},
+    }
+    while True:
+        resp = table.scan(**kwargs)
+        yield from resp.get('Items', [])
+        last_key = resp.get('LastEvaluatedKey')
+        if not last_key:
+            return
+        kwargs['ExclusiveStartKey'] = last_key
+
+def pending_payloads(cloth_table, user_table):
+    for item in _scan(cloth_table, ['userId', 'clothId', 'imageUrl', 'deleteFlag', 'imageVariants']):
+        if item.get('deleteFlag', 0) == 0 and item.get('imageUrl') and not item.get('imageVariants'):
+            yield {'task': 'derivative_worker', 'target': 'cloth', 'userId': item['userId'],
+                   'clothId': int(item['clothId']), 'imageUrl': item['imageUrl']}
+    for item in _scan(user_table, ['userId', 'createDatetime', 'imageLink', 'imageVariants']):
+        if item['createDatetime'] == CURRENT and item.get('imageLink') and not item.get('imageVariants'):
+            yield {'task': 'derivative_worker', 'target': 'user', 'userId': item['userId'], 'imageUrl': item['imageLink']}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--function-name', required=True, help='CoordiiApiFunction の関数名')
+    parser.add_argument('--cloth-table', default=os.environ.get('TABLE_CLOTH'), help='既定: $TABLE_CLOTH')
+    parser.add_argument('--user-table', default=os.environ.get('TABLE_USER'), help='既定: $TABLE_USER')
+    parser.add_argument('--region', default='ap-northeast-1')
+    parser.add_argument('--dry-run', action='store_true', help='起動せず件数のみ表示')
+    args = parser.parse_args()
+    if not args.cloth_table or not args.user_table:
+        parser.error('--cloth-table and --user-table are required')
+
+    dynamodb = boto3.resource('dynamodb', region_name=args.region)
+    lambda_client = boto3.client('lambda', region_name=args.region)
+    count = 0
+    for payload in pending_payloads(dynamodb.Table(args.cloth_table), dynamodb.Table(args.user_table)):
+        count += 1
+        if not args.dry_run:
+            lambda_client.invoke(FunctionName=args.function_name, InvocationType='Event', Payload=json.dumps(payload))
+    print(f"requested={count}{' (dry-run)' if args.dry_run else ''}")
+
+if __name__ == '__main__':
+    main()